@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+"""
+API key hashing throughput.
+
+    python benchmarks/api_key_hashing.py
+
+Compares the unkeyed SHA-256 used by older versions, an HMAC built on every
+call, and the precomputed HMAC state copied per call used by app/libs/keys.py.
+"""
+import hashlib
+import hmac
+import os
+import sys
+import timeit
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../src"))
+from app.libs.keys import hash_api_key, verify_api_key  # noqa: E402
+
+NUMBER = 200000
+SECRET = b"benchmark-secret"
+API_KEY = str(uuid.uuid4())
+DIGEST = hash_api_key(API_KEY)
+
+
+def sha256_hexdigest():
+    return hashlib.sha256(API_KEY.encode("utf-8")).hexdigest()
+
+
+def hmac_per_call():
+    return hmac.new(SECRET, API_KEY.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+CASES = {
+    "sha256 (legacy)": sha256_hexdigest,
+    "hmac.new per call": hmac_per_call,
+    "precomputed hmac copy": lambda: hash_api_key(API_KEY),
+    "verify (copy + compare)": lambda: verify_api_key(API_KEY, DIGEST),
+}
+
+
+def main() -> None:
+    for name, function in CASES.items():
+        elapsed = min(timeit.repeat(function, number=NUMBER, repeat=3))
+        print(f"{name:<25} {NUMBER / elapsed:12,.0f} hashes/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""
+Batch requests: separate calls vs one "/api/v1/batch" request.
+
+    python benchmarks/batch.py [calls]
+
+Times the given number of "GET /api/v1/users/<id>" calls (100 by default)
+sent one by one, in a batch, and in a concurrent batch. The calls go through
+the Flask test client, so the saved HTTP and network overhead of a real
+deployment isn't included, only the per-request and authentication work.
+"""
+import json
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../src"))
+from app import create_app, db  # noqa: E402
+from app.libs.usage import usage  # noqa: E402
+from app.models import User  # noqa: E402
+
+HEADERS = {"Authorization": "Bearer superuser", "Content-Type": "application/json"}
+
+
+def main(calls: int) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_app(
+            database_uri=f"sqlite:///{directory}/batch.db",
+            config={
+                "RATE_LIMIT_ENABLED": False,
+                "RESPONSE_CACHE_ENABLED": False,
+                "BATCH_MAX_REQUESTS": calls,
+            },
+        )
+        with app.app_context():
+            users = [User(email=f"user{n}@batch.local") for n in range(calls)]
+            db.session.add_all(users)
+            db.session.commit()
+            paths = [f"/api/v1/users/{user.id}" for user in users]
+
+        client = app.test_client()
+
+        def one_by_one():
+            for path in paths:
+                assert client.get(path, headers=HEADERS).status_code == 200
+
+        def batch(concurrent):
+            payload = json.dumps(
+                {
+                    "requests": [{"method": "GET", "path": path} for path in paths],
+                    "concurrent": concurrent,
+                }
+            )
+            resp = client.post("/api/v1/batch", headers=HEADERS, data=payload)
+            assert resp.status_code == 200
+
+        for name, function in (
+            ("one by one", one_by_one),
+            ("batch", lambda: batch(False)),
+            ("concurrent batch", lambda: batch(True)),
+        ):
+            elapsed = min(timeit.repeat(function, number=1, repeat=5))
+            print(f"{calls} calls, {name:<17} {elapsed * 1000:8.1f} ms")
+        usage.flush()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""
+JWT token cache: "/api/v1/jwt-check" throughput with and without the cache.
+
+    python benchmarks/jwt_check.py [requests]
+
+Sends the given number of requests (2000 by default) with the same access
+token through the Flask test client, and times decode_token() alone.
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../src"))
+from flask_jwt_extended import create_access_token, decode_token  # noqa: E402
+
+from app import create_app  # noqa: E402
+from app.libs.usage import usage  # noqa: E402
+from app.models import User  # noqa: E402
+
+
+def main(requests: int) -> None:
+    for ttl in (0, 300):
+        app = create_app(
+            config={
+                "RATE_LIMIT_ENABLED": False,
+                "TOKEN_CACHE_TTL": ttl,
+                "JWT_SECRET_KEY": "benchmark-secret-key-of-32-bytes",
+            }
+        )
+        with app.test_request_context():
+            token = create_access_token(identity=User.query.one().id)
+            decode_number = requests * 10
+            elapsed = min(
+                timeit.repeat(lambda: decode_token(token), number=decode_number)
+            )
+            decode_rate = decode_number / elapsed
+
+        client = app.test_client()
+        headers = {"Authorization": f"Bearer {token}"}
+        elapsed = min(
+            timeit.repeat(
+                lambda: client.get("/api/v1/jwt-check", headers=headers),
+                number=requests,
+                repeat=3,
+            )
+        )
+        name = "cache" if ttl else "no cache"
+        print(
+            f"{name:<9} decode_token {decode_rate:10,.0f}/s"
+            f"   GET /jwt-check {requests / elapsed:8,.0f} requests/s"
+        )
+        usage.flush()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
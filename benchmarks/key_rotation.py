@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""
+Mass API key rotation throughput and memory use.
+
+    python benchmarks/key_rotation.py [users] [batch_size]
+
+Fills a temporary SQLite file with the given number of users (1M by default),
+then rotates all their keys through the "rotate-api-keys" endpoint and reports
+the time, the peak memory of the process and the streamed response size.
+"""
+import os
+import resource
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../src"))
+from app import create_app, db  # noqa: E402
+from app.libs.audit import audit  # noqa: E402
+from app.libs.keys import random_digest  # noqa: E402
+from app.libs.usage import usage  # noqa: E402
+from app.models import User  # noqa: E402
+
+BATCH_SIZE = 50000
+
+
+def fill(users: int) -> None:
+    rows = []
+    for n in range(users):
+        rows.append(
+            {
+                "id": str(uuid.uuid4()),
+                "email": f"user{n}@pytest.local",
+                "is_admin": False,
+                "is_active": True,
+                "hashed_api_key": random_digest(),
+            }
+        )
+        if len(rows) == BATCH_SIZE:
+            db.session.execute(User.__table__.insert(), rows)
+            rows = []
+    if rows:
+        db.session.execute(User.__table__.insert(), rows)
+    db.session.commit()
+
+
+def max_rss() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main(users: int, batch_size: int) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_app(
+            database_uri=f"sqlite:///{directory}/rotation.db",
+            config={
+                "RATE_LIMIT_ENABLED": False,
+                "KEY_ROTATION_BATCH_SIZE": batch_size,
+            },
+        )
+        with app.app_context():
+            fill(users)
+        print(f"{users} users, peak memory after filling {max_rss():.0f} MiB")
+
+        client = app.test_client()
+        start = time.perf_counter()
+        resp = client.post(
+            "/api/v1/users/rotate-api-keys",
+            headers={"Authorization": "Bearer superuser"},
+            buffered=False,
+        )
+        size, last_line = 0, b""
+        for data in resp.response:
+            size += len(data)
+            last_line = data
+        elapsed = time.perf_counter() - start
+        usage.flush()
+        audit.flush()
+
+        print(f"rotated in {elapsed:.1f}s ({users / elapsed:,.0f} users/s)")
+        print(f"streamed {size / 2**20:.1f} MiB, last line {last_line.strip()!r}")
+        print(f"peak memory {max_rss():.0f} MiB")
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 1000000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 5000,
+    )
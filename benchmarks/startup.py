@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+"""
+Import time and cold start benchmark.
+
+    python benchmarks/startup.py [runs]
+
+Reports the median of:
+    import:        a fresh interpreter importing "app"
+    cold start:    a fresh interpreter importing "app" and calling create_app()
+    create_app():  repeated in-process create_app() calls, as paid by each test
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC)
+
+SNIPPETS = {
+    "import": "import app",
+    "cold start": "import app; app.create_app(database_uri='sqlite://')",
+    "cold start (no db work)": "import app; app.create_app(database_uri='sqlite://', "
+    "config={'CREATE_SCHEMA': False, 'BOOTSTRAP_SUPERUSER': False})",
+}
+
+
+def run_subprocess(snippet: str) -> float:
+    code = (
+        "import time; start = time.perf_counter(); "
+        f"{snippet}; print(time.perf_counter() - start)"
+    )
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=SRC)
+    return float(output.decode().strip().splitlines()[-1])
+
+
+def main(runs: int) -> None:
+    for name, snippet in SNIPPETS.items():
+        timings = [run_subprocess(snippet) for _ in range(runs)]
+        print(f"{name:<25} {statistics.median(timings) * 1000:8.1f} ms")
+
+    from app import create_app
+
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        create_app(database_uri="sqlite://")
+        timings.append(time.perf_counter() - start)
+    print(f"{'create_app()':<25} {statistics.median(timings) * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+Compare the text and compact storage modes of the users table.
+
+    python benchmarks/storage.py [users]
+
+For each mode, fills a temporary SQLite file with the given number of users
+(1M by default) then reports the database and index sizes, and the time of
+lookups by id and by API key digest.
+"""
+import hashlib
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../src"))
+from app import create_app, db  # noqa: E402
+from app.models import User  # noqa: E402
+
+BATCH_SIZE = 50000
+LOOKUPS = 20000
+
+
+def fill(users: int):
+    ids, digests, rows = [], [], []
+    for n in range(users):
+        user_id = str(uuid.uuid4())
+        digest = hashlib.sha256(str(uuid.uuid4()).encode("utf-8")).hexdigest()
+        if n % (users // LOOKUPS or 1) == 0:
+            ids.append(user_id)
+            digests.append(digest)
+        rows.append(
+            {
+                "id": user_id,
+                "first_name": "json",
+                "last_name": "derulo",
+                "email": f"user{n}@pytest.local",
+                "is_admin": False,
+                "is_active": True,
+                "hashed_api_key": digest,
+            }
+        )
+        if len(rows) == BATCH_SIZE:
+            db.session.execute(User.__table__.insert(), rows)
+            rows = []
+    if rows:
+        db.session.execute(User.__table__.insert(), rows)
+    db.session.commit()
+    return ids, digests
+
+
+def time_lookups(column, values) -> float:
+    statement = db.select(User.__table__.c.id).where(column == db.bindparam("value"))
+    connection = db.session.connection()
+    random.shuffle(values)
+    start = time.perf_counter()
+    for value in values:
+        connection.execute(statement, {"value": value}).first()
+    return (time.perf_counter() - start) / len(values) * 1e6
+
+
+def run(mode: str, users: int, directory: str) -> None:
+    path = os.path.join(directory, f"{mode}.db")
+    app = create_app(
+        database_uri=f"sqlite:///{path}",
+        config={"COMPACT_STORAGE": mode == "compact", "BOOTSTRAP_SUPERUSER": False},
+    )
+    with app.app_context():
+        start = time.perf_counter()
+        ids, digests = fill(users)
+        elapsed = time.perf_counter() - start
+        print(f"\n{mode} storage, {users} users, filled in {elapsed:.0f}s")
+        print(f"  database file           {os.path.getsize(path) / 2**20:8.1f} MiB")
+
+        sizes = db.session.execute(
+            db.text(
+                "SELECT name, sum(pgsize) FROM dbstat WHERE name IN "
+                "(SELECT name FROM sqlite_master WHERE tbl_name = 'users') "
+                "GROUP BY name ORDER BY name"
+            )
+        )
+        for name, size in sizes:
+            print(f"  {name:<32} {size / 2**20:8.1f} MiB")
+
+        id_lookup = time_lookups(User.__table__.c.id, ids)
+        digest_lookup = time_lookups(User.__table__.c.hashed_api_key, digests)
+        print(f"  lookup by id             {id_lookup:8.1f} us")
+        print(f"  lookup by key digest     {digest_lookup:8.1f} us")
+
+
+def main(users: int) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in ("text", "compact"):
+            run(mode, users, directory)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Users list total: trigger maintained counter vs COUNT over the table.
+
+    python benchmarks/user_count.py [users]
+
+Fills a temporary SQLite file with the given number of users (3M by default),
+then times the total count both ways, and the first page of the users list
+with the counter (default) and with "exact=true".
+"""
+import os
+import sys
+import tempfile
+import time
+import timeit
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../src"))
+from app import create_app, db  # noqa: E402
+from app.libs.keys import random_digest  # noqa: E402
+from app.libs.usage import usage  # noqa: E402
+from app.models import User, count_users  # noqa: E402
+
+BATCH_SIZE = 50000
+
+
+def fill(users: int) -> None:
+    rows = []
+    for n in range(users):
+        rows.append(
+            {
+                "id": str(uuid.uuid4()),
+                "first_name": "json",
+                "last_name": "derulo",
+                "email": f"user{n}@pytest.local",
+                "is_admin": False,
+                "is_active": True,
+                "hashed_api_key": random_digest(),
+            }
+        )
+        if len(rows) == BATCH_SIZE:
+            db.session.execute(User.__table__.insert(), rows)
+            rows = []
+    if rows:
+        db.session.execute(User.__table__.insert(), rows)
+    db.session.commit()
+
+
+def report(name: str, function, number: int) -> None:
+    elapsed = min(timeit.repeat(function, number=number, repeat=3)) / number
+    print(f"  {name:<32} {elapsed * 1000:10.3f} ms")
+
+
+def main(users: int) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_app(
+            database_uri=f"sqlite:///{directory}/count.db",
+            config={"RATE_LIMIT_ENABLED": False, "RESPONSE_CACHE_ENABLED": False},
+        )
+        with app.app_context():
+            start = time.perf_counter()
+            fill(users)
+            elapsed = time.perf_counter() - start
+            print(f"{users} users, filled in {elapsed:.0f}s")
+
+            total = db.session.execute(db.select(db.func.count(User.id))).scalar()
+            assert count_users() == total
+
+            report(
+                "COUNT over the users",
+                lambda: db.session.execute(db.select(db.func.count(User.id))).scalar(),
+                5,
+            )
+            report("users counter", count_users, 1000)
+
+        client = app.test_client()
+        headers = {"Authorization": "Bearer superuser"}
+        for url in ("/api/v1/users", "/api/v1/users?exact=true"):
+            report(f"GET {url}", lambda: client.get(url, headers=headers), 5)
+        usage.flush()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 3000000)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""
+User payload validation throughput.
+
+    python benchmarks/validation.py
+
+Compares the hand written checks used by the create endpoint before the
+schema layer (with the email regex compiled on every call) to the compiled
+USER_SCHEMA, for valid and invalid payloads, and for a bulk payload.
+"""
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../src"))
+from app.v1.users.routes import USER_SCHEMA  # noqa: E402
+
+NUMBER = 100000
+
+VALID = {
+    "first_name": "json",
+    "last_name": "derulo",
+    "email": "json.derulo@pytest.local",
+    "is_admin": False,
+}
+INVALID = {"first_name": "json", "email": "json.derulo", "is_admin": "yes"}
+BULK = [dict(VALID, email=f"user{n}@pytest.local") for n in range(1000)]
+
+
+def previous_validation(data: dict):
+    first_name = data.get("first_name")
+    last_name = data.get("last_name")
+    email = data.get("email")
+
+    if not (email and first_name and last_name):
+        return "Missing required parameters"
+
+    email_pattern = re.compile(r"(^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$)")
+    if not email_pattern.match(email):
+        return "Invalid email format"
+    return None
+
+
+# Name: (function, payloads per call)
+CASES = {
+    "previous, valid": (lambda: previous_validation(VALID), 1),
+    "previous, invalid": (lambda: previous_validation(INVALID), 1),
+    "schema, valid": (lambda: USER_SCHEMA.validate(VALID), 1),
+    "schema, invalid": (lambda: USER_SCHEMA.validate(INVALID), 1),
+    "previous, bulk of 1000": (
+        lambda: [previous_validation(data) for data in BULK],
+        len(BULK),
+    ),
+    "schema, bulk of 1000": (lambda: USER_SCHEMA.validate_many(BULK), len(BULK)),
+}
+
+
+def main() -> None:
+    for name, (function, payloads) in CASES.items():
+        number = NUMBER // payloads
+        elapsed = min(timeit.repeat(function, number=number, repeat=3))
+        print(f"{name:<25} {number * payloads / elapsed:12,.0f} payloads/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,96 +3,253 @@ import logging
 import logging.handlers
 import os
 import sys
+from functools import lru_cache
+from typing import Optional
 
 # Third-party imports
 import toml
 
 # Flask imports
 from flask import Flask, jsonify
-from flask_jwt_extended import JWTManager
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.exc import SQLAlchemyError
 from werkzeug.exceptions import HTTPException
 
-# Load the settings TOML file dynamically regardless
+# Local imports
+from app.libs.replicas import RoutingSession
+from app.libs.tokens import jwt  # JWT lib, caches the verified tokens
+
+# Find the settings TOML files regardless
 # from where this code is being executed.
 file_path = os.path.abspath(__file__)
 install_path = os.path.dirname(os.path.dirname(file_path))
-with open(f"{install_path}/settings.toml", "r", encoding="utf8") as file:
-    settings = toml.load(file)
-
 
-# Setup logging
-DEBUG_MODE = settings["general"]["debug"]
 log = logging.getLogger()
 
-if DEBUG_MODE:
-    log.setLevel(logging.DEBUG)
-    formatter = logging.Formatter("App: %(levelname)s: [%(funcName)s] %(message)s")
-else:
-    log.setLevel(logging.INFO)
-    formatter = logging.Formatter("App: %(levelname)s: %(message)s")
+# Init database lib, the session routes the reads to the replicas if any
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+
+@lru_cache(maxsize=None)
+def get_settings() -> dict:
+    """
+    Load the settings once per process.
+
+    The values from "settings.toml" are laid over the defaults from
+    "settings.toml.default", so settings added in newer versions
+    don't break existing settings files.
+    """
+    with open(f"{install_path}/settings.toml.default", "r", encoding="utf8") as file:
+        settings = toml.load(file)
+
+    with open(f"{install_path}/settings.toml", "r", encoding="utf8") as file:
+        for section, values in toml.load(file).items():
+            settings.setdefault(section, {}).update(values)
+
+    return settings
+
+
+def __getattr__(name):
+    # Keeps "from app import settings" working without
+    # parsing the settings file at import time.
+    if name == "settings":
+        return get_settings()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def check_secrets(settings: dict) -> None:
+    """
+    Refuse to run with the secrets shipped in "settings.toml.default"
+    unless debug is enabled, raises RuntimeError.
+    """
+    if settings["debug"]:
+        return
+
+    with open(f"{install_path}/settings.toml.default", "r", encoding="utf8") as file:
+        defaults = toml.load(file)["general"]
+
+    unchanged = [
+        name
+        for name in ("secret_key", "api_key_secret", "superuser_api_key")
+        if settings[name] and settings[name] == defaults[name]
+    ]
+    if unchanged:
+        raise RuntimeError(
+            f'Set {" and ".join(unchanged)} in settings.toml, '
+            "the default values are only meant for development"
+        )
 
-if os.path.exists("/dev/log"):
-    handler = logging.handlers.SysLogHandler(address="/dev/log")
-    handler.setFormatter(formatter)
-    log.addHandler(handler)
 
-# This checks if the code is running interactively from
-# the terminal then prints the logs to standard out as well.
-# Otherwise the logs are written to the syslog only.
-if sys.stdout.isatty():
-    handler = logging.StreamHandler(sys.stdout)
-    handler.setFormatter(formatter)
-    log.addHandler(handler)
+@lru_cache(maxsize=None)
+def setup_logging(debug_mode: bool) -> None:
+    """
+    Setup the root logger, this only runs once per process.
+    """
+    if debug_mode:
+        log.setLevel(logging.DEBUG)
+        formatter = logging.Formatter("App: %(levelname)s: [%(funcName)s] %(message)s")
+    else:
+        log.setLevel(logging.INFO)
+        formatter = logging.Formatter("App: %(levelname)s: %(message)s")
 
-# Init database lib
-db = SQLAlchemy()
+    if os.path.exists("/dev/log"):
+        handler = logging.handlers.SysLogHandler(address="/dev/log")
+        handler.setFormatter(formatter)
+        log.addHandler(handler)
 
-# Init JWT lib
-jwt = JWTManager()
+    # This checks if the code is running interactively from
+    # the terminal then prints the logs to standard out as well.
+    # Otherwise the logs are written to the syslog only.
+    if sys.stdout.isatty():
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(formatter)
+        log.addHandler(handler)
 
 
-def create_app(database_uri=settings["general"]["sqlite_database_uri"]):
+def create_superuser() -> bool:
+    """
+    Create the initial superuser if the database has no users.
+    Returns True if the superuser was created.
+    """
+    from app.models import User
+
+    if db.session.execute(db.select(db.select(User.id).exists())).scalar():
+        return False
+
+    log.info("No users found, creating the initial superuser")
+    superuser_api_key = get_settings()["general"]["superuser_api_key"]
+
+    admin_user = User(
+        email="superuser@localhost",
+        is_admin=True,
+    )
+
+    if superuser_api_key:
+        admin_user.set_api_key(superuser_api_key)
+
+    try:
+        db.session.add(admin_user)
+        db.session.commit()
+        log.info(f'Superuser account "{admin_user.email}" has been created')
+        return True
+    except SQLAlchemyError as err:
+        db.session.rollback()
+        log.info("Failed creating the initial superuser, database err: %s", err)
+        return False
+
+
+def create_app(database_uri: Optional[str] = None, config: Optional[dict] = None):
+    """
+    Create the Flask app.
+
+    Any setting can be overridden with the "config" dict, for example
+    {"CREATE_SCHEMA": False} skips the startup database work when
+    the schema and superuser are managed with the CLI commands instead.
+    """
+    all_settings = get_settings()
+    settings = all_settings["general"]
+    setup_logging(settings["debug"])
+
     app = Flask(__name__)
-    app.config["SECRET_KEY"] = settings["general"]["secret_key"]
-    app.config["SQLALCHEMY_DATABASE_URI"] = database_uri
-    app.config["JWT_SECRET_KEY"] = settings["general"]["secret_key"]
-    app.config["JWT_ACCESS_TOKEN_EXPIRES"] = settings["general"]["jwt_expiration"]
+    app.config["SECRET_KEY"] = settings["secret_key"]
+    app.config["SQLALCHEMY_DATABASE_URI"] = (
+        database_uri or settings["sqlite_database_uri"]
+    )
+    app.config["JWT_SECRET_KEY"] = settings["secret_key"]
+    app.config["JWT_ACCESS_TOKEN_EXPIRES"] = settings["jwt_expiration"]
     app.config["JWT_ERROR_MESSAGE_KEY"] = "error"
+    app.config["COMPACT_STORAGE"] = settings["compact_storage"]
+    app.config["CREATE_SCHEMA"] = settings["create_schema"]
+    app.config["BOOTSTRAP_SUPERUSER"] = settings["bootstrap_superuser"]
+    app.config["LEGACY_API_KEY_DIGESTS"] = settings["legacy_api_key_digests"]
+    app.config["TRUSTED_PROXIES"] = settings["trusted_proxies"]
+
+    # The settings of the other sections ([usage], [rate_limit]...)
+    # are available as "<SECTION>_<NAME>" config keys.
+    for section, values in all_settings.items():
+        if section != "general":
+            for name, value in values.items():
+                app.config[f"{section}_{name}".upper()] = value
+
+    app.config.update(config or {})
+    # The read replicas are additional binds of the same models
+    app.config["SQLALCHEMY_BINDS"] = {
+        f"replica_{n}": uri for n, uri in enumerate(app.config["REPLICAS_URIS"])
+    }
     db.init_app(app)
     jwt.init_app(app)
 
+    from app.cli import register_commands
+    from app.libs.audit import audit as audit_log
+    from app.libs.batch import batch as batch_dispatcher
+    from app.libs.cache import response_cache
+    from app.libs.health import health
+    from app.libs.idempotency import idempotency
+    from app.libs.jobs import jobs as job_runner
+    from app.libs.keyfilter import key_filter
+    from app.libs.purger import purger
+    from app.libs.ratelimit import limiter
+    from app.libs.replicas import router
+    from app.libs.usage import usage
+    from app.libs.watchdog import watchdog
+    from app.v1.audit import audit
     from app.v1.auth import auth
+    from app.v1.batch import batch
     from app.v1.check import check
+    from app.v1.jobs import jobs
     from app.v1.users import users
 
     app.register_blueprint(check, url_prefix="/api/v1")
     app.register_blueprint(auth, url_prefix="/api/v1")
     app.register_blueprint(users, url_prefix="/api/v1/users")
+    app.register_blueprint(jobs, url_prefix="/api/v1/jobs")
+    app.register_blueprint(batch, url_prefix="/api/v1/batch")
+    app.register_blueprint(audit, url_prefix="/api/v1/audit-events")
+    register_commands(app)
+    limiter.init_app(app)
+    job_runner.init_app(app)
+    router.init_app(app)
+    response_cache.init_app(app)
+    batch_dispatcher.init_app(app)
+    health.init_app(app)
+    idempotency.init_app(app)
+    watchdog.init_app(app)
+    purger.init_app(app)
+    usage.init_app(
+        app,
+        app.config["USAGE_FLUSH_INTERVAL"],
+        app.config["USAGE_FLUSH_MAX_PENDING"],
+        app.config["USAGE_FLUSH_MAX_RETRIES"],
+    )
+    audit_log.init_app(
+        app,
+        app.config["AUDIT_FLUSH_INTERVAL"],
+        app.config["AUDIT_FLUSH_MAX_PENDING"],
+        app.config["AUDIT_FLUSH_MAX_RETRIES"],
+    )
 
     with app.app_context():
-        db.create_all()
-        from app.models import User
-
-        if User.query.count() == 0:
-            log.info("No users found, creating the initial superuser")
-            superuser_api_key = settings["general"]["superuser_api_key"]
+        # The storage mode is read by the column types in app/models.py
+        for engine in db.engines.values():
+            engine.dialect.compact_storage = app.config["COMPACT_STORAGE"]
 
-            admin_user = User(
-                email="superuser@localhost",
-                is_admin=True,
+        if app.config["CREATE_SCHEMA"]:
+            from app.models import (
+                check_storage_mode,
+                ensure_search_index,
+                ensure_soft_delete,
             )
 
-            if superuser_api_key:
-                admin_user.set_api_key(superuser_api_key)
+            # The replicas are copies of the primary database
+            ensure_soft_delete()
+            db.create_all(bind_key=None)
+            check_storage_mode()
+            ensure_search_index()
+
+        if app.config["BOOTSTRAP_SUPERUSER"]:
+            create_superuser()
 
-            try:
-                db.session.add(admin_user)
-                db.session.commit()
-                log.info(f'Superuser account "{admin_user.email}" has been created')
-            except SQLAlchemyError as err:
-                log.info("Failed creating the initial superuser, database err: %s", err)
+        key_filter.init_app(app)
 
     @app.errorhandler(HTTPException)
     def handle_http_exception(err):
@@ -0,0 +1,79 @@
+# Python imports
+import click
+
+# Local imports
+from app import create_superuser, db
+
+"""
+Maintenance commands, run them with the Flask CLI from the "src" directory:
+    flask --app "app:create_app(config={'CREATE_SCHEMA': False})" init-db
+"""
+
+
+def register_commands(app) -> None:
+    @app.cli.command("init-db")
+    def init_db():
+        """Create the database tables, indexes and triggers."""
+        from app.models import ensure_search_index, ensure_soft_delete
+
+        ensure_soft_delete()
+        db.create_all(bind_key=None)
+        ensure_search_index()
+        click.echo("Database schema is up to date")
+
+    @app.cli.command("create-superuser")
+    def create_superuser_command():
+        """Create the initial superuser if the database has no users."""
+        if create_superuser():
+            click.echo("Superuser account has been created")
+        else:
+            click.echo("Users already exist, nothing to do")
+
+    @app.cli.command("rebuild-search-index")
+    def rebuild_search_index_command():
+        """Rebuild the users full-text search index, needed after a VACUUM."""
+        from app.models import rebuild_search_index, search_index_supported
+
+        if not search_index_supported():
+            raise click.ClickException(
+                "SQLite lacks FTS5 or its trigram tokenizer, there is no search index"
+            )
+        rebuild_search_index()
+        click.echo("Search index has been rebuilt")
+
+    @app.cli.command("purge-deleted-users")
+    def purge_deleted_users_command():
+        """
+        Remove the soft deleted users now, in rate limited batches,
+        for instance from a cron job in a low traffic window.
+        Refused while a worker is purging them.
+        """
+        from app.libs.purger import purger
+
+        if not purger.claim():
+            raise click.ClickException(
+                "The deleted users are being purged by a worker, try again later"
+            )
+        try:
+            purged = purger.purge()
+        finally:
+            purger.release()
+        click.echo(f"{purged} deleted users have been purged")
+
+    @app.cli.command("migrate-storage")
+    @click.argument("target_uri")
+    @click.option(
+        "--compact/--text",
+        default=True,
+        help="Storage mode of the new database, compact by default.",
+    )
+    def migrate_storage_command(target_uri, compact):
+        """
+        Copy the database into TARGET_URI using the given storage mode.
+        Point sqlite_database_uri to the new database and set compact_storage
+        accordingly once done.
+        """
+        from app.models import copy_database
+
+        copy_database(target_uri, compact)
+        click.echo(f"Database has been copied to {target_uri}")
@@ -0,0 +1,60 @@
+# Python imports
+from datetime import datetime, timezone
+from typing import Optional
+
+# Local imports
+from app import db
+from app.libs import metrics
+from app.libs.writebehind import WriteBehindBuffer
+from app.models import AuditEvent
+
+"""
+Audit trail of the changes made through the API (users, API keys).
+
+The events are queued in memory once the change is committed, then inserted
+in batches into the "audit_events" table by a write-behind buffer, so the
+requests don't wait for an extra insert.
+
+This is a best-effort trail, not a guaranteed one: the events queued in
+a worker are written when it exits but lost if it's killed (SIGKILL, out of
+memory), and a batch failing to be inserted [audit] flush_max_retries times
+in a row is dropped. The lost events are counted in the "dropped" metric.
+"""
+
+
+class AuditLog(WriteBehindBuffer):
+    def empty(self):
+        return []
+
+    def merge(self, pending, event: dict) -> None:
+        pending.append(event)
+
+    def write(self, pending) -> None:
+        db.session.execute(db.insert(AuditEvent), pending)
+
+    def restore(self, pending, failed) -> None:
+        # Before the newer events, the ids follow the insertion order
+        pending[:0] = failed
+
+    def record(
+        self,
+        action: str,
+        actor_id: Optional[str],
+        target_id: Optional[str] = None,
+        details: Optional[dict] = None,
+        source_addr: Optional[str] = None,
+    ) -> None:
+        self.push(
+            {
+                "created_at": datetime.now(timezone.utc).replace(tzinfo=None),
+                "action": action,
+                "actor_id": actor_id,
+                "target_id": target_id,
+                "source_addr": source_addr,
+                "details": details,
+            }
+        )
+
+
+audit = AuditLog()
+metrics.register("audit", audit.stats)
@@ -0,0 +1,63 @@
+# Python imports
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+"""
+Background threads and thread pools, started lazily once per process.
+
+Threads don't survive a fork, and gunicorn forks the workers after the app
+is created. So the components start their threads from the process using
+them, on first use, and a forked child (worker) starts its own.
+"""
+
+
+class ProcessThread:
+    """A daemon thread running "target", started at most once per process."""
+
+    def __init__(self, target: Callable[[], None], name: str) -> None:
+        self.target = target
+        self.name = name
+        self._pid = None
+        self._lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def start(self) -> None:
+        if self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+
+        threading.Thread(target=self.target, name=self.name, daemon=True).start()
+
+    def _after_fork(self) -> None:
+        self._lock = threading.Lock()
+
+
+class ProcessExecutor:
+    """A thread pool, created at most once per process."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def get(self, max_workers: int) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(
+                    max_workers=max_workers, thread_name_prefix=self.name
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    def _after_fork(self) -> None:
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
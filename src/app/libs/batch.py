@@ -0,0 +1,191 @@
+# Python imports
+from typing import List, Optional, Tuple
+
+# Flask imports
+from flask import current_app, g, request
+from werkzeug.datastructures import Headers
+
+# Local imports
+from app import db, log
+from app.libs import metrics
+from app.libs.background import ProcessExecutor
+from app.libs.keys import parse_api_key
+from app.libs.replicas import router
+from app.models import ApiKey, User
+
+"""
+Batch requests, many API calls in one HTTP round trip.
+
+The sub-requests go through the app URL map and views like regular requests
+(rate limiting, decorators, error handlers), each one in its own app and
+request context, so it gets its own database session and "g".
+The batch request is authenticated once, the sub-requests skip the API key
+lookup and hashing. Each one reloads the caller from the primary instead,
+once the caller's record changed (deactivated, deleted, demoted or promoted,
+keys revoked) the remaining ones aren't run. They all use the batch request
+credentials and source address, and each one takes a rate limit token.
+
+With "concurrent", consecutive GET sub-requests run at once in a thread pool
+of [batch] workers threads, the others run one after another, in order.
+"""
+
+# Only these sub-requests may run concurrently
+READ_METHODS = ("GET",)
+
+# Headers of the batch request used by all the sub-requests, never their own
+FORWARDED_HEADERS = ("Authorization", "X-Forwarded-For")
+
+# Result of the sub-requests not run, the caller's record changed
+CREDENTIALS_CHANGED = {
+    "status": 403,
+    "headers": {},
+    "body": {"error": "The batch request credentials changed"},
+}
+
+# Not returned with the sub-request responses
+DROPPED_HEADERS = ("Content-Length", "Content-Type")
+
+
+def _load_caller(user_id: str, key_id: Optional[str]) -> Tuple[Optional[User], tuple]:
+    """
+    Load the caller from the primary, returns it along with its record fields
+    the credentials depend on.
+    """
+    with router.reading_from_replica(False):
+        user = db.session.get(User, user_id, populate_existing=True)
+        if user is None:
+            return None, ()
+
+        hashed_secret = None
+        if key_id:
+            hashed_secret = db.session.execute(
+                db.select(ApiKey.hashed_secret).where(
+                    ApiKey.key_id == key_id, ApiKey.user_id == user_id
+                )
+            ).scalar()
+    state = (user.is_active, user.is_admin, user.deleted_at, user.hashed_api_key)
+    return user, (*state, hashed_secret)
+
+
+class BatchDispatcher:
+    def __init__(self) -> None:
+        self.max_requests = 0
+        self.workers = 0
+        self._executor = ProcessExecutor("batch")
+        self._stats = {"batches": 0, "requests": 0, "concurrent": 0, "errors": 0}
+
+    def init_app(self, app) -> None:
+        self.max_requests = app.config["BATCH_MAX_REQUESTS"]
+        self.workers = app.config["BATCH_WORKERS"]
+
+    def dispatch(self, items: List[dict], user, concurrent: bool = False) -> list:
+        """
+        Run the sub-requests ({"method", "path", "headers", "body"}) as the
+        given user, returns their results in the same order.
+        """
+        app = current_app._get_current_object()
+        api_key = request.headers.get("Authorization", "").split("Bearer ")[-1]
+        parsed_api_key = parse_api_key(api_key.strip())
+        key_id = parsed_api_key[0] if parsed_api_key else None
+        base = {
+            "caller": (user.id, key_id, _load_caller(user.id, key_id)[1]),
+            "changed": False,
+            "base_url": request.root_url,
+            "environ_base": {"REMOTE_ADDR": request.remote_addr or "127.0.0.1"},
+            "headers": [
+                (name, request.headers[name])
+                for name in FORWARDED_HEADERS
+                if name in request.headers
+            ],
+        }
+
+        results, reads = [], []
+        for item in items:
+            if concurrent and self.workers and item["method"] in READ_METHODS:
+                reads.append(item)
+                continue
+
+            results.extend(self._run_reads(app, base, reads))
+            reads = []
+            results.append(self._run(app, base, item))
+        results.extend(self._run_reads(app, base, reads))
+
+        self._stats["batches"] += 1
+        self._stats["requests"] += len(items)
+        return results
+
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            "max_requests": self.max_requests,
+            "workers": self.workers,
+        }
+
+    def _run_reads(self, app, base: dict, items: List[dict]) -> list:
+        if len(items) < 2:
+            return [self._run(app, base, item) for item in items]
+
+        self._stats["concurrent"] += len(items)
+        executor = self._executor.get(self.workers)
+        return list(executor.map(lambda item: self._run(app, base, item), items))
+
+    def _run(self, app, base: dict, item: dict) -> dict:
+        if base["changed"]:
+            return CREDENTIALS_CHANGED
+
+        headers = Headers(item.get("headers") or {})
+        for name in FORWARDED_HEADERS:
+            headers.remove(name)
+        for name, value in base["headers"]:
+            headers.set(name, value)
+        body = {"json": item["body"]} if "body" in item else {}
+
+        try:
+            with app.app_context():
+                user_id, key_id, state = base["caller"]
+                caller, caller_state = _load_caller(user_id, key_id)
+                if caller is None or caller_state != state:
+                    base["changed"] = True
+                    return CREDENTIALS_CHANGED
+
+                # Authenticated by the batch request, see "_get_api_user"
+                g.api_user = caller, None, None
+                g.in_batch = True
+                with app.test_request_context(
+                    item["path"],
+                    method=item["method"],
+                    base_url=base["base_url"],
+                    environ_base=base["environ_base"],
+                    headers=headers,
+                    **body,
+                ):
+                    response = app.full_dispatch_request()
+                    data = (
+                        response.get_json()
+                        if response.is_json
+                        else response.get_data(as_text=True)
+                    )
+        except Exception:
+            log.exception(
+                "Batch sub-request %s %s failed", item["method"], item["path"]
+            )
+            self._stats["errors"] += 1
+            return {
+                "status": 500,
+                "headers": {},
+                "body": {"error": "Could not process your request"},
+            }
+
+        return {
+            "status": response.status_code,
+            "headers": {
+                name: value
+                for name, value in response.headers.items()
+                if name not in DROPPED_HEADERS
+            },
+            "body": data,
+        }
+
+
+batch = BatchDispatcher()
+metrics.register("batch", batch.stats)
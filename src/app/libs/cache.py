@@ -0,0 +1,149 @@
+# Python imports
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+# Third-party imports
+from sqlalchemy import TextClause, event
+
+# Local imports
+from app.libs import metrics
+from app.libs.replicas import RoutingSession
+from app.models import User
+
+"""
+Response cache of the admin read endpoints (users list, search and details).
+
+The responses are kept per worker in an LRU bounded by entries and bytes,
+with a TTL. Every entry is tagged with the users table generation, a counter
+in shared memory bumped after any commit changing the users, so a change
+made by any gunicorn worker (or job) invalidates the cached responses of all
+of them. Entries are tagged with the generation read before running the
+endpoint, a change committed meanwhile makes them stale right away.
+
+The changes are found from the app sessions, where the users are written:
+ORM changes and bulk statements on the users, Core statements on the users
+table and any text statement, which may write them. The generation is bumped
+after the commit.
+"""
+
+
+class ResponseCache:
+    def __init__(self) -> None:
+        self.ttl = 0
+        self.max_entries = 0
+        self.max_bytes = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        # Created before gunicorn forks the workers
+        self._generation = multiprocessing.RawValue("Q", 0)
+        self._generation_lock = multiprocessing.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stale": 0, "expired": 0}
+
+    def init_app(self, app) -> None:
+        self.ttl = app.config["RESPONSE_CACHE_TTL"]
+        self.max_entries = app.config["RESPONSE_CACHE_MAX_ENTRIES"]
+        self.max_bytes = app.config["RESPONSE_CACHE_MAX_BYTES"]
+        self.clear()
+
+    @property
+    def generation(self) -> int:
+        return self._generation.value
+
+    def invalidate(self) -> None:
+        with self._generation_lock:
+            self._generation.value += 1
+
+    def get(self, key: tuple) -> Optional[Tuple[bytes, int, str]]:
+        """Returns the cached body, status code and mimetype."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+
+            generation, expires_at, response = entry
+            stale = generation != self.generation
+            if stale or expires_at < time.monotonic():
+                self._stats["stale" if stale else "expired"] += 1
+                self._stats["misses"] += 1
+                self._remove(key)
+                return None
+
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return response
+
+    def set(self, key: tuple, generation: int, response: Tuple[bytes, int, str]):
+        if not self.ttl or len(response[0]) > self.max_bytes:
+            return
+
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (generation, time.monotonic() + self.ttl, response)
+            self._size += len(response[0])
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> dict:
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "hit_ratio": self._stats["hits"] / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "bytes": self._size,
+            "generation": self.generation,
+        }
+
+    def _remove(self, key: tuple) -> None:
+        entry = self._entries.pop(key, None)
+        if entry:
+            self._size -= len(entry[2][0])
+
+
+response_cache = ResponseCache()
+metrics.register("response_cache", response_cache.stats)
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _users_flushed(session, flush_context) -> None:
+    if any(
+        isinstance(instance, User)
+        for instance in (*session.new, *session.dirty, *session.deleted)
+    ):
+        session.info["users_changed"] = True
+
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def _users_bulk_changed(orm_execute_state) -> None:
+    # Bulk statements, such as the bulk delete job or the key rotation,
+    # Core statements on the users table and text ones
+    if orm_execute_state.is_select:
+        return
+    statement = orm_execute_state.statement
+    mapper = orm_execute_state.bind_mapper
+    if (
+        (mapper is not None and mapper.class_ is User)
+        or getattr(statement, "table", None) is User.__table__
+        or isinstance(statement, TextClause)
+    ):
+        orm_execute_state.session.info["users_changed"] = True
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _users_committed(session) -> None:
+    if session.info.pop("users_changed", False):
+        response_cache.invalidate()
+
+
+@event.listens_for(RoutingSession, "after_rollback")
+def _users_rolled_back(session) -> None:
+    session.info.pop("users_changed", None)
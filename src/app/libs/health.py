@@ -0,0 +1,159 @@
+# Python imports
+import multiprocessing
+import os
+import threading
+import time
+from typing import Optional
+
+# Flask imports
+from flask import g
+from sqlalchemy.pool import QueuePool
+
+# Local imports
+from app import db, log
+from app.libs import metrics
+from app.models import User
+
+"""
+Readiness of the worker, for the load balancer health checks.
+
+The database is probed with a one row read of the users table, at most once
+every [health] probe_ttl seconds per worker. The health checks in between get
+the last result, so frequent checks don't add load. A single request probes
+at a time, the others get the previous result meanwhile.
+
+The requests being served are counted per worker, and across all the
+gunicorn workers: every worker publishes its count in its own slot of
+an array in shared memory. The gunicorn "post_fork" hook gives a slot to
+each new worker, "child_exit" (run by the arbiter, even for a killed worker)
+frees it, so the total doesn't drift when workers die mid-request.
+"""
+
+# Shared memory slots, at least the number of gunicorn workers
+MAX_WORKERS = 64
+
+
+class HealthProbe:
+    def __init__(self) -> None:
+        self.app = None
+        self.probe_ttl = 0.0
+        self._result = None
+        self._checked_at = None
+        self._probe_lock = threading.Lock()
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        # Created before gunicorn forks the workers, a worker pid
+        # and its requests in flight per slot
+        self._slot = None
+        self._slot_pids = multiprocessing.RawArray("q", MAX_WORKERS)
+        self._slot_in_flight = multiprocessing.RawArray("q", MAX_WORKERS)
+        self._slots_lock = multiprocessing.Lock()
+        self._stats = {"probes": 0, "failed_probes": 0}
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def init_app(self, app) -> None:
+        self.app = app
+        self.probe_ttl = app.config["HEALTH_PROBE_TTL"]
+        self._result = self._checked_at = None
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+
+    def check(self) -> dict:
+        """
+        Returns the last database probe result, probing again when it's older
+        than "probe_ttl" seconds.
+        """
+        now = time.monotonic()
+        stale = self._checked_at is None or now - self._checked_at >= self.probe_ttl
+        if stale and self._probe_lock.acquire(blocking=self._result is None):
+            try:
+                self._result = self._probe()
+                self._checked_at = time.monotonic()
+            finally:
+                self._probe_lock.release()
+        return {**self._result, "age": time.monotonic() - self._checked_at}
+
+    def post_fork(self, server, worker) -> None:
+        """The gunicorn "post_fork" hook, takes a free slot."""
+        with self._slots_lock:
+            for slot, pid in enumerate(self._slot_pids):
+                if not pid:
+                    self._slot_pids[slot] = os.getpid()
+                    self._slot_in_flight[slot] = 0
+                    self._slot = slot
+                    return
+        log.warning("No free in flight slot for worker %s", os.getpid())
+
+    def child_exit(self, server, worker) -> None:
+        """The gunicorn "child_exit" hook (arbiter), frees the worker slot."""
+        with self._slots_lock:
+            for slot, pid in enumerate(self._slot_pids):
+                if pid == worker.pid:
+                    self._slot_pids[slot] = 0
+                    self._slot_in_flight[slot] = 0
+
+    def in_flight(self) -> dict:
+        total = sum(self._slot_in_flight)
+        if self._slot is None:
+            # Not a gunicorn worker (debug server, commands)
+            total += self._in_flight
+        return {"worker": self._in_flight, "all_workers": total}
+
+    def stats(self) -> dict:
+        return {**self._stats, "in_flight": self.in_flight(), "pool": pool_stats()}
+
+    def _probe(self) -> dict:
+        self._stats["probes"] += 1
+        start = time.perf_counter()
+        error: Optional[str] = None
+        try:
+            with db.engine.connect() as connection:
+                connection.execute(db.select(User.id).limit(1)).first()
+        except Exception as err:
+            self._stats["failed_probes"] += 1
+            log.error("Database probe failed: %s", err)
+            error = type(err).__name__
+        return {
+            "ok": error is None,
+            "error": error,
+            "latency_ms": (time.perf_counter() - start) * 1000,
+        }
+
+    def _add_in_flight(self, count: int) -> None:
+        with self._lock:
+            self._in_flight += count
+            # Only written by this worker
+            if self._slot is not None:
+                self._slot_in_flight[self._slot] = self._in_flight
+
+    def _before_request(self) -> None:
+        self._add_in_flight(1)
+        g.health_counted = True
+
+    def _teardown_request(self, exc) -> None:
+        if g.pop("health_counted", False):
+            self._add_in_flight(-1)
+
+    def _after_fork(self) -> None:
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._slot = None
+
+
+def pool_stats() -> dict:
+    """The connection pool usage of the primary database of this worker."""
+    pool = db.engine.pool
+    if not isinstance(pool, QueuePool):
+        # SQLite in memory, a single shared connection
+        return {"class": type(pool).__name__}
+    return {
+        "class": type(pool).__name__,
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": pool.overflow(),
+    }
+
+
+health = HealthProbe()
+metrics.register("health", health.stats)
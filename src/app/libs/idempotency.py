@@ -0,0 +1,231 @@
+# Python imports
+import json
+import time
+from datetime import datetime, timedelta, timezone
+
+# Flask imports
+from flask import Response
+from sqlalchemy.dialects.sqlite import insert
+
+# Local imports
+from app import db, log
+from app.libs import metrics
+from app.libs.background import ProcessThread
+from app.models import IdempotencyKey
+
+"""
+Idempotency keys, so clients can safely retry a request that timed out.
+
+The first request with a given "Idempotency-Key" header claims the key in the
+"idempotency_keys" table, runs, then stores its response. Repeats get the stored
+response without running the endpoint again, a repeat arriving while the first
+request still runs gets a "409 Conflict" right away. The keys are scoped to
+the client credentials and expire after [idempotency] ttl seconds.
+
+The stored responses never hold secrets. A response with "api_key" fields
+(a new key, the previous one is already revoked) is stored as a "410 Gone"
+error saying the key was issued and can't be sent again, along with the rest
+of the response. The client generates another key.
+
+The store is bounded: every worker runs a thread, started on its first request,
+removing the expired keys every "purge_interval" seconds, then the oldest
+ones beyond "max_keys".
+"""
+
+# Stored response headers, besides the body and status code
+STORED_HEADERS = ("Content-Type", "Location")
+
+# Response fields never stored, their responses are replayed as errors
+REDACTED_FIELDS = ("api_key",)
+
+KEY_ISSUED_ERROR = (
+    "The API key was issued to the first request with this Idempotency-Key "
+    "and can't be sent again, generate a new one"
+)
+
+_table = IdempotencyKey.__table__
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _redact(data, redacted: set):
+    """Copy of the JSON "data" without the REDACTED_FIELDS."""
+    if isinstance(data, list):
+        return [_redact(item, redacted) for item in data]
+    if not isinstance(data, dict):
+        return data
+
+    copy = {}
+    for name, value in data.items():
+        if name in REDACTED_FIELDS and value is not None:
+            redacted.add(name)
+        else:
+            copy[name] = _redact(value, redacted)
+    return copy
+
+
+class IdempotencyStore:
+    def __init__(self) -> None:
+        self.app = None
+        self.ttl = 0
+        self.lock_timeout = 0
+        self.max_keys = 0
+        self.purge_interval = 0.0
+        self._thread = ProcessThread(self._run, "idempotency-purge")
+        self._stats = {
+            "stored": 0,
+            "replayed": 0,
+            "conflicts": 0,
+            "released": 0,
+            "purged": 0,
+            "evicted": 0,
+        }
+
+    def init_app(self, app) -> None:
+        self.app = app
+        self.ttl = app.config["IDEMPOTENCY_TTL"]
+        self.lock_timeout = app.config["IDEMPOTENCY_LOCK_TIMEOUT"]
+        self.max_keys = app.config["IDEMPOTENCY_MAX_KEYS"]
+        self.purge_interval = app.config["IDEMPOTENCY_PURGE_INTERVAL"]
+        app.before_request(self._start_thread)
+
+    def _expired(self, now: datetime):
+        # Expired keys, and keys left in progress by a crashed worker
+        return db.or_(
+            _table.c.created_at < now - timedelta(seconds=self.ttl),
+            db.and_(
+                _table.c.status_code.is_(None),
+                _table.c.created_at < now - timedelta(seconds=self.lock_timeout),
+            ),
+        )
+
+    def claim(self, key_digest: str, fingerprint: str):
+        """
+        Claim the key for a new request, returns None once claimed.
+        Otherwise returns the existing row: a completed request,
+        a different request using the same key, or a request still in progress.
+        """
+        while True:
+            now = _now()
+            with db.engine.begin() as connection:
+                connection.execute(
+                    _table.delete().where(
+                        _table.c.key_digest == key_digest, self._expired(now)
+                    )
+                )
+                claimed = connection.execute(
+                    insert(_table)
+                    .values(
+                        key_digest=key_digest, fingerprint=fingerprint, created_at=now
+                    )
+                    .on_conflict_do_nothing()
+                ).rowcount
+                row = None
+                if not claimed:
+                    row = connection.execute(
+                        _table.select().where(_table.c.key_digest == key_digest)
+                    ).first()
+
+            if claimed:
+                return None
+
+            # Released in the meantime
+            if row is None:
+                continue
+
+            if row.status_code is None and row.fingerprint == fingerprint:
+                self._stats["conflicts"] += 1
+            return row
+
+    def save(self, key_digest: str, response: Response) -> None:
+        headers = {
+            name: response.headers[name]
+            for name in STORED_HEADERS
+            if name in response.headers
+        }
+        status_code, body = response.status_code, response.get_data()
+        if response.is_json:
+            redacted = set()
+            data = _redact(response.get_json(), redacted)
+            if redacted:
+                status_code = 410
+                headers = {"Content-Type": "application/json"}
+                body = json.dumps(
+                    {
+                        "error": KEY_ISSUED_ERROR,
+                        "status_code": response.status_code,
+                        "response": data,
+                    }
+                ).encode("utf-8")
+
+        with db.engine.begin() as connection:
+            connection.execute(
+                _table.update()
+                .where(_table.c.key_digest == key_digest)
+                .values(status_code=status_code, headers=headers, body=body)
+            )
+        self._stats["stored"] += 1
+
+    def release(self, key_digest: str) -> None:
+        """Drop a claimed key so the request can be retried."""
+        with db.engine.begin() as connection:
+            connection.execute(
+                _table.delete().where(
+                    _table.c.key_digest == key_digest, _table.c.status_code.is_(None)
+                )
+            )
+        self._stats["released"] += 1
+
+    def replay(self, row) -> Response:
+        self._stats["replayed"] += 1
+        response = Response(row.body, row.status_code, row.headers)
+        response.headers["Idempotent-Replayed"] = "true"
+        return response
+
+    def purge(self) -> int:
+        """
+        Remove the expired keys, then the oldest ones beyond "max_keys",
+        returns their number.
+        """
+        with db.engine.begin() as connection:
+            purged = connection.execute(
+                _table.delete().where(self._expired(_now()))
+            ).rowcount
+            # Creation date of the newest key beyond the limit
+            cutoff = connection.execute(
+                db.select(_table.c.created_at)
+                .order_by(_table.c.created_at.desc())
+                .offset(self.max_keys)
+                .limit(1)
+            ).scalar()
+            evicted = 0
+            if cutoff is not None:
+                evicted = connection.execute(
+                    _table.delete().where(_table.c.created_at <= cutoff)
+                ).rowcount
+
+        self._stats["purged"] += purged
+        self._stats["evicted"] += evicted
+        return purged + evicted
+
+    def stats(self) -> dict:
+        return dict(self._stats)
+
+    def _start_thread(self) -> None:
+        if self.purge_interval:
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.purge_interval)
+            try:
+                with self.app.app_context():
+                    self.purge()
+            except Exception as err:
+                log.error("Purging the idempotency keys failed: %s", err)
+
+
+idempotency = IdempotencyStore()
+metrics.register("idempotency", idempotency.stats)
@@ -0,0 +1,246 @@
+# Python imports
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Optional
+
+# Local imports
+from app import db, log
+from app.libs import metrics
+from app.libs.background import ProcessExecutor, ProcessThread
+from app.models import Job
+
+"""
+Background jobs for long admin operations (bulk deletes, key rotations...),
+so they don't hold a gunicorn worker for their whole duration.
+
+A job is a row of the "jobs" table, submit() returns its id right away and
+the work runs in a thread pool of the submitting process, with at most
+"max_workers" jobs running at once per process. No broker is involved,
+the progress and result are read back from the table.
+
+Handlers are registered by kind and called with a JobContext and the
+job params, they commit their work in chunks and report the progress
+with JobContext.advance(), which is committed along with the chunk.
+Work that has to run in the request (a streamed response) is recorded
+as a job with start() and finish(), so it's followed the same way.
+
+The queued and running jobs hold a lease: a thread of the process running
+them renews their "heartbeat_at" every "heartbeat_interval" seconds. A job
+whose heartbeat is older than "lease_timeout" is reported as failed, its
+process is gone (killed, restarted) whatever the host it ran on.
+"""
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class JobContext:
+    def __init__(self, job_id: str, created_by: Optional[str] = None) -> None:
+        self.job_id = job_id
+        self.created_by = created_by
+
+    def set_total(self, total: int) -> None:
+        db.session.execute(
+            db.update(Job).where(Job.id == self.job_id).values(total=total)
+        )
+        db.session.commit()
+
+    def advance(self, count: int) -> None:
+        """Add to the job progress, written with the handler next commit."""
+        db.session.execute(
+            db.update(Job)
+            .where(Job.id == self.job_id)
+            .values(progress=Job.progress + count, heartbeat_at=_now())
+        )
+
+
+class JobRunner:
+    def __init__(self) -> None:
+        self.app = None
+        self.max_workers = 1
+        self.heartbeat_interval = 0
+        self.lease_timeout = 0
+        self._handlers: Dict[str, Callable] = {}
+        self._active = set()
+        self._executor = ProcessExecutor("job")
+        self._heartbeat = ProcessThread(self._run_heartbeat, "job-heartbeat")
+        self._lock = threading.Lock()
+        self._stats = {"submitted": 0, "succeeded": 0, "failed": 0, "running": 0}
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def init_app(self, app) -> None:
+        self.app = app
+        self.max_workers = app.config["JOBS_MAX_WORKERS"]
+        self.heartbeat_interval = app.config["JOBS_HEARTBEAT_INTERVAL"]
+        self.lease_timeout = app.config["JOBS_LEASE_TIMEOUT"]
+
+    def handler(self, kind: str):
+        """
+        Register the function running the jobs of the given kind,
+        it returns the JSON serializable job result.
+        """
+
+        def decorator(func):
+            self._handlers[kind] = func
+            return func
+
+        return decorator
+
+    def submit(self, kind: str, params: dict, created_by: Optional[str] = None):
+        """
+        Queue a job, returns its id.
+        """
+        if kind not in self._handlers:
+            raise ValueError(f'Unknown job kind "{kind}"')
+
+        job = Job(kind=kind, params=params, created_by=created_by, heartbeat_at=_now())
+        db.session.add(job)
+        db.session.commit()
+        job_id = job.id
+
+        with self._lock:
+            self._active.add(job_id)
+        self._start_heartbeat()
+        self._executor.get(self.max_workers).submit(self._run, job_id)
+        self._stats["submitted"] += 1
+        return job_id
+
+    def start(
+        self, kind: str, params: dict, created_by: Optional[str] = None
+    ) -> JobContext:
+        """
+        Record a job run by the caller, which reports its outcome
+        with finish(). Returns its context.
+        """
+        now = _now()
+        job = Job(
+            kind=kind,
+            params=params,
+            created_by=created_by,
+            status="running",
+            started_at=now,
+            heartbeat_at=now,
+        )
+        db.session.add(job)
+        db.session.commit()
+
+        with self._lock:
+            self._active.add(job.id)
+        self._start_heartbeat()
+        self._stats["submitted"] += 1
+        self._stats["running"] += 1
+        return JobContext(job.id, created_by)
+
+    def finish(self, job_id: str, result=None, error: Optional[str] = None) -> None:
+        """
+        Save the outcome of a running job, failed when there's an error.
+        Called within an app context, it closes the session.
+        """
+        status = "failed" if error else "succeeded"
+        self._stats["running"] -= 1
+        with self._lock:
+            self._active.discard(job_id)
+
+        try:
+            db.session.execute(
+                db.update(Job)
+                .where(Job.id == job_id)
+                .values(status=status, result=result, error=error, finished_at=_now())
+            )
+            db.session.commit()
+        except Exception as err:
+            db.session.rollback()
+            log.error('Job "%s": failed saving the result: %s', job_id, err)
+        finally:
+            db.session.close()
+
+        self._stats[status] += 1
+        log.info('Job "%s" %s', job_id, status)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """
+        Load a job, a job left unfinished by a process that is gone
+        (its lease expired) is marked as failed.
+        """
+        job = db.session.get(Job, job_id)
+        expired_at = _now() - timedelta(seconds=self.lease_timeout)
+        if (
+            job
+            and job.status in ("queued", "running")
+            and (job.heartbeat_at is None or job.heartbeat_at < expired_at)
+        ):
+            job.status = "failed"
+            job.error = "Interrupted, the process running the job has exited"
+            job.finished_at = _now()
+            db.session.commit()
+        return job
+
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            "max_workers": self.max_workers,
+            "active": len(self._active),
+        }
+
+    def _run(self, job_id: str) -> None:
+        with self.app.app_context():
+            job = db.session.get(Job, job_id)
+            job.status, job.started_at = "running", _now()
+            db.session.commit()
+            kind, params, created_by = job.kind, job.params, job.created_by
+            self._stats["running"] += 1
+
+            try:
+                result = self._handlers[kind](JobContext(job_id, created_by), **params)
+                error = None
+            except Exception as err:
+                db.session.rollback()
+                log.exception('Job "%s" (%s) failed', job_id, kind)
+                result, error = None, str(err)
+
+            self.finish(job_id, result, error)
+
+    def heartbeat(self) -> int:
+        """
+        Renew the lease of the jobs of this process, returns their number.
+        """
+        with self._lock:
+            job_ids = list(self._active)
+        if not job_ids:
+            return 0
+
+        with self.app.app_context():
+            try:
+                db.session.execute(
+                    db.update(Job)
+                    .where(Job.id.in_(job_ids))
+                    .values(heartbeat_at=_now())
+                )
+                db.session.commit()
+            except Exception as err:
+                db.session.rollback()
+                log.error("Failed renewing the jobs heartbeat: %s", err)
+                return 0
+            finally:
+                db.session.close()
+        return len(job_ids)
+
+    def _start_heartbeat(self) -> None:
+        if self.heartbeat_interval:
+            self._heartbeat.start()
+
+    def _run_heartbeat(self) -> None:
+        while True:
+            time.sleep(self.heartbeat_interval)
+            self.heartbeat()
+
+    def _after_fork(self) -> None:
+        self._lock = threading.Lock()
+        self._active = set()
+
+
+jobs = JobRunner()
+metrics.register("jobs", jobs.stats)
@@ -0,0 +1,216 @@
+# Python imports
+import hashlib
+import math
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+
+# Third-party imports
+from sqlalchemy import event
+
+# Local imports
+from app import db, log
+from app.libs import metrics
+from app.models import ApiKey, User
+
+"""
+Cheap rejection of unknown API keys, so a flood of bad keys doesn't reach
+the database.
+
+NegativeCache: the recently seen unknown keys, kept for a short TTL.
+BloomFilter: every valid key id and key digest, built at startup and updated
+    when keys are created or changed. A key it has never seen is rejected
+    right away, keys it might have seen are looked up in the database.
+    The bits live in shared memory, created before gunicorn forks the workers,
+    so a key created by any worker is seen by all of them. Keys created by
+    another server using the same database are not, only enable the filter
+    when a single instance writes the API keys.
+"""
+
+
+class NegativeCache:
+    def __init__(self, ttl: float, max_entries: int) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0}
+
+    def __contains__(self, key: str) -> bool:
+        if not self.ttl:
+            return False
+
+        with self._lock:
+            expires_at = self._entries.get(key)
+            if expires_at and expires_at > time.monotonic():
+                self._stats["hits"] += 1
+                return True
+            if expires_at:
+                del self._entries[key]
+        self._stats["misses"] += 1
+        return False
+
+    def add(self, key: str) -> None:
+        if not self.ttl:
+            return
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = time.monotonic() + self.ttl
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        return {**self._stats, "entries": len(self._entries)}
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float) -> None:
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = multiprocessing.RawArray("B", (self.size + 7) // 8)
+        self._items = multiprocessing.RawValue("Q", 0)
+        self._lock = multiprocessing.Lock()
+        self._stats = {"lookups": 0, "rejected": 0, "false_positives": 0}
+
+    def _positions(self, item: str):
+        # Double hashing, the k positions are derived from two 64 bit hashes
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + n * second) % self.size for n in range(self.hashes)]
+
+    def add(self, item: str) -> None:
+        with self._lock:
+            for position in self._positions(item):
+                self._bits[position >> 3] |= 1 << (position & 7)
+            self._items.value += 1
+
+    def __contains__(self, item: str) -> bool:
+        self._stats["lookups"] += 1
+        found = all(
+            self._bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(item)
+        )
+        if not found:
+            self._stats["rejected"] += 1
+        return found
+
+    def false_positive(self) -> None:
+        """Called when an item reported as present was not found in the database."""
+        self._stats["false_positives"] += 1
+
+    def stats(self) -> dict:
+        items = self._items.value
+        estimated = (1 - math.exp(-self.hashes * items / self.size)) ** self.hashes
+        lookups = self._stats["lookups"]
+        accepted = lookups - self._stats["rejected"]
+        return {
+            **self._stats,
+            "items": items,
+            "memory_bytes": len(self._bits),
+            "hashes": self.hashes,
+            "estimated_false_positive_rate": estimated,
+            "observed_false_positive_rate": (
+                self._stats["false_positives"] / accepted if accepted else 0.0
+            ),
+        }
+
+
+class KeyFilter:
+    def __init__(self) -> None:
+        self.negative_cache = NegativeCache(0, 0)
+        self.bloom_filter = None
+
+    def init_app(self, app) -> None:
+        """
+        Must run within an app context, the bloom filter is loaded
+        from the database.
+        """
+        self.negative_cache = NegativeCache(
+            app.config["KEY_FILTER_NEGATIVE_CACHE_TTL"],
+            app.config["KEY_FILTER_NEGATIVE_CACHE_SIZE"],
+        )
+        self.bloom_filter = None
+        if app.config["KEY_FILTER_BLOOM_FILTER"]:
+            self.bloom_filter = self._build_bloom_filter(
+                app.config["KEY_FILTER_BLOOM_FILTER_CAPACITY"],
+                app.config["KEY_FILTER_BLOOM_FILTER_ERROR_RATE"],
+            )
+
+    def _build_bloom_filter(self, capacity: int, error_rate: float) -> BloomFilter:
+        start = time.perf_counter()
+        bloom_filter = BloomFilter(capacity, error_rate)
+        for statement in (db.select(User.hashed_api_key), db.select(ApiKey.key_id)):
+            for item in db.session.execute(
+                statement.execution_options(yield_per=10000)
+            ):
+                bloom_filter.add(item[0])
+        log.info(
+            "API keys bloom filter loaded %d keys in %.2fs",
+            bloom_filter.stats()["items"],
+            time.perf_counter() - start,
+        )
+        return bloom_filter
+
+    @staticmethod
+    def token_digest(api_key: str) -> bytes:
+        return hashlib.blake2b(api_key.encode("utf-8"), digest_size=16).digest()
+
+    def is_rejected(self, api_key: str) -> bool:
+        return self.token_digest(api_key) in self.negative_cache
+
+    def reject(self, api_key: str) -> None:
+        self.negative_cache.add(self.token_digest(api_key))
+
+    def forget(self, api_key: str) -> None:
+        """
+        Called when a custom API key is set, in case it was rejected recently.
+        Other workers keep rejecting it until their negative cache entry expires.
+        """
+        self.negative_cache.discard(self.token_digest(api_key))
+
+    def might_exist(self, item: str) -> bool:
+        """
+        Returns False if the key id or digest is certainly unknown.
+        """
+        return self.bloom_filter is None or item in self.bloom_filter
+
+    def add(self, item: str) -> None:
+        if self.bloom_filter is not None:
+            self.bloom_filter.add(item)
+
+    def report_false_positive(self) -> None:
+        if self.bloom_filter is not None:
+            self.bloom_filter.false_positive()
+
+    def stats(self) -> dict:
+        return {
+            "negative_cache": self.negative_cache.stats(),
+            "bloom_filter": self.bloom_filter.stats() if self.bloom_filter else None,
+        }
+
+
+key_filter = KeyFilter()
+metrics.register("key_filter", key_filter.stats)
+
+
+@event.listens_for(User, "after_insert")
+def _add_user_digest(mapper, connection, target) -> None:
+    key_filter.add(target.hashed_api_key)
+
+
+@event.listens_for(User, "after_update")
+def _update_user_digest(mapper, connection, target) -> None:
+    if db.inspect(target).attrs.hashed_api_key.history.has_changes():
+        key_filter.add(target.hashed_api_key)
+
+
+@event.listens_for(ApiKey, "after_insert")
+def _add_key_id(mapper, connection, target) -> None:
+    key_filter.add(target.key_id)
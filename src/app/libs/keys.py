@@ -0,0 +1,95 @@
+# Python imports
+import hashlib
+import hmac
+import secrets
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+# Local imports
+from app import get_settings
+
+"""
+API key hashing.
+
+The API keys are stored as keyed HMAC-SHA256 digests, using the "api_key_secret"
+setting as the key. A leaked database alone isn't enough to brute force the keys.
+
+Generated keys have the format "<prefix>_<key_id>_<secret>", the key id is stored
+in clear and indexed so a key is found with a single lookup, only the secret
+part is hashed. Keys without the prefix (custom keys set by an admin, and keys
+generated by older versions) are looked up by the digest of the whole key.
+"""
+
+KEY_ID_LENGTH = 12
+
+
+@lru_cache(maxsize=None)
+def _base_digest() -> "hmac.HMAC":
+    # The HMAC key schedule is computed once per process,
+    # every hash copies the precomputed state instead.
+    secret = get_settings()["general"]["api_key_secret"]
+    return hmac.new(secret.encode("utf-8"), digestmod=hashlib.sha256)
+
+
+@lru_cache(maxsize=None)
+def _prefix() -> str:
+    return get_settings()["general"]["api_key_prefix"]
+
+
+def gen_api_key() -> Tuple[str, str, str]:
+    """
+    Returns the key id, the secret and the full API key.
+    """
+    key_id = secrets.token_hex(KEY_ID_LENGTH // 2)
+    secret = secrets.token_urlsafe(32)
+    return key_id, secret, f"{_prefix()}_{key_id}_{secret}"
+
+
+def gen_hashed_api_keys(count: int) -> List[Tuple[str, str, str]]:
+    """
+    Generate API keys in bulk, returns the key id, the hashed secret
+    and the full API key of each one.
+    """
+    keys = []
+    for _ in range(count):
+        key_id, secret, api_key = gen_api_key()
+        keys.append((key_id, hash_api_key(secret), api_key))
+    return keys
+
+
+def parse_api_key(api_key: str) -> Optional[Tuple[str, str]]:
+    """
+    Split a prefixed API key into its key id and secret,
+    returns None for keys in any other format.
+    """
+    parts = api_key.split("_", 2)
+    if len(parts) != 3 or parts[0] != _prefix():
+        return None
+
+    _, key_id, secret = parts
+    if len(key_id) != KEY_ID_LENGTH or not secret:
+        return None
+    return key_id, secret
+
+
+def hash_api_key(api_key: str) -> str:
+    digest = _base_digest().copy()
+    digest.update(api_key.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def legacy_hash_api_key(api_key: str) -> str:
+    """The unkeyed SHA-256 digest used by older versions."""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+def verify_api_key(api_key: str, hashed_api_key: str) -> bool:
+    return hmac.compare_digest(hash_api_key(api_key), hashed_api_key)
+
+
+def random_digest() -> str:
+    """
+    A random value in the digest format, no known API key hashes to it.
+    Used for accounts created without an API key.
+    """
+    return secrets.token_hex(32)
@@ -0,0 +1,18 @@
+# Python imports
+from typing import Callable, Dict
+
+"""
+A registry of the in-process components statistics (caches, buffers, limiters),
+served by the admin "/api/v1/metrics" endpoint.
+The values are per worker process unless a component says otherwise.
+"""
+
+_sources: Dict[str, Callable[[], dict]] = {}
+
+
+def register(name: str, stats: Callable[[], dict]) -> None:
+    _sources[name] = stats
+
+
+def collect() -> dict:
+    return {name: stats() for name, stats in _sources.items()}
@@ -0,0 +1,231 @@
+# Python imports
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+
+# Third-party imports
+from sqlalchemy.dialects.sqlite import insert
+
+# Local imports
+from app import db, log
+from app.libs import metrics
+from app.libs.audit import audit
+from app.libs.background import ProcessThread
+from app.models import Lease, User, purge_users
+
+"""
+Purge of the soft deleted users.
+
+With [soft_delete] enabled, deleting a user only sets its "deleted_at",
+the API key lookups and the users endpoints skip such users. The purger
+removes them later along with their API keys and usage counters, in batches
+of "purge_batch_size" users with a "purge_pause" between them, so it doesn't
+hold the database write lock for long, and only within the "purge_window"
+(low traffic hours).
+
+Every worker runs a purger thread, started on its first request, checking
+for deleted users every "purge_interval" seconds. A single process purges
+at a time, holding the "purger" row of the "leases" table, renewed after
+every batch. Another one, on any host, takes over once the lease is released,
+or expired for "purge_lease" seconds (killed or stuck worker). The owners
+are named by host, pid and a random part, pids are reused.
+The "purge-deleted-users" command purges right away (cron jobs), it takes
+the same lease and refuses to run while a worker holds it.
+"""
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def parse_window(window: str) -> Optional[Tuple[int, int]]:
+    """
+    Parse a "HH:MM-HH:MM" UTC window into minutes of the day,
+    None for an empty window (any time). Raises ValueError.
+    """
+    if not window:
+        return None
+
+    try:
+        start, end = (
+            int(hours) * 60 + int(minutes)
+            for hours, minutes in (bound.split(":") for bound in window.split("-"))
+        )
+    except ValueError:
+        raise ValueError(
+            f'Invalid purge window "{window}", expected "HH:MM-HH:MM"'
+        ) from None
+    return start, end
+
+
+class UserPurger:
+    def __init__(self) -> None:
+        self.app = None
+        self.enabled = False
+        self.batch_size = 0
+        self.pause = 0.0
+        self.interval = 0.0
+        self.window = None
+        self.lease = 0.0
+        self._thread = ProcessThread(self._run, "purger")
+        self._owner = None
+        self._holding = False
+        self._stats = {"purged": 0, "batches": 0, "errors": 0}
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def init_app(self, app) -> None:
+        self.app = app
+        self.enabled = app.config["SOFT_DELETE_ENABLED"]
+        self.batch_size = app.config["SOFT_DELETE_PURGE_BATCH_SIZE"]
+        self.pause = app.config["SOFT_DELETE_PURGE_PAUSE"]
+        self.interval = app.config["SOFT_DELETE_PURGE_INTERVAL"]
+        self.window = parse_window(app.config["SOFT_DELETE_PURGE_WINDOW"])
+        self.lease = app.config["SOFT_DELETE_PURGE_LEASE"]
+        app.before_request(self._start_thread)
+
+    def in_window(self, now: Optional[datetime] = None) -> bool:
+        if self.window is None:
+            return True
+
+        now = now or _now()
+        minute = now.hour * 60 + now.minute
+        start, end = self.window
+        if start <= end:
+            return start <= minute < end
+        # Across midnight
+        return minute >= start or minute < end
+
+    def purge_batch(self) -> int:
+        """
+        Remove up to "batch_size" deleted users, returns their number.
+        Called within an app context.
+        """
+        user_ids = (
+            db.session.execute(
+                db.select(User.id)
+                .where(User.deleted_at.is_not(None))
+                .order_by(User.deleted_at)
+                .limit(self.batch_size)
+            )
+            .scalars()
+            .all()
+        )
+        if not user_ids:
+            return 0
+
+        try:
+            purge_users(user_ids)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            self._stats["errors"] += 1
+            raise
+
+        self._stats["batches"] += 1
+        self._stats["purged"] += len(user_ids)
+        audit.record("users.purge", None, details={"purged": len(user_ids)})
+        return len(user_ids)
+
+    def purge(self, window: bool = False) -> int:
+        """
+        Purge the deleted users batch after batch, returns their number.
+        With "window", stops once outside of the purge window.
+        The caller holds the lease, see claim().
+        """
+        purged = 0
+        with self.app.app_context():
+            while not window or self.in_window():
+                count = self.purge_batch()
+                purged += count
+                self._renew()
+                if count < self.batch_size:
+                    break
+                time.sleep(self.pause)
+            db.session.close()
+
+        if purged:
+            log.info("%d deleted users have been purged", purged)
+        return purged
+
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            "holding_lease": self._holding,
+            "in_window": self.in_window(),
+        }
+
+    @property
+    def owner(self) -> str:
+        """Name of this process as the lease owner."""
+        if self._owner is None:
+            self._owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+        return self._owner
+
+    def claim(self) -> bool:
+        """
+        Take the purge lease, or renew it, returns False while another
+        process holds it. Called within an app context.
+        """
+        now = _now()
+        lease = {"owner": self.owner, "expires_at": now + timedelta(seconds=self.lease)}
+        with db.engine.begin() as connection:
+            claimed = connection.execute(
+                insert(Lease)
+                .values(name="purger", **lease)
+                .on_conflict_do_update(
+                    index_elements=[Lease.name],
+                    set_=lease,
+                    where=db.or_(Lease.expires_at < now, Lease.owner == self.owner),
+                )
+            ).rowcount
+        self._holding = bool(claimed)
+        return self._holding
+
+    def release(self) -> None:
+        """Drop the purge lease, if held by this process."""
+        with db.engine.begin() as connection:
+            connection.execute(
+                db.delete(Lease).where(
+                    Lease.name == "purger", Lease.owner == self.owner
+                )
+            )
+        self._holding = False
+
+    def _renew(self) -> None:
+        with db.engine.begin() as connection:
+            connection.execute(
+                db.update(Lease)
+                .where(Lease.name == "purger", Lease.owner == self.owner)
+                .values(expires_at=_now() + timedelta(seconds=self.lease))
+            )
+
+    def _after_fork(self) -> None:
+        self._owner = None
+        self._holding = False
+
+    def _start_thread(self) -> None:
+        if self.enabled and self.interval:
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            if not self.in_window():
+                continue
+            try:
+                with self.app.app_context():
+                    if not self.claim():
+                        continue
+                    try:
+                        self.purge(window=True)
+                    finally:
+                        self.release()
+            except Exception as err:
+                log.error("Purging the deleted users failed: %s", err)
+
+
+purger = UserPurger()
+metrics.register("purger", purger.stats)
@@ -0,0 +1,144 @@
+# Python imports
+import hashlib
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+
+# Local imports
+from app.libs import metrics
+
+"""
+Token bucket rate limiting.
+
+Every bucket holds up to "burst" tokens and refills at "rate" tokens per second,
+a request takes one token and is refused when the bucket is empty.
+
+Two bucket stores are available:
+    MemoryBucketStore: per process, an LRU bounded dict.
+    SharedBucketStore: a fixed size table in shared memory, created before
+        gunicorn forks the workers so the limits hold across all of them.
+Both are O(1) per request with a bounded memory use.
+"""
+
+
+class MemoryBucketStore:
+    def __init__(self, max_buckets: int) -> None:
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key: str, rate: float, burst: float) -> float:
+        """
+        Take a token from the bucket, returns 0 if allowed,
+        otherwise the number of seconds until a token is available.
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (burst, now))
+            tokens, retry_after = _take_token(tokens, updated_at, now, rate, burst)
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_buckets:
+                # Evict the least recently used bucket
+                self._buckets.popitem(last=False)
+        return retry_after
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class SharedBucketStore:
+    """
+    Direct mapped table, every key is hashed to a slot holding a 64 bit
+    fingerprint of the key, the tokens and the last update time.
+    A key landing on a slot owned by another key takes it over with a full
+    bucket, which bounds the memory at the cost of rare resets.
+    """
+
+    LOCKS = 64
+
+    def __init__(self, max_buckets: int) -> None:
+        self.max_buckets = max_buckets
+        self._fingerprints = multiprocessing.RawArray("Q", max_buckets)
+        self._buckets = multiprocessing.RawArray("d", max_buckets * 2)
+        self._locks = [multiprocessing.Lock() for _ in range(self.LOCKS)]
+
+    def consume(self, key: str, rate: float, burst: float) -> float:
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+        fingerprint = int.from_bytes(digest, "little") or 1
+        slot = fingerprint % self.max_buckets
+
+        now = time.monotonic()
+        with self._locks[slot % self.LOCKS]:
+            if self._fingerprints[slot] != fingerprint:
+                self._fingerprints[slot] = fingerprint
+                tokens, updated_at = burst, now
+            else:
+                tokens, updated_at = (
+                    self._buckets[slot * 2],
+                    self._buckets[slot * 2 + 1],
+                )
+            tokens, retry_after = _take_token(tokens, updated_at, now, rate, burst)
+            self._buckets[slot * 2], self._buckets[slot * 2 + 1] = tokens, now
+        return retry_after
+
+    def __len__(self) -> int:
+        return sum(1 for fingerprint in self._fingerprints if fingerprint)
+
+
+def _take_token(tokens, updated_at, now, rate, burst):
+    tokens = min(burst, tokens + (now - updated_at) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / rate
+
+
+class RateLimiter:
+    def __init__(self) -> None:
+        self.enabled = False
+        self.store = None
+        self.limits = {}
+        self._stats = {"allowed": 0, "limited": 0}
+
+    def init_app(self, app) -> None:
+        self.enabled = app.config["RATE_LIMIT_ENABLED"]
+        self.limits = {
+            "key": (
+                app.config["RATE_LIMIT_PER_KEY_RATE"],
+                app.config["RATE_LIMIT_PER_KEY_BURST"],
+            ),
+            "address": (
+                app.config["RATE_LIMIT_PER_ADDRESS_RATE"],
+                app.config["RATE_LIMIT_PER_ADDRESS_BURST"],
+            ),
+        }
+        store = {"memory": MemoryBucketStore, "shared": SharedBucketStore}
+        self.store = store[app.config["RATE_LIMIT_BACKEND"]](
+            app.config["RATE_LIMIT_MAX_BUCKETS"]
+        )
+
+    def check(self, address: str, token: str = "") -> float:
+        """
+        Take a token from the address bucket and from the API key bucket,
+        returns 0 if allowed, otherwise the number of seconds to wait.
+        """
+        if not self.enabled:
+            return 0.0
+
+        retry_after = self.store.consume(f"address:{address}", *self.limits["address"])
+        if token:
+            # Don't keep the API keys in memory
+            key = hashlib.blake2b(token.encode("utf-8"), digest_size=16).hexdigest()
+            retry_after = max(
+                retry_after, self.store.consume(f"key:{key}", *self.limits["key"])
+            )
+
+        self._stats["limited" if retry_after else "allowed"] += 1
+        return retry_after
+
+    def stats(self) -> dict:
+        return {**self._stats, "buckets": len(self.store) if self.store else 0}
+
+
+limiter = RateLimiter()
+metrics.register("rate_limit", limiter.stats)
@@ -0,0 +1,186 @@
+# Python imports
+import hashlib
+import multiprocessing
+import random
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+# Flask imports
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import Select, UpdateBase, event
+
+# Local imports
+from app.libs import metrics
+
+"""
+Read replica routing.
+
+The replicas are extra SQLAlchemy binds ("replica_<n>") built from the
+[replicas] uris setting. Keeping them in sync with the primary database
+is left to the replication tool (Litestream, LiteFS, snapshots...).
+
+A SELECT goes to a replica, chosen once per request, when:
+    - the request reads from the replicas: the view is decorated with
+      "read_replica" (app/libs/utils.py),
+    - the request hasn't written to the primary yet,
+    - the client (Authorization header) hasn't written in the last
+      "sticky_seconds", so clients read their own writes despite the lag.
+Everything else goes to the primary. The stickiness is tracked across
+the gunicorn workers in shared memory, the next request of a client usually
+lands on another worker.
+The authentication (API keys, JWT users) always reads from the primary,
+a revoked key or a deactivated user must not work until the replicas
+catch up.
+"""
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            bind_key = router.bind_key_for(clause)
+            if bind_key:
+                return self._db.engines[bind_key]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, "before_flush")
+def _session_flushing(session, flush_context, instances) -> None:
+    # The flush writes, and the reads that follow it must see the changes
+    if has_request_context() and router.enabled():
+        g.replica_wrote = True
+
+
+class StickyClients:
+    """
+    The clients which wrote recently, in a table in shared memory created
+    before gunicorn forks the workers. Every client is hashed to two slots
+    holding a 64 bit fingerprint and the end of its stickiness, a write takes
+    its own slot, a free or expired one, otherwise the one expiring first.
+    A client losing its slot reads from a replica early, at worst.
+    """
+
+    def __init__(self, max_clients: int) -> None:
+        self.max_clients = max_clients
+        self._fingerprints = multiprocessing.RawArray("Q", max_clients)
+        self._until = multiprocessing.RawArray("d", max_clients)
+        # Only the writes are locked, they follow the writing requests
+        self._lock = multiprocessing.Lock()
+
+    def _slots(self, client: bytes):
+        fingerprint = int.from_bytes(client[:8], "little") or 1
+        return fingerprint, (
+            fingerprint % self.max_clients,
+            (fingerprint >> 32) % self.max_clients,
+        )
+
+    def add(self, client: bytes, seconds: float) -> None:
+        fingerprint, slots = self._slots(client)
+        now = time.monotonic()
+        with self._lock:
+            owned = [slot for slot in slots if self._fingerprints[slot] == fingerprint]
+            slot = owned[0] if owned else min(slots, key=lambda slot: self._until[slot])
+            self._fingerprints[slot] = fingerprint
+            self._until[slot] = now + seconds
+
+    def is_sticky(self, client: bytes) -> bool:
+        fingerprint, slots = self._slots(client)
+        now = time.monotonic()
+        return any(
+            self._fingerprints[slot] == fingerprint and self._until[slot] > now
+            for slot in slots
+        )
+
+    def __len__(self) -> int:
+        now = time.monotonic()
+        return sum(1 for until in self._until if until > now)
+
+
+class ReplicaRouter:
+    def __init__(self, max_clients: int = 100000) -> None:
+        self.sticky = StickyClients(max_clients)
+        self._stats = {"replica_reads": 0, "sticky_reads": 0}
+
+    def init_app(self, app) -> None:
+        app.after_request(self._after_request)
+
+    @staticmethod
+    def bind_keys() -> list:
+        # The binds of the current app
+        binds = current_app.config["SQLALCHEMY_BINDS"]
+        return [key for key in binds if key.startswith("replica_")]
+
+    def bind_key_for(self, clause) -> Optional[str]:
+        """
+        Returns the replica bind key to run the clause on,
+        None for the primary database.
+        """
+        if not has_request_context() or not self.bind_keys():
+            return None
+
+        if isinstance(clause, UpdateBase):
+            g.replica_wrote = True
+            return None
+
+        if (
+            not isinstance(clause, Select)
+            or not g.get("read_replica")
+            or g.get("replica_wrote")
+        ):
+            return None
+
+        if self._is_sticky(self._client()):
+            self._stats["sticky_reads"] += 1
+            return None
+
+        if "replica_bind_key" not in g:
+            g.replica_bind_key = random.choice(self.bind_keys())
+        self._stats["replica_reads"] += 1
+        return g.replica_bind_key
+
+    @contextmanager
+    def reading_from_replica(self, enabled: bool = True):
+        """Route the reads within the block to a replica or to the primary."""
+        previous = g.get("read_replica", False)
+        g.read_replica = enabled
+        try:
+            yield
+        finally:
+            g.read_replica = previous
+
+    def enabled(self) -> bool:
+        return bool(self.bind_keys())
+
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            "replicas": len(self.bind_keys()),
+            "sticky_clients": len(self.sticky),
+        }
+
+    def _client(self) -> Optional[bytes]:
+        if "replica_client" not in g:
+            auth_header = request.headers.get("Authorization", "")
+            g.replica_client = (
+                hashlib.blake2b(auth_header.encode("utf-8"), digest_size=16).digest()
+                if auth_header
+                else None
+            )
+        return g.replica_client
+
+    def _is_sticky(self, client: Optional[bytes]) -> bool:
+        if not client or not current_app.config["REPLICAS_STICKY_SECONDS"]:
+            return False
+        return self.sticky.is_sticky(client)
+
+    def _after_request(self, response):
+        sticky_seconds = current_app.config["REPLICAS_STICKY_SECONDS"]
+        client = self._client() if g.get("replica_wrote") else None
+        if client and sticky_seconds:
+            self.sticky.add(client, sticky_seconds)
+        return response
+
+
+router = ReplicaRouter()
+metrics.register("replicas", router.stats)
@@ -0,0 +1,122 @@
+# Python imports
+import abc
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+"""
+Declarative validation of the JSON payloads.
+
+A Schema is built once at import time, each of its fields is compiled into
+a single check function (type, emptiness, length and pattern), so validating
+a payload is one pass over the fields. All the errors are collected, keyed
+by field name, instead of stopping at the first one.
+"""
+
+# This is as good as it gets.
+# More information: https://emailregex.com/index.html
+EMAIL_PATTERN = re.compile(r"(^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$)")
+
+MISSING_ERROR = "Missing required parameter"
+
+_MISSING = object()
+
+
+class Field(abc.ABC):
+    def __init__(self, required: bool = False) -> None:
+        self.required = required
+
+    @abc.abstractmethod
+    def compile(self) -> Callable[[Any], Optional[str]]:
+        """Returns a function checking a value, it returns the error or None."""
+
+
+class String(Field):
+    def __init__(
+        self,
+        required: bool = False,
+        max_length: int = 255,
+        pattern: Optional["re.Pattern"] = None,
+        pattern_error: str = "Invalid format",
+    ) -> None:
+        super().__init__(required)
+        self.max_length = max_length
+        self.pattern = pattern
+        self.pattern_error = pattern_error
+
+    def compile(self):
+        max_length, match, pattern_error = (
+            self.max_length,
+            self.pattern.match if self.pattern else None,
+            self.pattern_error,
+        )
+        too_long = f"Must be at most {max_length} characters"
+
+        def check(value):
+            if type(value) is not str:
+                return "Must be a string"
+            if not value:
+                return "Must not be empty"
+            if len(value) > max_length:
+                return too_long
+            if match and not match(value):
+                return pattern_error
+            return None
+
+        return check
+
+
+class Email(String):
+    def __init__(self, required: bool = False) -> None:
+        super().__init__(required, 254, EMAIL_PATTERN, "Invalid email format")
+
+
+class Boolean(Field):
+    def compile(self):
+        def check(value):
+            return None if type(value) is bool else "Must be true or false"
+
+        return check
+
+
+class Schema:
+    def __init__(self, **fields: Field) -> None:
+        self._checks = tuple(
+            (name, field.required, field.compile()) for name, field in fields.items()
+        )
+
+    def validate(self, data, partial: bool = False) -> Tuple[dict, Dict[str, str]]:
+        """
+        Returns the known fields of the payload and the errors.
+        With "partial" the required fields may be left out (updates).
+        Fields without a schema are ignored.
+        """
+        if not isinstance(data, dict):
+            return {}, {"payload": "Expected a JSON object"}
+
+        values, errors = {}, {}
+        for name, required, check in self._checks:
+            value = data.get(name, _MISSING)
+            if value is _MISSING:
+                if required and not partial:
+                    errors[name] = MISSING_ERROR
+            else:
+                error = check(value)
+                if error:
+                    errors[name] = error
+                else:
+                    values[name] = value
+        return values, errors
+
+    def validate_many(
+        self, items, partial: bool = False
+    ) -> Tuple[List[dict], Dict[int, Dict[str, str]]]:
+        """
+        Validate a list of payloads, the errors are keyed by index.
+        """
+        values, errors = [], {}
+        for index, data in enumerate(items):
+            item_values, item_errors = self.validate(data, partial)
+            values.append(item_values)
+            if item_errors:
+                errors[index] = item_errors
+        return values, errors
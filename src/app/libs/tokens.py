@@ -0,0 +1,111 @@
+# Python imports
+import hashlib
+import inspect
+import threading
+import time
+from collections import OrderedDict
+
+# Flask imports
+from flask_jwt_extended import JWTManager
+from flask_jwt_extended.config import config
+
+# Local imports
+from app.libs import metrics
+
+"""
+JWT decoding with a cache of the verified claims.
+
+A client sends the same access token on every request until it expires,
+decoding it means parsing it, decoding it twice (unverified then verified)
+and checking its HMAC signature. The verified claims are kept per worker
+in an LRU, keyed by a digest of the token and the decode key, until the token
+"exp" time or for [token_cache] ttl seconds, whichever comes first.
+
+Only the decoding is cached: flask_jwt_extended runs the token type,
+freshness, blocklist (revocation) and custom claims checks on every request.
+Invalid and expired tokens are never cached.
+
+flask_jwt_extended has no public hook around the decoding, the cache overrides
+JWTManager._decode_jwt_from_config, called by decode_token and the request
+verification. The package is pinned in requirements.txt, init_app refuses
+a version without this method, and tests/test_jwt.py checks it is still called.
+"""
+
+# Parameters of the overridden JWTManager method
+DECODE_PARAMETERS = ["self", "encoded_token", "csrf_value", "allow_expired"]
+
+
+class CachingJWTManager(JWTManager):
+    def __init__(self, app=None, add_context_processor: bool = False) -> None:
+        self.ttl = 0
+        self.max_entries = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "expired": 0}
+        super().__init__(app, add_context_processor)
+
+    def init_app(self, app, add_context_processor: bool = False) -> None:
+        decode = getattr(JWTManager, "_decode_jwt_from_config", None)
+        if (
+            decode is None
+            or list(inspect.signature(decode).parameters) != DECODE_PARAMETERS
+        ):
+            raise RuntimeError(
+                "Unsupported flask_jwt_extended version, the token cache "
+                "overrides JWTManager._decode_jwt_from_config"
+            )
+
+        super().init_app(app, add_context_processor)
+        self.ttl = app.config["TOKEN_CACHE_TTL"]
+        self.max_entries = app.config["TOKEN_CACHE_MAX_ENTRIES"]
+        self.clear()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "hit_ratio": self._stats["hits"] / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+        }
+
+    def _decode_jwt_from_config(
+        self, encoded_token: str, csrf_value=None, allow_expired: bool = False
+    ) -> dict:
+        # The CSRF tokens (cookies) and the expired tokens aren't cached
+        if not self.ttl or csrf_value is not None or allow_expired:
+            return super()._decode_jwt_from_config(
+                encoded_token, csrf_value, allow_expired
+            )
+
+        key = hashlib.blake2b(
+            f"{config.decode_key}\0{encoded_token}".encode("utf-8"), digest_size=16
+        ).digest()
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return dict(entry[1])
+
+            if entry:
+                self._stats["expired"] += 1
+                del self._entries[key]
+            self._stats["misses"] += 1
+
+        # Raises on invalid or expired tokens
+        claims = super()._decode_jwt_from_config(encoded_token)
+        expires_at = min(claims.get("exp", now + self.ttl), now + self.ttl)
+        with self._lock:
+            self._entries[key] = (expires_at, claims)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return dict(claims)
+
+
+jwt = CachingJWTManager()
+metrics.register("token_cache", jwt.stats)
@@ -0,0 +1,69 @@
+# Python imports
+from datetime import datetime, timezone
+from typing import Optional
+
+# Third-party imports
+from sqlalchemy.dialects.sqlite import insert
+
+# Local imports
+from app import db
+from app.libs import metrics
+from app.libs.writebehind import WriteBehindBuffer
+from app.models import UsageCounter
+
+"""
+Per user and per API key usage counters (request count and last access).
+
+Writing them on every request would turn every authenticated read into
+a database write, instead they are aggregated in memory per worker and
+upserted in bulk by a write-behind buffer.
+"""
+
+
+class UsageAccumulator(WriteBehindBuffer):
+    def merge(self, pending, subject: str, subject_id: str, seen_at) -> None:
+        count, _ = pending.get((subject, subject_id), (0, None))
+        pending[(subject, subject_id)] = (count + 1, seen_at)
+
+    def write(self, pending) -> None:
+        statement = insert(UsageCounter)
+        statement = statement.on_conflict_do_update(
+            index_elements=[UsageCounter.subject, UsageCounter.subject_id],
+            set_={
+                "request_count": UsageCounter.request_count
+                + statement.excluded.request_count,
+                "last_seen_at": db.func.max(
+                    db.func.coalesce(
+                        UsageCounter.last_seen_at, statement.excluded.last_seen_at
+                    ),
+                    statement.excluded.last_seen_at,
+                ),
+            },
+        )
+        db.session.execute(
+            statement,
+            [
+                {
+                    "subject": subject,
+                    "subject_id": subject_id,
+                    "request_count": count,
+                    "last_seen_at": seen_at,
+                }
+                for (subject, subject_id), (count, seen_at) in pending.items()
+            ],
+        )
+
+    def restore(self, pending, failed) -> None:
+        for key, (count, seen_at) in failed.items():
+            newer_count, newer_seen_at = pending.get(key, (0, seen_at))
+            pending[key] = (count + newer_count, newer_seen_at)
+
+    def record(self, user_id: str, key_id: Optional[str] = None) -> None:
+        seen_at = datetime.now(timezone.utc).replace(tzinfo=None)
+        self.push("user", user_id, seen_at)
+        if key_id:
+            self.push("api_key", key_id, seen_at)
+
+
+usage = UsageAccumulator()
+metrics.register("usage", usage.stats)
@@ -1,16 +1,30 @@
 # Python imports
 import hashlib
-import re
-from functools import wraps
+import ipaddress
+import math
+from functools import lru_cache, wraps
 from typing import Callable, Optional, Tuple
 
 # Flask imports
-from flask import abort, jsonify, request
+from flask import abort, current_app, g, jsonify, make_response, request
 from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
 
 # Local imports
-from app import log
-from app.models import User
+from app import db, log
+from app.libs.cache import response_cache
+from app.libs.idempotency import idempotency
+from app.libs.keyfilter import key_filter
+from app.libs.keys import (
+    hash_api_key,
+    legacy_hash_api_key,
+    parse_api_key,
+    verify_api_key,
+)
+from app.libs.ratelimit import limiter
+from app.libs.replicas import router
+from app.libs.schema import EMAIL_PATTERN
+from app.libs.usage import usage
+from app.models import ApiKey, User
 
 """
 Here are several functions intended for quick project prototyping.
@@ -26,11 +40,9 @@ the API routes "api/routes.py".
 
 def validate_email(email: str) -> bool:
     """
-    This is as good as it gets.
-    More information: https://emailregex.com/index.html
+    The pattern is compiled once in app/libs/schema.py.
     """
-    email_pattern = re.compile(r"(^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$)")
-    return bool(email_pattern.match(email))
+    return bool(EMAIL_PATTERN.match(email))
 
 
 def get_api_user() -> Optional[User]:
@@ -38,12 +50,18 @@ def get_api_user() -> Optional[User]:
     This will either return a user or None.
     Works for both JWT and normal API users.
     """
-    if _get_api_user()[0]:
-        return _get_api_user()[0]
+    user = _get_api_user()[0]
+    if user:
+        return user
 
     if verify_jwt_in_request():
-        user = User.query.filter(User.id == get_jwt_identity()).first()
+        # Like the API keys, see "_find_api_key_user"
+        with router.reading_from_replica(False):
+            user = User.query.filter(
+                User.id == get_jwt_identity(), User.deleted_at.is_(None)
+            ).first()
         if user:
+            usage.record(user.id)
             return user
 
 
@@ -64,6 +82,95 @@ def api_key_required(f: Callable) -> Callable:
     return decorator
 
 
+def rate_limited(f: Callable) -> Callable:
+    """
+    Token bucket rate limiting per source address and per API key.
+    Place it above "api_key_required" so refused requests never reach
+    the API key lookup.
+    """
+
+    @wraps(f)
+    def decorator(*args, **kwargs):
+        auth_header = request.headers.get("Authorization", "")
+        token = (
+            auth_header[len("Bearer ") :] if auth_header.startswith("Bearer ") else ""
+        )
+        retry_after = limiter.check(get_source_addr(), token.strip())
+        if retry_after:
+            response = jsonify({"error": "Too many requests"})
+            response.headers["Retry-After"] = str(math.ceil(retry_after))
+            return response, 429
+
+        return f(*args, **kwargs)
+
+    return decorator
+
+
+def read_replica(f: Callable) -> Callable:
+    """
+    Read from a replica database in this endpoint, see app/libs/replicas.py.
+    Only use it on endpoints that don't write.
+    """
+
+    @wraps(f)
+    def decorator(*args, **kwargs):
+        with router.reading_from_replica():
+            return f(*args, **kwargs)
+
+    return decorator
+
+
+def idempotent(f: Callable) -> Callable:
+    """
+    Replay the stored response of requests repeated with the same
+    "Idempotency-Key" header, see app/libs/idempotency.py.
+    Place it below "api_key_required", only authenticated requests are stored.
+    """
+
+    @wraps(f)
+    def decorator(*args, **kwargs):
+        key = request.headers.get("Idempotency-Key")
+        if key is None:
+            return f(*args, **kwargs)
+
+        if not key.strip() or len(key) > 255:
+            return jsonify({"error": "Invalid Idempotency-Key header"}), 400
+
+        # The key is only valid with the same credentials
+        scope = "\0".join((request.headers.get("Authorization", ""), key))
+        key_digest = hash_api_key(f"idempotency\0{scope}")
+        fingerprint = hashlib.sha256(
+            "\0".join((request.method, request.full_path)).encode("utf-8")
+            + b"\0"
+            + request.get_data()
+        ).hexdigest()
+
+        stored = idempotency.claim(key_digest, fingerprint)
+        if stored is not None:
+            if stored.fingerprint != fingerprint:
+                error = "The Idempotency-Key was used by a different request"
+                return jsonify({"error": error}), 422
+            if stored.status_code is None:
+                error = "A request with this Idempotency-Key is in progress"
+                return jsonify({"error": error}), 409
+            return idempotency.replay(stored)
+
+        try:
+            response = make_response(f(*args, **kwargs))
+        except Exception:
+            idempotency.release(key_digest)
+            raise
+
+        # Server errors can be retried
+        if response.status_code >= 500 or response.is_streamed:
+            idempotency.release(key_digest)
+        else:
+            idempotency.save(key_digest, response)
+        return response
+
+    return decorator
+
+
 def admin_required(f: Callable) -> Callable:
     """
     Custom admin login required decorator.
@@ -84,31 +191,100 @@ def admin_required(f: Callable) -> Callable:
     return decorator
 
 
+def cached_response(f: Callable) -> Callable:
+    """
+    Serve the response from the response cache while the users haven't
+    changed, see app/libs/cache.py.
+    Place it at the bottom of the decorator stack, below "admin_required",
+    so the cached responses are only served to authorized requests.
+    """
+
+    @wraps(f)
+    def decorator(*args, **kwargs):
+        if not current_app.config["RESPONSE_CACHE_ENABLED"]:
+            return f(*args, **kwargs)
+
+        key = (
+            request.endpoint,
+            request.host_url,
+            tuple(sorted(kwargs.items())),
+            tuple(sorted(request.args.items(multi=True))),
+        )
+        cached = response_cache.get(key)
+        if cached:
+            body, status_code, mimetype = cached
+            response = current_app.response_class(body, status_code, mimetype=mimetype)
+            response.headers["X-Cache"] = "hit"
+            return response
+
+        # Read before running the endpoint, so a change committed meanwhile
+        # makes the entry stale
+        generation = response_cache.generation
+        response = make_response(f(*args, **kwargs))
+        if response.status_code == 200 and not response.is_streamed:
+            response_cache.set(
+                key, generation, (response.get_data(), 200, response.mimetype)
+            )
+        response.headers["X-Cache"] = "miss"
+        return response
+
+    return decorator
+
+
+@lru_cache(maxsize=None)
+def _trusted_networks(proxies: Tuple[str, ...]) -> tuple:
+    return tuple(ipaddress.ip_network(proxy, strict=False) for proxy in proxies)
+
+
+def _is_trusted_proxy(addr: str) -> bool:
+    try:
+        addr = ipaddress.ip_address(addr)
+    except ValueError:
+        return False
+    networks = _trusted_networks(tuple(current_app.config["TRUSTED_PROXIES"]))
+    return any(addr in network for network in networks)
+
+
 def get_source_addr() -> str:
     """
     The default flask "request.remote_addr" does not work when
-    using a proxy or localhost.
+    using a proxy.
 
-    This function provides the source IP of the request,
-    regardless of its origin. It should function properly with
-    direct requests, local requests, and requests that have been proxied.
+    This function provides the source IP of the request. The
+    "X-Forwarded-For" header is only used when the request comes from
+    one of the "trusted_proxies", the client address is the last one
+    that wasn't added by a trusted proxy. Other clients could send any
+    address in the header.
 
     If you are proxying traffic from another server, such as Nginx,
     be sure to enable the forwarded header.
     More information:
     https://www.nginx.com/resources/wiki/start/topics/examples/forwarded/
     """
-    if "X-Forwarded-For" in request.headers:
-        return request.headers["X-Forwarded-For"].split(",")[0].strip()
-    else:
-        return request.remote_addr or "127.0.0.1"
+    remote_addr = request.remote_addr or "127.0.0.1"
+    if "X-Forwarded-For" not in request.headers or not _is_trusted_proxy(remote_addr):
+        return remote_addr
+
+    forwarded = [addr.strip() for addr in request.headers["X-Forwarded-For"].split(",")]
+    for addr in reversed(forwarded):
+        if not _is_trusted_proxy(addr):
+            return addr
+    return forwarded[0]
 
 
 def _get_api_user() -> Tuple[Optional[User], Optional[str], Optional[int]]:
     """
     This function validates the authorization token then returns
     the user database object if valid.
+    The result is kept for the rest of the request, so stacked decorators
+    don't authenticate the same request twice.
     """
+    if "api_user" not in g:
+        g.api_user = _authenticate_api_key()
+    return g.api_user
+
+
+def _authenticate_api_key() -> Tuple[Optional[User], Optional[str], Optional[int]]:
     auth_header = request.headers.get("Authorization", "")
     if not auth_header.startswith("Bearer "):
         return None, "Missing or invalid Authorization header", 401
@@ -117,17 +293,90 @@ def _get_api_user() -> Tuple[Optional[User], Optional[str], Optional[int]]:
     if not api_key:
         return None, "A valid authorization token is required", 400
 
+    # Recently rejected keys are refused without hashing or querying again
+    if key_filter.is_rejected(api_key):
+        return None, "A valid authorization token is required", 403
+
     try:
-        hashed_api_key = hashlib.sha256(api_key.encode("utf-8")).hexdigest()
-        user = User.query.filter_by(hashed_api_key=hashed_api_key).first()
+        parsed_api_key = parse_api_key(api_key)
+        key_id = parsed_api_key[0] if parsed_api_key else None
+        user = _find_api_key_user(api_key, parsed_api_key)
+
         if not user:
+            key_filter.reject(api_key)
             return None, "A valid authorization token is required", 403
 
         if not user.is_active:
             return None, "Inactive account", 403
 
+        usage.record(user.id, key_id)
+
     except Exception as err:
         log.error("API auth error: %s", err)
         return None, "Internal server error", 500
 
     return user, None, None
+
+
+def _find_api_key_user(api_key: str, parsed_api_key) -> Optional[User]:
+    # Always on the primary, even in "read_replica" endpoints: a lagging
+    # replica would still accept revoked keys and deactivated or deleted users.
+    with router.reading_from_replica(False):
+        if parsed_api_key:
+            return _get_prefixed_api_key_user(*parsed_api_key)
+        return _get_api_key_user(api_key)
+
+
+def _get_prefixed_api_key_user(key_id: str, secret: str) -> Optional[User]:
+    if not key_filter.might_exist(key_id):
+        return None
+
+    row = db.session.execute(
+        db.select(ApiKey.hashed_secret, User)
+        .join(ApiKey.user)
+        .where(ApiKey.key_id == key_id, User.deleted_at.is_(None))
+    ).first()
+    if not row:
+        key_filter.report_false_positive()
+        return None
+
+    if not verify_api_key(secret, row.hashed_secret):
+        return None
+
+    return row.User
+
+
+def _get_api_key_user(api_key: str) -> Optional[User]:
+    """
+    Look up a key that isn't in the prefixed format by the digest of the whole key.
+    """
+    hashed_api_key = hash_api_key(api_key)
+    if key_filter.might_exist(hashed_api_key):
+        user = User.query.filter_by(
+            hashed_api_key=hashed_api_key, deleted_at=None
+        ).first()
+        if user:
+            return user
+        key_filter.report_false_positive()
+
+    if current_app.config["LEGACY_API_KEY_DIGESTS"]:
+        return _upgrade_legacy_api_key(api_key, hashed_api_key)
+
+
+def _upgrade_legacy_api_key(api_key: str, hashed_api_key: str) -> Optional[User]:
+    """
+    Look up a key hashed by an older version (plain SHA-256),
+    then store its keyed digest in place of the old one.
+    """
+    legacy_hashed_api_key = legacy_hash_api_key(api_key)
+    if not key_filter.might_exist(legacy_hashed_api_key):
+        return None
+
+    user = User.query.filter_by(
+        hashed_api_key=legacy_hashed_api_key, deleted_at=None
+    ).first()
+    if user:
+        user.hashed_api_key = hashed_api_key
+        db.session.commit()
+        log.info('User "%s" API key digest has been upgraded', user.email)
+    return user
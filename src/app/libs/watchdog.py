@@ -0,0 +1,107 @@
+# Python imports
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+# Local imports
+from app import log
+from app.libs import metrics
+
+"""
+Worker memory watchdog, for the gunicorn launcher (src/bin/run).
+
+Long running workers slowly grow (identity maps, caches, fragmentation).
+Every [workers] rss_check_every requests, a worker samples its resident
+memory (RSS) and when it's over max_rss_mb, it stops accepting requests:
+gunicorn lets it finish the requests in flight, then replaces it. Along with
+the gunicorn "max_requests" (with jitter, so the workers don't all restart
+at once), this bounds the memory of long running workers.
+
+The recycles are counted by reason in shared memory, created before gunicorn
+forks the workers, so any worker reports the totals in the metrics.
+"""
+
+RECYCLE_REASONS = ("memory", "max_requests", "other")
+
+
+def current_rss() -> int:
+    """The resident memory of this process, in bytes."""
+    try:
+        with open("/proc/self/statm", "rb") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Not Linux, the peak RSS is the closest value available
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class MemoryWatchdog:
+    def __init__(self) -> None:
+        self.max_rss = 0
+        self.check_every = 0
+        self._requests = 0
+        self._over_limit = False
+        self._recycles = multiprocessing.RawArray("Q", len(RECYCLE_REASONS))
+        # Time, pid and RSS of the last recycle
+        self._last_recycle = multiprocessing.RawArray("d", 3)
+        self._lock = multiprocessing.Lock()
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def init_app(self, app) -> None:
+        self.max_rss = app.config["WORKERS_MAX_RSS_MB"] * 1024 * 1024
+        self.check_every = max(1, app.config["WORKERS_RSS_CHECK_EVERY"])
+
+    def post_request(self, worker, req, environ, resp) -> None:
+        """The gunicorn "post_request" hook."""
+        self._requests += 1
+        if not self.max_rss or self._over_limit or self._requests % self.check_every:
+            return
+
+        rss = current_rss()
+        if rss > self.max_rss:
+            log.warning(
+                "Worker %s uses %d MiB over the %d MiB limit, recycling it",
+                worker.pid,
+                rss // 2**20,
+                self.max_rss // 2**20,
+            )
+            self._over_limit = True
+            # Stops accepting requests, the ones in flight are completed
+            worker.alive = False
+
+    def worker_exit(self, server, worker) -> None:
+        """The gunicorn "worker_exit" hook, counts the recycled workers."""
+        if self._over_limit:
+            reason = "memory"
+        elif worker.max_requests and worker.nr >= worker.max_requests:
+            reason = "max_requests"
+        else:
+            reason = "other"
+
+        with self._lock:
+            self._recycles[RECYCLE_REASONS.index(reason)] += 1
+            self._last_recycle[:] = [time.time(), worker.pid, current_rss()]
+
+    def stats(self) -> dict:
+        recycled_at, pid, rss = self._last_recycle[:]
+        return {
+            "rss": current_rss(),
+            "max_rss": self.max_rss,
+            "requests": self._requests,
+            "recycles": dict(zip(RECYCLE_REASONS, self._recycles[:])),
+            "last_recycle": (
+                {"at": recycled_at, "pid": int(pid), "rss": int(rss)}
+                if recycled_at
+                else None
+            ),
+        }
+
+    def _after_fork(self) -> None:
+        self._requests = 0
+        self._over_limit = False
+
+
+watchdog = MemoryWatchdog()
+metrics.register("workers", watchdog.stats)
@@ -0,0 +1,151 @@
+# Python imports
+import abc
+import atexit
+import os
+import threading
+
+# Local imports
+from app import db, log
+from app.libs.background import ProcessThread
+
+"""
+Write-behind buffers, for bookkeeping writes that shouldn't slow down requests.
+
+The data is collected in memory and written in bulk from a background thread,
+every "interval" seconds or as soon as "max_pending" items are waiting.
+Each process (gunicorn worker) has its own buffer and thread, the pending data
+is dropped in forked children (it belongs to the parent) and flushed when the
+process exits.
+
+The writes are best-effort: a failed write is put back into the pending data
+and retried with the next flush, up to "max_retries" times in a row, then it's
+dropped. The pending data of a killed process (SIGKILL, out of memory) is lost.
+The dropped items are counted in the "dropped" stat.
+"""
+
+
+class WriteBehindBuffer(abc.ABC):
+    def __init__(self) -> None:
+        self.app = None
+        self.interval = 0
+        self.max_pending = 0
+        self.max_retries = 0
+        self._pending = self.empty()
+        self._failures = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = ProcessThread(self._run, type(self).__name__)
+        self._stats = {
+            "flushes": 0,
+            "flushed_items": 0,
+            "errors": 0,
+            "retries": 0,
+            "dropped": 0,
+        }
+        os.register_at_fork(after_in_child=self._after_fork)
+        atexit.register(self._flush_at_exit)
+
+    def init_app(
+        self, app, interval: float, max_pending: int, max_retries: int = 3
+    ) -> None:
+        self.app = app
+        self.interval = interval
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+
+    def empty(self):
+        """Returns a new empty container for the pending data."""
+        return {}
+
+    @abc.abstractmethod
+    def merge(self, pending, *args) -> None:
+        """Adds an item to the pending data, called with the lock held."""
+
+    @abc.abstractmethod
+    def write(self, pending) -> None:
+        """Writes the pending data, called within an app context."""
+
+    @abc.abstractmethod
+    def restore(self, pending, failed) -> None:
+        """
+        Puts the data of a failed write back into the pending data,
+        called with the lock held.
+        """
+
+    def push(self, *args) -> None:
+        with self._lock:
+            self.merge(self._pending, *args)
+            size = len(self._pending)
+
+        if self.interval:
+            self._thread.start()
+        if self.max_pending and size >= self.max_pending:
+            self._wakeup.set()
+
+    def pending(self):
+        with self._lock:
+            return self._pending.copy()
+
+    def flush(self) -> int:
+        """
+        Write the pending data, returns the number of written items.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, self.empty()
+
+        if not pending or not self.app:
+            return 0
+
+        with self.app.app_context():
+            try:
+                self.write(pending)
+                db.session.commit()
+            except Exception as err:
+                db.session.rollback()
+                self._stats["errors"] += 1
+                self._retry(pending, err)
+                return 0
+
+        self._failures = 0
+        self._stats["flushes"] += 1
+        self._stats["flushed_items"] += len(pending)
+        return len(pending)
+
+    def stats(self) -> dict:
+        return {**self._stats, "pending": len(self._pending)}
+
+    def _retry(self, failed, err: Exception) -> None:
+        name = type(self).__name__
+        self._failures += 1
+        if self._failures > self.max_retries:
+            self._failures = 0
+            self._stats["dropped"] += len(failed)
+            log.error(
+                "%s: failed writing, dropped %d items: %s", name, len(failed), err
+            )
+            return
+
+        self._stats["retries"] += 1
+        log.error("%s: failed writing, will retry: %s", name, err)
+        with self._lock:
+            self.restore(self._pending, failed)
+
+    def _flush_at_exit(self) -> None:
+        self.flush()
+        if self._pending:
+            self._stats["dropped"] += len(self._pending)
+            log.error(
+                "%s: dropped %d items at exit", type(self).__name__, len(self._pending)
+            )
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def _after_fork(self) -> None:
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pending = self.empty()
+        self._failures = 0
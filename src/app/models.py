@@ -1,17 +1,103 @@
 # Python imports
-import hashlib
+import sqlite3
 import uuid
+from functools import lru_cache
+from typing import Optional, Tuple
+
+# Third-party imports
+from sqlalchemy import DDL, event
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.types import TypeDecorator
 
 # Local imports
-from app import db
+from app import db, log
+from app.libs.keys import (
+    KEY_ID_LENGTH,
+    gen_api_key,
+    hash_api_key,
+    parse_api_key,
+    random_digest,
+    verify_api_key,
+)
+
+
+class CompactType(TypeDecorator):
+    """
+    A string column that is stored as raw bytes when the engine has
+    compact storage enabled ("compact_storage" setting).
+    The conversion is transparent, the application always sees strings.
+    """
+
+    impl = db.String
+    cache_ok = True
+
+    def __init__(self, length: int, compact_length: int) -> None:
+        super().__init__(length)
+        self.length = length
+        self.compact_length = compact_length
+
+    def load_dialect_impl(self, dialect):
+        if getattr(dialect, "compact_storage", False):
+            return dialect.type_descriptor(db.LargeBinary(self.compact_length))
+        return dialect.type_descriptor(db.String(self.length))
+
+    def process_bind_param(self, value, dialect):
+        if value is None or not getattr(dialect, "compact_storage", False):
+            return value
+        try:
+            return self.to_bytes(value)
+        except ValueError:
+            # Not a valid value, store it as is so it never matches a valid one
+            return value.encode("utf-8")
+
+    def process_result_value(self, value, dialect):
+        if value is None or isinstance(value, str):
+            return value
+        return self.from_bytes(value)
+
+    def to_bytes(self, value: str) -> bytes:
+        """Converts a valid value to its stored bytes, raises ValueError."""
+        raise NotImplementedError
+
+    def from_bytes(self, value: bytes) -> str:
+        """Converts stored bytes back to the value."""
+        raise NotImplementedError
+
+
+class UUIDString(CompactType):
+    """A UUID string, stored as 16 bytes in compact mode."""
+
+    cache_ok = True
+
+    def __init__(self) -> None:
+        super().__init__(36, 16)
+
+    def to_bytes(self, value: str) -> bytes:
+        return uuid.UUID(value).bytes
+
+    def from_bytes(self, value: bytes) -> str:
+        return str(uuid.UUID(bytes=value))
+
+
+class HexDigest(CompactType):
+    """A hex encoded SHA-256 digest, stored as 32 bytes in compact mode."""
+
+    cache_ok = True
+
+    def __init__(self) -> None:
+        super().__init__(150, 32)
+
+    def to_bytes(self, value: str) -> bytes:
+        return bytes.fromhex(value)
+
+    def from_bytes(self, value: bytes) -> str:
+        return value.hex()
 
 
 class Base(db.Model):
     __abstract__ = True
 
-    id = db.Column(
-        db.String(36), unique=True, primary_key=True, default=lambda: str(uuid.uuid4())
-    )
+    id = db.Column(UUIDString(), primary_key=True, default=lambda: str(uuid.uuid4()))
     created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
     updated_at = db.Column(
         db.DateTime,
@@ -20,32 +106,548 @@ class Base(db.Model):
     )
 
 
+def _email_domain(email):
+    """
+    SQL expression extracting the domain part of an email column.
+    The constants are rendered inline rather than as bound parameters,
+    otherwise SQLite can't match queries against the expression index.
+    """
+    at, one = db.literal_column("'@'"), db.literal_column("1")
+    return db.func.substr(email, db.func.instr(email, at) + one)
+
+
+# Users deleted with soft delete enabled are only marked as deleted,
+# then removed by the purger (app/libs/purger.py).
+NOT_DELETED = db.text("deleted_at IS NULL")
+
+
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        # Composite indexes backing the filters and sort keys
+        # of the users list endpoint, partial indexes over the users
+        # that aren't deleted.
+        db.Index("ix_users_created_at", "created_at", sqlite_where=NOT_DELETED),
+        db.Index(
+            "ix_users_is_admin_created_at",
+            "is_admin",
+            "created_at",
+            sqlite_where=NOT_DELETED,
+        ),
+        db.Index(
+            "ix_users_is_active_created_at",
+            "is_active",
+            "created_at",
+            sqlite_where=NOT_DELETED,
+        ),
+        db.Index(
+            "ix_users_last_name_first_name",
+            "last_name",
+            "first_name",
+            sqlite_where=NOT_DELETED,
+        ),
+        # The deleted users waiting to be purged
+        db.Index(
+            "ix_users_deleted_at",
+            "deleted_at",
+            sqlite_where=db.text("deleted_at IS NOT NULL"),
+        ),
+    )
 
     first_name = db.Column(db.String, nullable=True, unique=False)
     last_name = db.Column(db.String, nullable=True, unique=False)
     email = db.Column(db.String, nullable=False, unique=True)
     is_admin = db.Column(db.Boolean, default=False)
     is_active = db.Column(db.Boolean, default=True)
-    hashed_api_key = db.Column(db.String(150), nullable=False)
+    # Accounts created without an API key get a random digest
+    # that no key matches, until one is set or generated.
+    hashed_api_key = db.Column(
+        HexDigest(), nullable=False, index=True, default=random_digest
+    )
+    deleted_at = db.Column(db.DateTime, nullable=True)
+
+    @hybrid_property
+    def email_domain(self) -> str:
+        return self.email.split("@", 1)[-1]
 
-    def __init__(self, **kwargs) -> None:
-        super().__init__(**kwargs)
+    @email_domain.inplace.expression
+    @classmethod
+    def _email_domain_expression(cls):
+        return _email_domain(cls.email)
 
-        # When a User is created, if no API key is given
-        # Generate and hash a new API Key
-        if not self.hashed_api_key:
-            self.gen_api_key()
+    api_keys = db.relationship(
+        "ApiKey", back_populates="user", cascade="all, delete-orphan"
+    )
 
-    def gen_api_key(self) -> str:
-        new_api_key = str(uuid.uuid4())
-        self.hashed_api_key = hashlib.sha256(new_api_key.encode("utf-8")).hexdigest()
+    def gen_api_key(self, name: Optional[str] = None) -> str:
+        """
+        Replace all the user API keys with a newly generated one,
+        returns the new API key.
+        """
+        self.revoke_api_keys()
+        _, new_api_key = self.add_api_key(name)
         return new_api_key
 
+    def add_api_key(self, name: Optional[str] = None) -> Tuple["ApiKey", str]:
+        """
+        Generate an additional API key, the existing ones stay valid.
+        """
+        key_id, secret, new_api_key = gen_api_key()
+        api_key = ApiKey(key_id=key_id, hashed_secret=hash_api_key(secret), name=name)
+        self.api_keys.append(api_key)
+        return api_key, new_api_key
+
     def set_api_key(self, key) -> None:
-        self.hashed_api_key = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        """
+        Replace all the user API keys with the given custom key.
+        """
+        self.revoke_api_keys()
+        self.hashed_api_key = hash_api_key(key)
+
+    def revoke_api_keys(self) -> None:
+        self.api_keys = []
+        self.hashed_api_key = random_digest()
 
     def check_api_key(self, key) -> bool:
-        hashed_api_key = hashlib.sha256(key.encode("utf-8")).hexdigest()
-        return self.hashed_api_key == hashed_api_key
+        parsed = parse_api_key(key)
+        if not parsed:
+            return verify_api_key(key, self.hashed_api_key)
+
+        key_id, secret = parsed
+        return any(
+            api_key.key_id == key_id and verify_api_key(secret, api_key.hashed_secret)
+            for api_key in self.api_keys
+        )
+
+
+def delete_usage_counters(user_ids: list) -> None:
+    """Delete the usage counters of the users and of their API keys."""
+    key_ids = db.select(ApiKey.key_id).where(ApiKey.user_id.in_(user_ids))
+    db.session.execute(
+        db.delete(UsageCounter).where(
+            db.or_(
+                db.and_(
+                    UsageCounter.subject == "user",
+                    UsageCounter.subject_id.in_(user_ids),
+                ),
+                db.and_(
+                    UsageCounter.subject == "api_key",
+                    UsageCounter.subject_id.in_(key_ids),
+                ),
+            )
+        )
+    )
+
+
+def purge_users(user_ids: list) -> None:
+    """
+    Delete the users along with their API keys and usage counters,
+    in bulk without loading them. The caller commits.
+    """
+    if not user_ids:
+        return
+
+    delete_usage_counters(user_ids)
+    db.session.execute(db.delete(ApiKey).where(ApiKey.user_id.in_(user_ids)))
+    db.session.execute(db.delete(User).where(User.id.in_(user_ids)))
+
+
+class ApiKey(Base):
+    __tablename__ = "api_keys"
+
+    user_id = db.Column(
+        UUIDString(),
+        db.ForeignKey("users.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    )
+    key_id = db.Column(db.String(KEY_ID_LENGTH), nullable=False, unique=True)
+    hashed_secret = db.Column(HexDigest(), nullable=False)
+    name = db.Column(db.String, nullable=True)
+
+    user = db.relationship("User", back_populates="api_keys")
+
+
+class UsageCounter(db.Model):
+    """
+    Request count and last access of a user ("user" subject) or
+    an API key ("api_key" subject, by key id).
+    Written in bulk by app/libs/usage.py, it can lag behind by a few seconds.
+    """
+
+    __tablename__ = "usage_counters"
+
+    subject = db.Column(db.String(16), primary_key=True)
+    subject_id = db.Column(db.String(36), primary_key=True)
+    request_count = db.Column(db.Integer, nullable=False, default=0)
+    last_seen_at = db.Column(db.DateTime, nullable=True)
+
+
+class Job(Base):
+    """
+    A background job run by app/libs/jobs.py, its state is served by
+    "/api/v1/jobs/<id>". The process running the job renews "heartbeat_at",
+    jobs whose heartbeat is older than the lease timeout are reported
+    as failed.
+    """
+
+    __tablename__ = "jobs"
+
+    kind = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.String(16), nullable=False, default="queued")
+    params = db.Column(db.JSON, nullable=False, default=dict)
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer, nullable=True)
+    result = db.Column(db.JSON, nullable=True)
+    error = db.Column(db.String, nullable=True)
+    created_by = db.Column(UUIDString(), nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+
+class IdempotencyKey(db.Model):
+    """
+    The stored response of a request sent with an "Idempotency-Key" header,
+    see app/libs/idempotency.py. Rows without a status code are requests
+    still in progress.
+    """
+
+    __tablename__ = "idempotency_keys"
+
+    key_digest = db.Column(HexDigest(), primary_key=True)
+    fingerprint = db.Column(db.String(64), nullable=False)
+    status_code = db.Column(db.Integer, nullable=True)
+    headers = db.Column(db.JSON, nullable=True)
+    body = db.Column(db.LargeBinary, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+class Lease(db.Model):
+    """
+    A lease held by a single process at a time, whatever the host it runs on,
+    such as the deleted users purge (app/libs/purger.py). Another process
+    takes it over once released or expired.
+    """
+
+    __tablename__ = "leases"
+
+    name = db.Column(db.String(64), primary_key=True)
+    owner = db.Column(db.String, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+
+class AuditEvent(db.Model):
+    """
+    A change made through the API, by "actor_id" to the user "target_id"
+    (none for the bulk operations), served by "/api/v1/audit-events".
+    Written in batches by app/libs/audit.py, it can lag behind by a few seconds.
+    The integer ids follow the insertion order, the events are paginated
+    on them, newest first.
+    """
+
+    __tablename__ = "audit_events"
+    __table_args__ = (
+        # One index per filter of the audit events endpoint,
+        # with the id for the pagination.
+        db.Index("ix_audit_events_target_id_id", "target_id", "id"),
+        db.Index("ix_audit_events_actor_id_id", "actor_id", "id"),
+        db.Index("ix_audit_events_action_id", "action", "id"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+    action = db.Column(db.String(64), nullable=False)
+    actor_id = db.Column(UUIDString(), nullable=True)
+    target_id = db.Column(UUIDString(), nullable=True)
+    source_addr = db.Column(db.String(64), nullable=True)
+    details = db.Column(db.JSON, nullable=True)
+
+
+db.Index("ix_users_email_domain", _email_domain(User.__table__.c.email))
+
+
+# Full-text search index over the users names and email.
+# This is an external content FTS5 table using the trigram tokenizer,
+# so it supports case insensitive substring matches of 3 characters or more.
+# The index is kept in sync with the users table by triggers.
+# It needs FTS5 and SQLite 3.34 or later, otherwise the search runs LIKE scans.
+# Note: VACUUM may renumber the users rowids, run rebuild_search_index() after it.
+SEARCH_INDEX_DDL = (
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+        first_name, last_name, email,
+        content='users', content_rowid='rowid', tokenize='trigram'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users BEGIN
+        INSERT INTO users_fts(rowid, first_name, last_name, email)
+        VALUES (new.rowid, new.first_name, new.last_name, new.email);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users BEGIN
+        INSERT INTO users_fts(users_fts, rowid, first_name, last_name, email)
+        VALUES ('delete', old.rowid, old.first_name, old.last_name, old.email);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS users_fts_update
+    AFTER UPDATE OF first_name, last_name, email ON users BEGIN
+        INSERT INTO users_fts(users_fts, rowid, first_name, last_name, email)
+        VALUES ('delete', old.rowid, old.first_name, old.last_name, old.email);
+        INSERT INTO users_fts(rowid, first_name, last_name, email)
+        VALUES (new.rowid, new.first_name, new.last_name, new.email);
+    END
+    """,
+)
+
+users_fts = db.table("users_fts", db.column("rowid"), db.column("rank"))
+
+
+@lru_cache(maxsize=None)
+def search_index_supported() -> bool:
+    """
+    Whether the SQLite library has FTS5 and its trigram tokenizer (3.34+).
+    """
+    if sqlite3.sqlite_version_info < (3, 34):
+        return False
+
+    connection = sqlite3.connect(":memory:")
+    try:
+        connection.execute(
+            "CREATE VIRTUAL TABLE probe USING fts5(x, tokenize='trigram')"
+        )
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        connection.close()
+    return True
+
+
+for statement in SEARCH_INDEX_DDL:
+    event.listen(
+        User.__table__,
+        "after_create",
+        DDL(statement).execute_if(
+            dialect="sqlite", callable_=lambda *args, **kw: search_index_supported()
+        ),
+    )
+
+
+class TableCounter(db.Model):
+    """
+    Row counts maintained by triggers, so the users list doesn't
+    count the whole table on every page.
+    """
+
+    __tablename__ = "table_counters"
+
+    name = db.Column(db.String(64), primary_key=True)
+    row_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+# The counter is seeded from the table when missing, so the statements also
+# set up existing databases. They run after every create_all (init-db).
+# The soft deleted users aren't counted.
+ROW_COUNTER_DDL = (
+    """
+    INSERT OR IGNORE INTO table_counters (name, row_count)
+    SELECT 'users', count(*) FROM users WHERE deleted_at IS NULL
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS users_count_insert AFTER INSERT ON users
+    WHEN new.deleted_at IS NULL BEGIN
+        UPDATE table_counters SET row_count = row_count + 1 WHERE name = 'users';
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS users_count_delete_live AFTER DELETE ON users
+    WHEN old.deleted_at IS NULL BEGIN
+        UPDATE table_counters SET row_count = row_count - 1 WHERE name = 'users';
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS users_count_soft_delete
+    AFTER UPDATE OF deleted_at ON users
+    WHEN (old.deleted_at IS NULL) != (new.deleted_at IS NULL) BEGIN
+        UPDATE table_counters
+        SET row_count = row_count
+            + CASE WHEN new.deleted_at IS NULL THEN 1 ELSE -1 END
+        WHERE name = 'users';
+    END
+    """,
+)
+
+for statement in ROW_COUNTER_DDL:
+    event.listen(
+        db.metadata, "after_create", DDL(statement).execute_if(dialect="sqlite")
+    )
+
+
+def count_users() -> int:
+    """
+    The number of users, read from the counter in O(1)
+    instead of a COUNT over the table when available.
+    """
+    if db.engine.dialect.name == "sqlite":
+        row_count = db.session.execute(
+            db.select(TableCounter.row_count).where(TableCounter.name == "users")
+        ).scalar()
+        if row_count is not None:
+            return row_count
+    return db.session.execute(
+        db.select(db.func.count(User.id)).where(User.deleted_at.is_(None))
+    ).scalar()
+
+
+def ensure_soft_delete() -> None:
+    """
+    Add the "deleted_at" column to databases created before soft delete
+    was introduced, run it before create_all. The list indexes are replaced
+    by partial indexes, and the users counter triggers by ones skipping
+    the soft deleted users (created by create_all).
+    """
+    if db.engine.dialect.name != "sqlite":
+        return
+
+    inspector = db.inspect(db.engine)
+    if not inspector.has_table("users"):
+        return
+
+    with db.engine.begin() as connection:
+        insert_trigger = connection.exec_driver_sql(
+            "SELECT sql FROM sqlite_master "
+            "WHERE type = 'trigger' AND name = 'users_count_insert'"
+        ).scalar()
+        if insert_trigger and "deleted_at" not in insert_trigger:
+            # It counted the inserted soft deleted users (copy_database),
+            # the counter is seeded again by create_all.
+            connection.exec_driver_sql("DROP TRIGGER users_count_insert")
+            connection.exec_driver_sql(
+                "DELETE FROM table_counters WHERE name = 'users'"
+            )
+
+    if "deleted_at" in {column["name"] for column in inspector.get_columns("users")}:
+        return
+
+    partial_indexes = [
+        index
+        for index in User.__table__.indexes
+        if index.dialect_options["sqlite"]["where"] is not None
+    ]
+    with db.engine.begin() as connection:
+        connection.exec_driver_sql("ALTER TABLE users ADD COLUMN deleted_at DATETIME")
+        connection.exec_driver_sql("DROP TRIGGER IF EXISTS users_count_delete")
+        for index in partial_indexes:
+            connection.exec_driver_sql(f"DROP INDEX IF EXISTS {index.name}")
+            index.create(connection)
+
+
+def ensure_search_index() -> None:
+    """
+    Create and populate the search index for databases
+    created before the index was introduced.
+    """
+    if db.engine.dialect.name != "sqlite":
+        return
+
+    if not search_index_supported():
+        log.warning(
+            "SQLite %s lacks FTS5 or its trigram tokenizer (3.34+), "
+            "the users search falls back to LIKE scans",
+            sqlite3.sqlite_version,
+        )
+        return
+
+    exists = db.session.execute(
+        db.text("SELECT 1 FROM sqlite_master WHERE name = 'users_fts'")
+    ).first()
+    if not exists:
+        for statement in SEARCH_INDEX_DDL:
+            db.session.execute(db.text(statement))
+        rebuild_search_index()
+
+
+def rebuild_search_index() -> None:
+    if not search_index_supported():
+        return
+    db.session.execute(db.text("INSERT INTO users_fts(users_fts) VALUES ('rebuild')"))
+    db.session.commit()
+
+
+def search_users_select(terms):
+    """
+    Return a select statement of the users matching all the given terms,
+    ordered by relevance (bm25). Without the search index, the terms are
+    matched with LIKE and the users ordered by creation date.
+    """
+    if not search_index_supported():
+        columns = (User.first_name, User.last_name, User.email)
+        return (
+            db.select(User)
+            .where(
+                *(
+                    db.or_(
+                        *(column.contains(term, autoescape=True) for column in columns)
+                    )
+                    for term in terms
+                ),
+                User.deleted_at.is_(None),
+            )
+            .order_by(User.created_at, User.id)
+        )
+
+    # Quote every term so FTS5 query syntax in the user input is ignored
+    match = " ".join('"{}"'.format(term.replace('"', '""')) for term in terms)
+    return (
+        db.select(User)
+        .join(users_fts, users_fts.c.rowid == db.literal_column("users.rowid"))
+        .where(
+            db.literal_column("users_fts").op("MATCH")(match),
+            User.deleted_at.is_(None),
+        )
+        .order_by(users_fts.c.rank)
+    )
+
+
+def check_storage_mode() -> None:
+    """
+    Make sure the existing database was created with the configured storage mode.
+    """
+    compact = getattr(db.engine.dialect, "compact_storage", False)
+    columns = {
+        column["name"]: column["type"]
+        for column in db.inspect(db.engine).get_columns("users")
+    }
+    if columns and isinstance(columns["id"], db.LargeBinary) != compact:
+        raise RuntimeError(
+            "The database storage mode doesn't match the compact_storage setting, "
+            'convert the database with the "migrate-storage" command'
+        )
+
+
+def copy_database(target_uri: str, compact: bool, batch_size: int = 10000) -> None:
+    """
+    Copy every table of the current database into a new database,
+    converting the columns to the compact or text storage mode.
+    """
+    target = db.create_engine(target_uri)
+    target.dialect.compact_storage = compact
+    db.metadata.create_all(target)
+
+    # The column types convert the values to strings when reading from the source,
+    # then back to the target storage mode when writing.
+    with db.engine.connect() as source, target.begin() as destination:
+        for table in db.metadata.sorted_tables:
+            if table is TableCounter.__table__:
+                # Maintained by the triggers while the users are copied
+                continue
+            result = source.execution_options(yield_per=batch_size).execute(
+                table.select()
+            )
+            for rows in result.mappings().partitions():
+                destination.execute(table.insert(), [dict(row) for row in rows])
+
+    target.dispose()
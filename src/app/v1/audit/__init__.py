@@ -0,0 +1,5 @@
+from flask import Blueprint
+
+audit = Blueprint("audit", __name__)
+
+from app.v1.audit import routes  # noqa: F401, E402
@@ -0,0 +1,78 @@
+# Python imports
+from urllib.parse import urlencode
+
+# Flask imports
+from flask import jsonify, request
+
+# Local imports
+from app import db
+from app.libs.audit import audit as audit_log
+from app.libs.utils import admin_required, api_key_required, rate_limited, read_replica
+from app.models import AuditEvent
+from app.v1.audit import audit
+
+# Query arguments filtering the events, each one is backed by an index
+FILTER_ARGS = ("action", "actor_id", "target_id")
+
+EVENT_FIELDS = (
+    "id",
+    "created_at",
+    "action",
+    "actor_id",
+    "target_id",
+    "source_addr",
+    "details",
+)
+
+
+def _event_to_dict(event) -> dict:
+    return {field: getattr(event, field) for field in EVENT_FIELDS}
+
+
+@audit.route("", methods=["GET"])
+@read_replica
+@rate_limited
+@api_key_required
+@admin_required
+def get_audit_events():
+    """
+    The audit events, newest first, optionally filtered by action,
+    actor or target user. The pages are keyset paginated, "next_page"
+    asks for the events before the last returned one.
+    """
+    before = request.args.get("before", type=int)
+    limit = request.args.get("limit", 100, type=int)
+    max_limit = 1000
+    if not 0 < limit <= max_limit:
+        return jsonify({"error": f"The limit must be between 1 and {max_limit}"}), 400
+
+    select = db.select(AuditEvent)
+    for name in FILTER_ARGS:
+        if name in request.args:
+            select = select.where(getattr(AuditEvent, name) == request.args[name])
+    if before is not None:
+        select = select.where(AuditEvent.id < before)
+
+    events = (
+        db.session.execute(select.order_by(AuditEvent.id.desc()).limit(limit))
+        .scalars()
+        .all()
+    )
+
+    next_url = None
+    if len(events) == limit:
+        args = request.args.to_dict()
+        args["before"] = events[-1].id
+        next_url = f"{request.base_url}?{urlencode(args)}"
+
+    return (
+        jsonify(
+            {
+                "events": [_event_to_dict(event) for event in events],
+                "next_page": next_url,
+                # Not written to the database yet by this worker
+                "pending": audit_log.stats()["pending"],
+            }
+        ),
+        200,
+    )
@@ -3,11 +3,12 @@ from flask import jsonify
 from flask_jwt_extended import create_access_token
 
 # Local imports
-from app.libs.utils import api_key_required, get_api_user
+from app.libs.utils import api_key_required, get_api_user, rate_limited
 from app.v1.auth import auth
 
 
 @auth.route("/auth", methods=["POST"])
+@rate_limited
 @api_key_required
 def login():
     user = get_api_user()
@@ -0,0 +1,5 @@
+from flask import Blueprint
+
+batch = Blueprint("batch", __name__)
+
+from app.v1.batch import routes  # noqa: F401, E402
@@ -0,0 +1,66 @@
+# Python imports
+import re
+
+# Flask imports
+from flask import g, jsonify, request
+
+# Local imports
+from app.libs.batch import batch as dispatcher
+from app.libs.schema import Schema, String
+from app.libs.utils import api_key_required, get_api_user, rate_limited
+from app.v1.batch import batch
+
+# A sub-request, its optional "headers" and "body" are checked apart
+SUB_REQUEST_SCHEMA = Schema(
+    method=String(
+        required=True,
+        pattern=re.compile(r"(GET|POST|PATCH|DELETE)$"),
+        pattern_error="Must be GET, POST, PATCH or DELETE",
+    ),
+    path=String(
+        required=True,
+        max_length=2048,
+        pattern=re.compile(r"/api/v1/"),
+        pattern_error='Must start with "/api/v1/"',
+    ),
+)
+
+
+def _check_headers(items: list, errors: dict) -> None:
+    for index, item in enumerate(items):
+        headers = item.get("headers", {}) if isinstance(item, dict) else {}
+        if not isinstance(headers, dict) or not all(
+            isinstance(value, str) for value in headers.values()
+        ):
+            errors.setdefault(index, {})["headers"] = "Must be an object of strings"
+
+
+@batch.route("", methods=["POST"])
+@rate_limited
+@api_key_required
+def dispatch_batch():
+    """
+    Run several API calls in one request, see app/libs/batch.py.
+    The payload is {"requests": [{"method", "path", "headers", "body"}, ...],
+    "concurrent": false}, the responses are returned in the same order.
+    """
+    if g.get("in_batch"):
+        return jsonify({"error": "Batch requests can't be nested"}), 400
+
+    data = request.get_json(silent=True)
+    items = data.get("requests") if isinstance(data, dict) else None
+    if not isinstance(items, list) or not 0 < len(items) <= dispatcher.max_requests:
+        error = f"Expected a list of 1 to {dispatcher.max_requests} requests"
+        return jsonify({"error": error}), 400
+
+    concurrent = data.get("concurrent", False)
+    if not isinstance(concurrent, bool):
+        return jsonify({"error": "Invalid concurrent value"}), 400
+
+    _, errors = SUB_REQUEST_SCHEMA.validate_many(items)
+    _check_headers(items, errors)
+    if errors:
+        return jsonify({"error": "Invalid parameters", "errors": errors}), 400
+
+    results = dispatcher.dispatch(items, get_api_user(), concurrent)
+    return jsonify({"responses": results}), 200
@@ -3,22 +3,47 @@ from flask import jsonify
 from flask_jwt_extended import jwt_required
 
 # Local imports
-from app.libs.utils import admin_required, api_key_required
+from app.libs import metrics
+from app.libs.health import health
+from app.libs.utils import admin_required, api_key_required, rate_limited
 from app.v1.check import check
 
 
 @check.route("/status", methods=["GET"])
+@check.route("/live", methods=["GET"])
 def health_check():
+    """
+    Liveness, the worker answers requests.
+    """
     return jsonify({"message": "Up and running"}), 200
 
 
+@check.route("/ready", methods=["GET"])
+def readiness_check():
+    """
+    Readiness, the worker can reach the database (a cached probe,
+    see app/libs/health.py), 503 otherwise.
+    Unauthenticated, the pool, in flight and cache details are only
+    in the admin metrics.
+    """
+    probe = health.check()
+    return (
+        jsonify(
+            {"status": "ready" if probe["ok"] else "unavailable", "database": probe}
+        ),
+        200 if probe["ok"] else 503,
+    )
+
+
 @check.route("/check", methods=["GET"])
+@rate_limited
 @api_key_required
 def check_user_api():
     return jsonify({"message": "API token is valid"}), 200
 
 
 @check.route("/admin-check", methods=["GET"])
+@rate_limited
 @api_key_required
 @admin_required
 def check_admin_api():
@@ -26,13 +51,23 @@ def check_admin_api():
 
 
 @check.route("/jwt-check", methods=["GET"])
+@rate_limited
 @jwt_required()
 def check_jwt_token():
     return jsonify({"message": "JWT API token is valid"}), 200
 
 
 @check.route("/jwt-admin-check", methods=["GET"])
+@rate_limited
 @jwt_required()
 @admin_required
 def check_admin_jwt_token():
     return jsonify({"message": "JWT API token is valid"}), 200
+
+
+@check.route("/metrics", methods=["GET"])
+@rate_limited
+@api_key_required
+@admin_required
+def get_metrics():
+    return jsonify(metrics.collect()), 200
@@ -0,0 +1,5 @@
+from flask import Blueprint
+
+jobs = Blueprint("jobs", __name__)
+
+from app.v1.jobs import routes  # noqa: F401, E402
@@ -0,0 +1,37 @@
+# Flask imports
+from flask import jsonify
+
+# Local imports
+from app.libs.jobs import jobs as job_runner
+from app.libs.utils import admin_required, api_key_required, rate_limited
+from app.v1.jobs import jobs
+
+JOB_FIELDS = (
+    "id",
+    "kind",
+    "status",
+    "progress",
+    "total",
+    "result",
+    "error",
+    "created_by",
+    "created_at",
+    "started_at",
+    "finished_at",
+)
+
+
+def job_to_dict(job) -> dict:
+    return {field: getattr(job, field) for field in JOB_FIELDS}
+
+
+@jobs.route("/<job_id>", methods=["GET"])
+@rate_limited
+@api_key_required
+@admin_required
+def get_job(job_id):
+    job = job_runner.get(job_id)
+    if not job:
+        return jsonify({"error": "Job not found!"}), 404
+
+    return jsonify(job_to_dict(job)), 200
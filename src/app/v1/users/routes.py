@@ -1,16 +1,176 @@
+# Python imports
+import json
+from typing import Optional, Tuple
+from urllib.parse import urlencode
+
 # Flask imports
-from flask import jsonify, request, url_for
+from flask import Response, current_app, jsonify, request, stream_with_context, url_for
 
 # Local imports
 from app import db, log
-from app.libs.utils import admin_required, api_key_required, validate_email
-from app.models import User
+from app.libs.audit import audit
+from app.libs.jobs import jobs
+from app.libs.keyfilter import key_filter
+from app.libs.keys import gen_hashed_api_keys, parse_api_key, random_digest
+from app.libs.schema import MISSING_ERROR, Boolean, Email, Schema, String
+from app.libs.usage import usage
+from app.libs.utils import (
+    admin_required,
+    api_key_required,
+    cached_response,
+    get_api_user,
+    get_source_addr,
+    idempotent,
+    rate_limited,
+    read_replica,
+)
+from app.models import (
+    ApiKey,
+    UsageCounter,
+    User,
+    count_users,
+    delete_usage_counters,
+    purge_users,
+    search_users_select,
+)
 from app.v1.users import users
 
+# Fields that can be returned by the users endpoints,
+# the "id" is always included.
+USER_FIELDS = ("id", "first_name", "last_name", "email", "is_active", "is_admin")
+
+# Whitelisted sort keys, each one is backed by an index on the users table.
+SORT_KEYS = {
+    "created_at": (User.created_at,),
+    "email": (User.email,),
+    "last_name": (User.last_name, User.first_name),
+}
+
+RESERVED_API_KEY_FORMAT_ERROR = (
+    "Custom API keys can't use the format of the generated API keys"
+)
+
+# Query arguments of the users list accepted by the bulk operations
+FILTER_ARGS = ("is_admin", "is_active", "email", "email_prefix", "email_domain")
+
+# Payload of the create and modify endpoints
+USER_SCHEMA = Schema(
+    first_name=String(required=True),
+    last_name=String(required=True),
+    email=Email(required=True),
+    is_active=Boolean(),
+    is_admin=Boolean(),
+    api_key=String(max_length=1024),
+)
+
+# Maximum number of users created by a bulk request
+BULK_MAX_USERS = 1000
+
+BOOLEAN_VALUES = {"true": True, "1": True, "false": False, "0": False}
+
+
+def _get_user(user_id: str) -> Optional[User]:
+    """Returns the user, unless it doesn't exist or is soft deleted."""
+    user = db.session.get(User, user_id)
+    return user if user and user.deleted_at is None else None
+
+
+def _taken_email(email: str) -> Tuple[bool, list]:
+    """
+    Returns whether a user has the email, and the soft deleted users still
+    holding it, which are purged before the email is reused.
+    """
+    rows = db.session.execute(
+        db.select(User.id, User.deleted_at).where(User.email == email)
+    ).all()
+    return (
+        any(row.deleted_at is None for row in rows),
+        [row.id for row in rows if row.deleted_at is not None],
+    )
+
+
+def _user_to_dict(user, fields=USER_FIELDS) -> dict:
+    return {field: getattr(user, field) for field in fields}
+
+
+def _parse_fields(args) -> tuple:
+    """
+    Parse the "fields" query argument into the list of user fields to return.
+    Raises ValueError on unknown fields.
+    """
+    if not args.get("fields"):
+        return USER_FIELDS
+
+    requested = {field.strip() for field in args["fields"].split(",")} - {""}
+    unknown = requested - set(USER_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+
+    return tuple(field for field in USER_FIELDS if field in requested or field == "id")
+
+
+def _build_users_select(args, fields=USER_FIELDS):
+    """
+    Build the users list select statement from the request query arguments.
+
+    Supported filters:
+        is_admin, is_active: true/false
+        email:               exact match
+        email_prefix:        prefix match, uses the email index as a range scan
+        email_domain:        exact match on the part after "@"
+    Sorting:
+        sort: comma separated keys from SORT_KEYS, prefix with "-" for descending
+    Raises ValueError on invalid arguments.
+    """
+    # Matches the partial indexes of the users table
+    select = db.select(User).where(User.deleted_at.is_(None))
+
+    for name in ("is_admin", "is_active"):
+        if name in args:
+            value = BOOLEAN_VALUES.get(args[name].lower())
+            if value is None:
+                raise ValueError(f'Invalid value for "{name}", expected true or false')
+            select = select.where(getattr(User, name) == value)
+
+    if args.get("email"):
+        select = select.where(User.email == args["email"])
+
+    if args.get("email_prefix"):
+        # A range scan instead of LIKE, SQLite's LIKE is case insensitive
+        # and can't use the default (binary) email index.
+        prefix = args["email_prefix"]
+        select = select.where(User.email >= prefix, User.email < prefix + "\U0010ffff")
+
+    if args.get("email_domain"):
+        select = select.where(User.email_domain == args["email_domain"])
+
+    order_by = []
+    for key in args.get("sort", "created_at").split(","):
+        descending = key.startswith("-")
+        columns = SORT_KEYS.get(key.lstrip("-"))
+        if not columns:
+            raise ValueError(
+                f'Invalid sort key "{key}", allowed keys: {", ".join(SORT_KEYS)}'
+            )
+        order_by += [column.desc() if descending else column for column in columns]
+
+    # Only load the requested columns from the database
+    columns = [getattr(User, field) for field in fields if field != "id"]
+    return select.options(db.load_only(*columns)).order_by(*order_by)
+
+
+def _page_url(page: int) -> str:
+    args = request.args.to_dict()
+    args["page"] = page
+    return f"{request.base_url}?{urlencode(args)}"
+
 
 @users.route("", methods=["GET"])
+@read_replica
+@rate_limited
 @api_key_required
 @admin_required
+@cached_response
 def get_users():
     page = request.args.get("page", 1, type=int)
     per_page = request.args.get("per_page", 20, type=int)
@@ -26,35 +186,36 @@ def get_users():
             ),
             400,
         )
+
+    try:
+        fields = _parse_fields(request.args)
+        select = _build_users_select(request.args, fields)
+    except ValueError as err:
+        return jsonify({"error": str(err)}), 400
+
+    exact = BOOLEAN_VALUES.get(request.args.get("exact", "false").lower())
+    if exact is None:
+        return (
+            jsonify({"error": 'Invalid value for "exact", expected true or false'}),
+            400,
+        )
+
     # db.paginate will automatically read and parse the request page arguments
-    # "per_page" then it will return the results accordingly
-    users = db.paginate(db.select(User).order_by(User.created_at))
+    # "per_page" then it will return the results accordingly.
+    # Without filters the total comes from the users counter,
+    # "exact=true" counts the rows instead.
+    filtered = any(name in request.args for name in FILTER_ARGS)
+    users = db.paginate(select, count=exact or filtered)
+    if users.total is None:
+        users.total = count_users()
 
-    next_url = (
-        None
-        if not users.has_next
-        else f"{request.base_url}?page={page + 1}&per_page={per_page}"
-    )
-    prev_url = (
-        None
-        if not users.has_prev
-        else f"{request.base_url}?page={page - 1}&per_page={per_page}"
-    )
+    next_url = None if not users.has_next else _page_url(page + 1)
+    prev_url = None if not users.has_prev else _page_url(page - 1)
 
     return (
         jsonify(
             {
-                "users": [
-                    {
-                        "id": user.id,
-                        "first_name": user.first_name,
-                        "last_name": user.last_name,
-                        "email": user.email,
-                        "is_active": user.is_active,
-                        "is_admin": user.is_admin,
-                    }
-                    for user in users
-                ],
+                "users": [_user_to_dict(user, fields) for user in users],
                 "total_pages": users.pages,
                 "total_items": users.total,
                 "items_per_page": per_page,
@@ -66,54 +227,129 @@ def get_users():
     )
 
 
-@users.route("", methods=["POST"])
+@users.route("/search", methods=["GET"])
+@read_replica
+@rate_limited
 @api_key_required
 @admin_required
-def create_user():
-    data = request.get_json()
+@cached_response
+def search_users():
+    """
+    Ranked substring search over the users first name, last name and email.
+    Every whitespace separated term of "q" must match.
+    """
+    page = request.args.get("page", 1, type=int)
+    per_page = request.args.get("per_page", 20, type=int)
+    max_per_page = 1000
 
-    first_name = data.get("first_name")
-    last_name = data.get("last_name")
-    email = data.get("email")
+    terms = request.args.get("q", "").split()
+    if not terms or any(len(term) < 3 for term in terms):
+        return jsonify({"error": "Search terms must be at least 3 characters"}), 400
 
-    if not (email and first_name and last_name):
-        return jsonify({"error": "Missing required parameters"}), 400
+    if page < 1 or not 0 < per_page <= max_per_page:
+        return jsonify({"error": "Invalid page or per_page value"}), 400
 
-    if not validate_email(email):
-        return jsonify({"error": "Invalid email format"}), 400
+    try:
+        fields = _parse_fields(request.args)
+    except ValueError as err:
+        return jsonify({"error": str(err)}), 400
 
-    user = User.query.filter_by(email=email).first()
-    if user:
-        return jsonify({"error": "user already exists"}), 400
+    # Fetch one extra row to know if there is a next page,
+    # counting all the matches would defeat the purpose of the index.
+    select = search_users_select(terms).limit(per_page + 1)
+    results = db.session.execute(select.offset((page - 1) * per_page)).scalars()
+    results = results.all()
+    has_next = len(results) > per_page
 
-    new_user = User(
-        first_name=first_name,
-        last_name=last_name,
-        email=email,
-        is_active=data.get("is_active", True),
-        is_admin=data.get("is_admin", False),
+    return (
+        jsonify(
+            {
+                "users": [_user_to_dict(user, fields) for user in results[:per_page]],
+                "items_per_page": per_page,
+                "next_page": _page_url(page + 1) if has_next else None,
+                "prev_page": _page_url(page - 1) if page > 1 else None,
+            }
+        ),
+        200,
     )
 
-    if data.get("api_key"):
-        new_user_api_key = data.get("api_key")
-        new_user.set_api_key(new_user_api_key)
-    else:
-        new_user_api_key = new_user.gen_api_key()
+
+@users.route("", methods=["POST"])
+@rate_limited
+@api_key_required
+@idempotent
+@admin_required
+def create_user():
+    data, errors = USER_SCHEMA.validate(request.get_json())
+    if errors:
+        return _invalid_payload(errors)
+
+    taken, deleted_ids = _taken_email(data["email"])
+    if taken:
+        return jsonify({"error": "user already exists"}), 400
+
+    if data.get("api_key") and parse_api_key(data["api_key"]):
+        return jsonify({"error": RESERVED_API_KEY_FORMAT_ERROR}), 400
+
+    new_user, new_user_api_key = _new_user(data)
 
     try:
+        purge_users(deleted_ids)
         db.session.add(new_user)
         db.session.commit()
         log.info('User "%s" has been added', new_user.email)
+        _audit("user.create", new_user.id, email=new_user.email)
+        return (
+            jsonify({**_user_to_dict(new_user), "api_key": new_user_api_key}),
+            201,
+        )
+    except Exception as err:
+        db.session.rollback()
+        log.error(f"Error occurred: {str(err)}")
+        return jsonify({"error": "Could not process your request"}), 500
+    finally:
+        db.session.close()
+
+
+@users.route("/bulk", methods=["POST"])
+@rate_limited
+@api_key_required
+@idempotent
+@admin_required
+def create_users():
+    """
+    Create up to BULK_MAX_USERS users at once, all or none of them.
+    The payload is {"users": [...]}, every item is validated before anything
+    is created and the errors are returned by item index.
+    """
+    items = (request.get_json() or {}).get("users")
+    if not isinstance(items, list) or not 0 < len(items) <= BULK_MAX_USERS:
+        return (
+            jsonify({"error": f"Expected a list of 1 to {BULK_MAX_USERS} users"}),
+            400,
+        )
+
+    values, errors = USER_SCHEMA.validate_many(items)
+    deleted_ids = _check_new_users(values, errors)
+    if errors:
+        return _invalid_payload(dict(sorted(errors.items())))
+
+    new_users = [_new_user(data) for data in values]
+
+    try:
+        purge_users(deleted_ids)
+        db.session.add_all([new_user for new_user, _ in new_users])
+        db.session.commit()
+        log.info("%d users have been added", len(new_users))
+        for new_user, _ in new_users:
+            _audit("user.create", new_user.id, email=new_user.email)
         return (
             jsonify(
                 {
-                    "id": new_user.id,
-                    "first_name": new_user.first_name,
-                    "last_name": new_user.last_name,
-                    "email": new_user.email,
-                    "is_active": new_user.is_active,
-                    "is_admin": new_user.is_admin,
-                    "api_key": new_user_api_key,
+                    "users": [
+                        {**_user_to_dict(new_user), "api_key": new_user_api_key}
+                        for new_user, new_user_api_key in new_users
+                    ]
                 }
             ),
             201,
@@ -126,23 +362,87 @@ def create_user():
         db.session.close()
 
 
+def _check_new_users(values: list, errors: dict) -> list:
+    """
+    Add the errors of the checks needing the database, or the whole payload:
+    emails used twice or by existing users (with a single query),
+    and custom API keys using the reserved format.
+    Returns the soft deleted users holding the emails, to purge.
+    """
+    indexes = {}
+    for index, data in enumerate(values):
+        if "email" in data:
+            indexes.setdefault(data["email"], []).append(index)
+        if data.get("api_key") and parse_api_key(data["api_key"]):
+            errors.setdefault(index, {})["api_key"] = RESERVED_API_KEY_FORMAT_ERROR
+
+    rows = db.session.execute(
+        db.select(User.id, User.email, User.deleted_at).where(
+            User.email.in_(list(indexes))
+        )
+    ).all()
+    existing = {row.email for row in rows if row.deleted_at is None}
+    for email, email_indexes in indexes.items():
+        if email in existing or len(email_indexes) > 1:
+            for index in email_indexes:
+                errors.setdefault(index, {})["email"] = "Email already exists"
+    return [row.id for row in rows if row.deleted_at is not None]
+
+
+def _new_user(data: dict):
+    """
+    Returns a new user built from a validated payload and its API key.
+    """
+    new_user = User(
+        first_name=data["first_name"],
+        last_name=data["last_name"],
+        email=data["email"],
+        is_active=data.get("is_active", True),
+        is_admin=data.get("is_admin", False),
+    )
+
+    if data.get("api_key"):
+        new_user_api_key = data["api_key"]
+        new_user.set_api_key(new_user_api_key)
+        key_filter.forget(new_user_api_key)
+    else:
+        new_user_api_key = new_user.gen_api_key()
+    return new_user, new_user_api_key
+
+
+def _audit(action: str, target_id: Optional[str] = None, **details) -> None:
+    """
+    Record a committed change in the audit trail, made by the requesting user.
+    """
+    audit.record(
+        action, get_api_user().id, target_id, details or None, get_source_addr()
+    )
+
+
+def _invalid_payload(errors: dict):
+    error = (
+        "Missing required parameters"
+        if MISSING_ERROR in errors.values()
+        else "Invalid parameters"
+    )
+    return jsonify({"error": error, "errors": errors}), 400
+
+
 @users.route("/<user_id>", methods=["GET"])
+@read_replica
+@rate_limited
 @api_key_required
 @admin_required
+@cached_response
 def get_user(user_id):
-    user = User.query.get(user_id)
+    user = _get_user(user_id)
     if not user:
         return jsonify({"error": "User not found!"}), 404
 
     return (
         jsonify(
             {
-                "id": user.id,
-                "first_name": user.first_name,
-                "last_name": user.last_name,
-                "email": user.email,
-                "is_active": user.is_active,
-                "is_admin": user.is_admin,
+                **_user_to_dict(user),
                 "actions": {
                     "regen-api-key": {
                         "uri": request.host_url.rstrip("/")
@@ -151,6 +451,12 @@ def get_user(user_id):
                         "description": "Regenerate the user API token and return "
                         "the newely generated token",
                     },
+                    "list-api-keys": {
+                        "uri": request.host_url.rstrip("/")
+                        + url_for("users.get_user_api_keys", user_id=user.id),
+                        "method": "GET",
+                        "description": "List the user API keys",
+                    },
                     "get-user-info": {
                         "uri": request.host_url.rstrip("/")
                         + url_for("users.modify_user", user_id=user.id),
@@ -179,32 +485,43 @@ def get_user(user_id):
 
 
 @users.route("/<user_id>", methods=["PATCH"])
+@rate_limited
 @api_key_required
+@idempotent
 @admin_required
 def modify_user(user_id):
-    user = User.query.get(user_id)
+    user = _get_user(user_id)
     if not user:
         return jsonify({"error": "User not found!"}), 404
 
-    data = request.get_json()
-
-    existing_email = User.query.filter_by(email=data.get("email", user.email)).first()
-    if existing_email and existing_email != user:
-        return jsonify({"error": "Email already exists"}), 400
-
-    new_api_key = data.get("api_key")
+    data, errors = USER_SCHEMA.validate(
+        _changed_fields(user, request.get_json()), partial=True
+    )
+    if errors:
+        return _invalid_payload(errors)
+
+    if "email" in data:
+        taken, deleted_ids = _taken_email(data["email"])
+        if taken:
+            return jsonify({"error": "Email already exists"}), 400
+        # Before the new email is flushed
+        purge_users(deleted_ids)
+
+    fields = sorted(data)
+    new_api_key = data.pop("api_key", None)
     if new_api_key:
+        if parse_api_key(new_api_key):
+            return jsonify({"error": RESERVED_API_KEY_FORMAT_ERROR}), 400
         user.set_api_key(new_api_key)
+        key_filter.forget(new_api_key)
 
-    user.first_name = data.get("first_name", user.first_name)
-    user.last_name = data.get("last_name", user.last_name)
-    user.email = data.get("email", user.email)
-    user.is_active = data.get("is_active", user.is_active)
-    user.is_admin = data.get("is_admin", user.is_admin)
+    for name, value in data.items():
+        setattr(user, name, value)
 
     try:
         db.session.commit()
         log.info('User "%s" has been modified', user.email)
+        _audit("user.update", user_id, fields=fields)
         return (
             jsonify({"message": "User has been updated", "user": user.email}),
             200,
@@ -217,18 +534,36 @@ def modify_user(user_id):
         db.session.close()
 
 
+def _changed_fields(user: User, data):
+    # The unchanged fields are neither validated nor checked for uniqueness
+    if not isinstance(data, dict):
+        return data
+    return {
+        name: value
+        for name, value in data.items()
+        if name not in USER_FIELDS or getattr(user, name) != value
+    }
+
+
 @users.route("/<user_id>", methods=["DELETE"])
+@rate_limited
 @api_key_required
 @admin_required
 def delete_user(user_id):
-    user = User.query.get(user_id)
+    user = _get_user(user_id)
     if not user:
         return jsonify({"error": "User not found!"}), 404
 
     try:
-        db.session.delete(user)
+        if current_app.config["SOFT_DELETE_ENABLED"]:
+            # Removed later by the purger, see app/libs/purger.py
+            user.deleted_at = db.func.current_timestamp()
+        else:
+            delete_usage_counters([user.id])
+            db.session.delete(user)
         db.session.commit()
         log.info('User "%s" has been deleted', user.email)
+        _audit("user.delete", user_id, email=user.email)
         return jsonify({"message": "User has been deleted"}), 200
     except Exception as e:
         db.session.rollback()
@@ -238,11 +573,96 @@ def delete_user(user_id):
         db.session.close()
 
 
+@users.route("", methods=["DELETE"])
+@rate_limited
+@api_key_required
+@idempotent
+@admin_required
+def delete_users():
+    """
+    Delete the users matching the list filters as a background job,
+    returns the job to follow at "/api/v1/jobs/<id>".
+    The requesting user is never deleted.
+    """
+    filters = {name: request.args[name] for name in FILTER_ARGS if name in request.args}
+    if not filters:
+        return jsonify({"error": "At least one filter is required"}), 400
+
+    try:
+        _build_users_select(filters)
+    except ValueError as err:
+        return jsonify({"error": str(err)}), 400
+
+    try:
+        requester_id = get_api_user().id
+        job_id = jobs.submit(
+            "delete_users",
+            {"filters": filters, "exclude_ids": [requester_id]},
+            created_by=requester_id,
+        )
+    except Exception as err:
+        db.session.rollback()
+        log.error(f"Error occurred: {str(err)}")
+        return jsonify({"error": "Could not process your request"}), 500
+
+    job_url = request.host_url.rstrip("/") + url_for("jobs.get_job", job_id=job_id)
+    return (
+        jsonify({"message": "Users deletion has started", "job": job_url}),
+        202,
+        {"Location": job_url},
+    )
+
+
+@jobs.handler("delete_users")
+def _delete_users_job(job, filters: dict, exclude_ids: list) -> dict:
+    batch_size = current_app.config["JOBS_BATCH_SIZE"]
+    select = (
+        _build_users_select(filters)
+        .with_only_columns(User.id)
+        .where(User.id.not_in(exclude_ids))
+    )
+    job.set_total(
+        db.session.execute(
+            db.select(db.func.count()).select_from(select.order_by(None).subquery())
+        ).scalar()
+    )
+
+    # The deleted rows leave the selection,
+    # so every chunk is the first batch of what remains.
+    deleted = 0
+    while True:
+        user_ids = db.session.execute(select.limit(batch_size)).scalars().all()
+        if not user_ids:
+            break
+
+        if current_app.config["SOFT_DELETE_ENABLED"]:
+            db.session.execute(
+                db.update(User)
+                .where(User.id.in_(user_ids))
+                .values(deleted_at=db.func.current_timestamp())
+            )
+        else:
+            purge_users(user_ids)
+        job.advance(len(user_ids))
+        db.session.commit()
+        deleted += len(user_ids)
+
+    log.info("%d users have been deleted", deleted)
+    audit.record(
+        "users.delete",
+        job.created_by,
+        details={"filters": filters, "deleted": deleted, "job_id": job.job_id},
+    )
+    return {"deleted": deleted}
+
+
 @users.route("/<user_id>/gen-api-key", methods=["POST"])
+@rate_limited
 @api_key_required
+@idempotent
 @admin_required
 def gen_user_api_key(user_id):
-    user = User.query.get(user_id)
+    user = _get_user(user_id)
     if not user:
         return jsonify({"error": "User not found!"}), 404
 
@@ -251,6 +671,7 @@ def gen_user_api_key(user_id):
     try:
         db.session.commit()
         log.info('User "%s" API key has been regenerated', user.email)
+        _audit("user.api_key.regenerate", user_id)
         return (
             jsonify(
                 {
@@ -268,3 +689,251 @@ def gen_user_api_key(user_id):
         return jsonify({"error": "Could not process your request"}), 500
     finally:
         db.session.close()
+
+
+@users.route("/rotate-api-keys", methods=["POST"])
+@rate_limited
+@api_key_required
+@admin_required
+def rotate_api_keys():
+    """
+    Replace the API keys of all the users, or of the users matching the list
+    filters, with newly generated keys. The requesting user is skipped.
+
+    The new keys are streamed back as NDJSON, one {"id", "email", "api_key"}
+    line per user, then a {"rotated": <count>, "job": <url>} line. The users
+    are processed in chunks, each one is committed before its keys are sent.
+    The rotation is recorded as a job (see "Location"), failed with the number
+    of rotated users when it fails or the response is interrupted: the users
+    that were not received must be rotated again.
+    """
+    filters = {name: request.args[name] for name in FILTER_ARGS if name in request.args}
+    try:
+        select = _build_users_select(filters)
+    except ValueError as err:
+        return jsonify({"error": str(err)}), 400
+
+    requester_id = get_api_user().id
+    select = (
+        select.with_only_columns(User.id, User.email)
+        .where(User.id != requester_id)
+        .order_by(None)
+        .order_by(User.id)
+    )
+    try:
+        job = jobs.start("rotate_api_keys", {"filters": filters}, requester_id)
+    except Exception as err:
+        db.session.rollback()
+        log.error(f"Error occurred: {str(err)}")
+        return jsonify({"error": "Could not process your request"}), 500
+
+    job_url = request.host_url.rstrip("/") + url_for("jobs.get_job", job_id=job.job_id)
+    rotation = _rotate_api_keys(
+        select, current_app.config["KEY_ROTATION_BATCH_SIZE"], job, job_url
+    )
+    return Response(
+        stream_with_context(rotation),
+        mimetype="application/x-ndjson",
+        headers={"Location": job_url},
+    )
+
+
+def _rotate_api_keys(select, batch_size: int, job, job_url: str):
+    # Keyset pagination on the users id, only one chunk is held in memory
+    rotated, last_id = 0, None
+    error = "Interrupted, the response was not fully sent"
+    try:
+        while True:
+            chunk = select if last_id is None else select.where(User.id > last_id)
+            rows = db.session.execute(chunk.limit(batch_size)).all()
+            if not rows:
+                break
+
+            keys = gen_hashed_api_keys(len(rows))
+            user_ids = [row.id for row in rows]
+            db.session.execute(db.delete(ApiKey).where(ApiKey.user_id.in_(user_ids)))
+            db.session.execute(
+                db.update(User),
+                [
+                    {"id": user_id, "hashed_api_key": random_digest()}
+                    for user_id in user_ids
+                ],
+            )
+            db.session.execute(
+                db.insert(ApiKey),
+                [
+                    {"user_id": user_id, "key_id": key_id, "hashed_secret": digest}
+                    for user_id, (key_id, digest, _) in zip(user_ids, keys)
+                ],
+            )
+            job.advance(len(rows))
+            db.session.commit()
+
+            # Bulk inserts don't trigger the ORM events updating the key filter
+            for key_id, _, _ in keys:
+                key_filter.add(key_id)
+
+            rotated += len(rows)
+            last_id = user_ids[-1]
+            yield "".join(
+                json.dumps({"id": row.id, "email": row.email, "api_key": api_key})
+                + "\n"
+                for row, (_, _, api_key) in zip(rows, keys)
+            )
+
+        log.info("%d users API keys have been rotated", rotated)
+        _audit("users.api_keys.rotate", rotated=rotated, job_id=job.job_id)
+        error = None
+        yield json.dumps({"rotated": rotated, "job": job_url}) + "\n"
+    except Exception as err:
+        db.session.rollback()
+        log.error(f"Error occurred: {str(err)}")
+        error = "Could not process your request"
+        yield json.dumps({"error": error, "rotated": rotated, "job": job_url}) + "\n"
+    finally:
+        # Closes the session
+        jobs.finish(job.job_id, {"rotated": rotated}, error)
+
+
+def _usage_counters(subject: str, subject_ids: list) -> dict:
+    counters = {
+        subject_id: {"request_count": 0, "last_seen_at": None, "pending": 0}
+        for subject_id in subject_ids
+    }
+    for counter in UsageCounter.query.filter(
+        UsageCounter.subject == subject, UsageCounter.subject_id.in_(subject_ids)
+    ):
+        counters[counter.subject_id].update(
+            request_count=counter.request_count, last_seen_at=counter.last_seen_at
+        )
+
+    for (pending_subject, subject_id), (count, seen_at) in usage.pending().items():
+        if pending_subject == subject and subject_id in counters:
+            counters[subject_id]["request_count"] += count
+            counters[subject_id]["last_seen_at"] = seen_at
+            counters[subject_id]["pending"] = count
+    return counters
+
+
+@users.route("/<user_id>/api-keys", methods=["GET"])
+@read_replica
+@rate_limited
+@api_key_required
+@admin_required
+def get_user_api_keys(user_id):
+    user = _get_user(user_id)
+    if not user:
+        return jsonify({"error": "User not found!"}), 404
+
+    counters = _usage_counters("api_key", [key.key_id for key in user.api_keys])
+
+    return (
+        jsonify(
+            {
+                "api_keys": [
+                    {
+                        "key_id": api_key.key_id,
+                        "name": api_key.name,
+                        "created_at": api_key.created_at,
+                        "last_used_at": counters[api_key.key_id]["last_seen_at"],
+                    }
+                    for api_key in user.api_keys
+                ]
+            }
+        ),
+        200,
+    )
+
+
+@users.route("/<user_id>/usage", methods=["GET"])
+@read_replica
+@rate_limited
+@api_key_required
+@admin_required
+def get_user_usage(user_id):
+    """
+    The user and API keys usage, as written to the database plus the counts
+    still pending in this worker.
+    """
+    user = _get_user(user_id)
+    if not user:
+        return jsonify({"error": "User not found!"}), 404
+
+    key_ids = [api_key.key_id for api_key in user.api_keys]
+    return (
+        jsonify(
+            {
+                "user": _usage_counters("user", [user.id])[user.id],
+                "api_keys": _usage_counters("api_key", key_ids),
+            }
+        ),
+        200,
+    )
+
+
+@users.route("/<user_id>/api-keys", methods=["POST"])
+@rate_limited
+@api_key_required
+@idempotent
+@admin_required
+def add_user_api_key(user_id):
+    """
+    Generate an additional API key, the existing keys stay valid.
+    """
+    user = _get_user(user_id)
+    if not user:
+        return jsonify({"error": "User not found!"}), 404
+
+    data = request.get_json(silent=True) or {}
+    api_key, user_new_api_key = user.add_api_key(data.get("name"))
+
+    try:
+        db.session.commit()
+        log.info('User "%s" API key "%s" has been added', user.email, api_key.key_id)
+        _audit("user.api_key.create", user_id, key_id=api_key.key_id)
+        return (
+            jsonify(
+                {
+                    "message": "New API key has been generated, "
+                    "be sure to save this now. "
+                    "It cannot be recovered once lost!",
+                    "key_id": api_key.key_id,
+                    "api_key": user_new_api_key,
+                }
+            ),
+            201,
+        )
+    except Exception as e:
+        db.session.rollback()
+        log.error(f"Error occurred: {str(e)}")
+        return jsonify({"error": "Could not process your request"}), 500
+    finally:
+        db.session.close()
+
+
+@users.route("/<user_id>/api-keys/<key_id>", methods=["DELETE"])
+@rate_limited
+@api_key_required
+@admin_required
+def delete_user_api_key(user_id, key_id):
+    api_key = (
+        ApiKey.query.filter_by(user_id=user_id, key_id=key_id)
+        .join(ApiKey.user)
+        .filter(User.deleted_at.is_(None))
+        .first()
+    )
+    if not api_key:
+        return jsonify({"error": "API key not found!"}), 404
+
+    try:
+        db.session.delete(api_key)
+        db.session.commit()
+        log.info('API key "%s" has been revoked', key_id)
+        _audit("user.api_key.revoke", user_id, key_id=key_id)
+        return jsonify({"message": "API key has been revoked"}), 200
+    except Exception as e:
+        db.session.rollback()
+        log.error(f"Error occurred: {str(e)}")
+        return jsonify({"error": "Could not process your request"}), 500
+    finally:
+        db.session.close()
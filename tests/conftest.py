@@ -27,10 +27,15 @@ users = {
 
 @pytest.fixture()
 def app():
-    app = create_app(database_uri="sqlite://")
+    app = create_app(
+        database_uri="sqlite://",
+        config={
+            "USAGE_FLUSH_INTERVAL": 0,
+            "AUDIT_FLUSH_INTERVAL": 0,
+            "RATE_LIMIT_ENABLED": False,
+        },
+    )
     with app.app_context():
-        db.create_all()
-
         for user in users.values():
             new_user = User(
                 first_name=user["first_name"],
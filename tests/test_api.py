@@ -426,3 +426,96 @@ def test_user_lifetime(client):
     resp = client.get("/api/v1/admin-check", headers=headers_new_user)
     assert resp.status_code == 403
     assert resp.json["error"] == "Inactive account"
+
+
+def test_list_filters(client):
+    for n, domain in enumerate(["pytest.local", "pytest.local", "example.org"]):
+        resp = client.post(
+            "/api/v1/users",
+            headers=headers_admin,
+            data=json.dumps(
+                {
+                    "first_name": "json",
+                    "last_name": f"derulo{n}",
+                    "email": f"filter{n}@{domain}",
+                    "is_active": n != 1,
+                }
+            ),
+        )
+        assert resp.status_code == 201
+
+    # Field selection, the id is always returned
+    resp = client.get("/api/v1/users?fields=email", headers=headers_admin)
+    assert resp.status_code == 200
+    assert set(resp.json["users"][0]) == {"id", "email"}
+
+    resp = client.get("/api/v1/users?fields=email,password", headers=headers_admin)
+    assert resp.status_code == 400
+
+    # Filters
+    resp = client.get("/api/v1/users?is_admin=true", headers=headers_admin)
+    assert {user["email"] for user in resp.json["users"]} == {
+        "superuser@localhost",
+        "admin@local",
+    }
+
+    resp = client.get("/api/v1/users?is_active=false", headers=headers_admin)
+    assert [user["email"] for user in resp.json["users"]] == ["filter1@pytest.local"]
+
+    resp = client.get("/api/v1/users?email_domain=pytest.local", headers=headers_admin)
+    assert resp.json["total_items"] == 2
+
+    resp = client.get(
+        "/api/v1/users?email_prefix=filter&email_domain=example.org",
+        headers=headers_admin,
+    )
+    assert [user["email"] for user in resp.json["users"]] == ["filter2@example.org"]
+
+    resp = client.get("/api/v1/users?is_admin=maybe", headers=headers_admin)
+    assert resp.status_code == 400
+
+    # Sorting
+    resp = client.get(
+        "/api/v1/users?email_prefix=filter&sort=-last_name", headers=headers_admin
+    )
+    assert [user["last_name"] for user in resp.json["users"]] == [
+        "derulo2",
+        "derulo1",
+        "derulo0",
+    ]
+
+    resp = client.get("/api/v1/users?sort=hashed_api_key", headers=headers_admin)
+    assert resp.status_code == 400
+
+    # Pagination links keep the filters
+    resp = client.get(
+        "/api/v1/users?email_prefix=filter&per_page=1", headers=headers_admin
+    )
+    assert "email_prefix=filter" in resp.json["next_page"]
+    resp = client.get(resp.json["next_page"], headers=headers_admin)
+    assert len(resp.json["users"]) == 1
+
+
+def test_user_count(client):
+    resp = client.get("/api/v1/users", headers=headers_admin)
+    assert resp.json["total_items"] == 3
+
+    resp = client.post(
+        "/api/v1/users",
+        headers=headers_admin,
+        data=json.dumps(
+            {"first_name": "json", "last_name": "derulo", "email": "count@pytest.local"}
+        ),
+    )
+    user_id = resp.json["id"]
+    resp = client.get("/api/v1/users?per_page=2", headers=headers_admin)
+    assert resp.json["total_items"] == 4
+    assert resp.json["total_pages"] == 2
+
+    client.delete(f"/api/v1/users/{user_id}", headers=headers_admin)
+    for exact in ("false", "true"):
+        resp = client.get(f"/api/v1/users?exact={exact}", headers=headers_admin)
+        assert resp.json["total_items"] == 3
+
+    resp = client.get("/api/v1/users?exact=maybe", headers=headers_admin)
+    assert resp.status_code == 400
@@ -0,0 +1,196 @@
+import json
+from datetime import datetime
+
+from app import db
+from app.libs.usage import usage
+from app.models import UsageCounter, User
+
+from .conftest import users
+
+headers_admin = {
+    "Authorization": f'Bearer {users["admin"]["api_key"]}',
+    "Content-Type": "application/json",
+}
+
+
+def test_prefixed_api_keys(client):
+    resp = client.post(
+        "/api/v1/users",
+        headers=headers_admin,
+        data=json.dumps(
+            {"first_name": "json", "last_name": "derulo", "email": "user1@pytest.local"}
+        ),
+    )
+    user_id = resp.json["id"]
+    first_api_key = resp.json["api_key"]
+    assert first_api_key.startswith("sk_")
+
+    # Additional key, both keys are valid
+    resp = client.post(
+        f"/api/v1/users/{user_id}/api-keys",
+        headers=headers_admin,
+        data=json.dumps({"name": "ci"}),
+    )
+    assert resp.status_code == 201
+    second_key_id, second_api_key = resp.json["key_id"], resp.json["api_key"]
+
+    for api_key in (first_api_key, second_api_key):
+        resp = client.get(
+            "/api/v1/check", headers={"Authorization": f"Bearer {api_key}"}
+        )
+        assert resp.status_code == 200
+
+    # A valid key id with a wrong secret
+    resp = client.get(
+        "/api/v1/check", headers={"Authorization": f"Bearer {second_api_key}x"}
+    )
+    assert resp.status_code == 403
+
+    # The usage is buffered then written in bulk
+    resp = client.get(f"/api/v1/users/{user_id}/usage", headers=headers_admin)
+    assert resp.json["user"]["request_count"] == 2
+    assert resp.json["user"]["pending"] == 2
+    assert resp.json["api_keys"][second_key_id]["request_count"] == 1
+
+    assert usage.flush() >= 4
+    assert usage.pending() == {}
+    resp = client.get(f"/api/v1/users/{user_id}/usage", headers=headers_admin)
+    assert resp.json["user"]["request_count"] == 2
+    assert resp.json["user"]["pending"] == 0
+
+    client.get("/api/v1/check", headers={"Authorization": f"Bearer {first_api_key}"})
+    usage.flush()
+    resp = client.get(f"/api/v1/users/{user_id}/usage", headers=headers_admin)
+    assert resp.json["user"]["request_count"] == 3
+
+    resp = client.get(f"/api/v1/users/{user_id}/api-keys", headers=headers_admin)
+    assert {key["name"] for key in resp.json["api_keys"]} == {None, "ci"}
+    assert all(key["last_used_at"] for key in resp.json["api_keys"])
+
+    # Revoke one key
+    resp = client.delete(
+        f"/api/v1/users/{user_id}/api-keys/{second_key_id}", headers=headers_admin
+    )
+    assert resp.status_code == 200
+    resp = client.get(
+        "/api/v1/check", headers={"Authorization": f"Bearer {second_api_key}"}
+    )
+    assert resp.status_code == 403
+    resp = client.get(
+        "/api/v1/check", headers={"Authorization": f"Bearer {first_api_key}"}
+    )
+    assert resp.status_code == 200
+
+    # Custom keys can't look like generated keys
+    resp = client.patch(
+        f"/api/v1/users/{user_id}",
+        headers=headers_admin,
+        data=json.dumps({"api_key": "sk_0123456789ab_secret"}),
+    )
+    assert resp.status_code == 400
+
+    # Setting a custom key revokes the generated keys
+    resp = client.patch(
+        f"/api/v1/users/{user_id}",
+        headers=headers_admin,
+        data=json.dumps({"api_key": "custom-key"}),
+    )
+    assert resp.status_code == 200
+    resp = client.get(
+        "/api/v1/check", headers={"Authorization": f"Bearer {first_api_key}"}
+    )
+    assert resp.status_code == 403
+    resp = client.get("/api/v1/check", headers={"Authorization": "Bearer custom-key"})
+    assert resp.status_code == 200
+
+    # Deleting the user deletes its keys
+    resp = client.post(f"/api/v1/users/{user_id}/api-keys", headers=headers_admin)
+    api_key = resp.json["api_key"]
+    resp = client.delete(f"/api/v1/users/{user_id}", headers=headers_admin)
+    assert resp.status_code == 200
+    resp = client.get("/api/v1/check", headers={"Authorization": f"Bearer {api_key}"})
+    assert resp.status_code == 403
+
+
+def test_rotate_api_keys(app, client):
+    app.config.update(KEY_ROTATION_BATCH_SIZE=3)
+    with app.app_context():
+        for n in range(7):
+            user = User(email=f"user{n}@rotate.local")
+            user.add_api_key()
+            db.session.add(user)
+        db.session.commit()
+
+    resp = client.post(
+        "/api/v1/users/rotate-api-keys?is_admin=maybe", headers=headers_admin
+    )
+    assert resp.status_code == 400
+
+    resp = client.post(
+        "/api/v1/users/rotate-api-keys?email_domain=rotate.local",
+        headers=headers_admin,
+    )
+    assert resp.status_code == 200
+    assert resp.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+    assert lines[-1] == {"rotated": 7, "job": resp.headers["Location"]}
+    assert len({line["api_key"] for line in lines[:-1]}) == 7
+
+    for line in lines[:-1]:
+        headers = {"Authorization": f'Bearer {line["api_key"]}'}
+        assert client.get("/api/v1/check", headers=headers).status_code == 200
+
+    # All the users except the requesting admin (7 + user + superuser),
+    # the previous keys are revoked
+    resp = client.post("/api/v1/users/rotate-api-keys", headers=headers_admin)
+    lines = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+    assert lines[-1]["rotated"] == 9
+    assert users["admin"]["email"] not in {line.get("email") for line in lines}
+    job = client.get(lines[-1]["job"], headers=headers_admin).json
+    assert job["kind"] == "rotate_api_keys"
+    assert job["status"] == "succeeded"
+    assert job["progress"] == 9 and job["result"] == {"rotated": 9}
+
+    headers = {"Authorization": f'Bearer {users["user"]["api_key"]}'}
+    assert client.get("/api/v1/check", headers=headers).status_code == 403
+    assert client.get("/api/v1/check", headers=headers_admin).status_code == 200
+
+
+def test_usage_failed_flush_is_restored(app, monkeypatch):
+    usage.flush()
+    first, second = datetime(2024, 1, 1), datetime(2024, 1, 2)
+    usage.push("user", "restored", first)
+    usage.push("user", "restored", first)
+
+    def fail(pending):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(usage, "write", fail)
+    assert usage.flush() == 0
+    monkeypatch.undo()
+
+    # Merged with the newer counts
+    usage.push("user", "restored", second)
+    assert usage.pending() == {("user", "restored"): (3, second)}
+    assert usage.flush() == 1
+    with app.app_context():
+        counter = UsageCounter.query.filter_by(
+            subject="user", subject_id="restored"
+        ).one()
+        assert (counter.request_count, counter.last_seen_at) == (3, second)
+
+
+def test_rotate_api_keys_interrupted(app, client):
+    app.config.update(KEY_ROTATION_BATCH_SIZE=1)
+    resp = client.post(
+        "/api/v1/users/rotate-api-keys", headers=headers_admin, buffered=False
+    )
+    stream = iter(resp.response)
+    assert "api_key" in json.loads(next(stream))
+    resp.close()
+
+    # The failure is reported by the job, not the (already sent) status code
+    job = client.get(resp.headers["Location"], headers=headers_admin).json
+    assert job["status"] == "failed"
+    assert job["result"] == {"rotated": 1}
+    assert "Interrupted" in job["error"]
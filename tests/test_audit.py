@@ -0,0 +1,126 @@
+import json
+
+from app import db
+from app.libs.audit import audit
+from app.models import AuditEvent, User
+
+from .conftest import users
+
+headers_admin = {
+    "Authorization": f'Bearer {users["admin"]["api_key"]}',
+    "Content-Type": "application/json",
+}
+new_user = {"first_name": "json", "last_name": "derulo", "email": "user1@pytest.local"}
+
+
+def test_audit_events(app, client):
+    with app.app_context():
+        admin_id = User.query.filter_by(email=users["admin"]["email"]).one().id
+        # Events left pending by the previous tests
+        audit.flush()
+        db.session.execute(db.delete(AuditEvent))
+        db.session.commit()
+
+    resp = client.post(
+        "/api/v1/users", headers=headers_admin, data=json.dumps(new_user)
+    )
+    user_id = resp.json["id"]
+    client.patch(
+        f"/api/v1/users/{user_id}",
+        headers=headers_admin,
+        data=json.dumps({"first_name": "jason", "last_name": "derulo"}),
+    )
+    client.post(f"/api/v1/users/{user_id}/api-keys", headers=headers_admin)
+    client.delete(f"/api/v1/users/{user_id}", headers=headers_admin)
+
+    # Failed changes aren't recorded
+    client.post("/api/v1/users", headers=headers_admin, data=json.dumps(new_user))
+    client.patch(f"/api/v1/users/{user_id}", headers=headers_admin, data="{}")
+
+    # Nothing is written until the buffer is flushed
+    resp = client.get("/api/v1/audit-events", headers=headers_admin)
+    assert resp.json["events"] == []
+    assert resp.json["pending"] == 5
+    assert audit.flush() == 5
+
+    resp = client.get(
+        f"/api/v1/audit-events?target_id={user_id}&limit=3", headers=headers_admin
+    )
+    assert resp.status_code == 200
+    events = resp.json["events"]
+    assert [event["action"] for event in events] == [
+        "user.delete",
+        "user.api_key.create",
+        "user.update",
+    ]
+    assert {event["actor_id"] for event in events} == {admin_id}
+    assert events[0]["source_addr"] == "127.0.0.1"
+    assert events[2]["details"] == {"fields": ["first_name"]}
+
+    resp = client.get(resp.json["next_page"], headers=headers_admin)
+    assert [event["action"] for event in resp.json["events"]] == ["user.create"]
+    assert resp.json["events"][0]["details"] == {"email": new_user["email"]}
+    assert resp.json["next_page"] is None
+
+    resp = client.get("/api/v1/audit-events?action=user.update", headers=headers_admin)
+    assert len(resp.json["events"]) == 1
+
+    resp = client.get("/api/v1/audit-events?limit=0", headers=headers_admin)
+    assert resp.status_code == 400
+
+    headers_user = {"Authorization": f'Bearer {users["user"]["api_key"]}'}
+    resp = client.get("/api/v1/audit-events", headers=headers_user)
+    assert resp.status_code == 403
+
+
+def test_failed_writes_are_retried(app, monkeypatch):
+    with app.app_context():
+        audit.flush()
+        db.session.execute(db.delete(AuditEvent))
+        db.session.commit()
+
+    def fail(pending):
+        raise RuntimeError("database is locked")
+
+    stats = audit.stats()
+    audit.record("first", None)
+    monkeypatch.setattr(audit, "write", fail)
+    assert audit.flush() == 0
+    audit.record("second", None)
+    assert audit.stats()["pending"] == 2
+    monkeypatch.undo()
+
+    assert audit.flush() == 2
+    with app.app_context():
+        actions = db.session.execute(
+            db.select(AuditEvent.action).order_by(AuditEvent.id)
+        ).scalars()
+        assert list(actions) == ["first", "second"]
+
+    # Dropped after failing max_retries times in a row
+    audit.record("lost", None)
+    monkeypatch.setattr(audit, "write", fail)
+    for _ in range(audit.max_retries + 1):
+        assert audit.flush() == 0
+    assert audit.stats()["pending"] == 0
+    assert audit.stats()["retries"] == stats["retries"] + audit.max_retries + 1
+    assert audit.stats()["dropped"] == stats["dropped"] + 1
+
+
+def test_audit_events_query_plan(app):
+    # Every filter is served by an index, without sorting the events
+    with app.app_context():
+        for name in ("action", "actor_id", "target_id"):
+            select = (
+                db.select(AuditEvent)
+                .where(getattr(AuditEvent, name) == "x", AuditEvent.id < 100)
+                .order_by(AuditEvent.id.desc())
+                .limit(10)
+            )
+            sql = select.compile(compile_kwargs={"literal_binds": True})
+            plan = " ".join(
+                row[-1]
+                for row in db.session.execute(db.text(f"EXPLAIN QUERY PLAN {sql}"))
+            )
+            assert f"ix_audit_events_{name}_id" in plan
+            assert "TEMP B-TREE" not in plan
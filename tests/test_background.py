@@ -0,0 +1,33 @@
+import multiprocessing
+import threading
+import time
+
+from app.libs.background import ProcessExecutor, ProcessThread
+
+
+def test_started_once_per_process():
+    started = multiprocessing.RawValue("i", 0)
+    release = threading.Event()
+
+    def target():
+        started.value += 1
+        release.wait()
+
+    def start_in_worker():
+        thread.start()
+        while started.value < 2:
+            time.sleep(0.01)
+
+    thread = ProcessThread(target, "test")
+    thread.start()
+    thread.start()
+    # A forked worker starts its own
+    worker = multiprocessing.get_context("fork").Process(target=start_in_worker)
+    worker.start()
+    worker.join(5)
+    release.set()
+    assert started.value == 2
+
+    executor = ProcessExecutor("test")
+    assert executor.get(2) is executor.get(2)
+    assert executor.get(2).submit(lambda: 42).result() == 42
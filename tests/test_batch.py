@@ -0,0 +1,217 @@
+import json
+
+import pytest
+from flask import request
+
+from app import create_app, db
+from app.libs.batch import batch
+from app.models import User
+
+from .conftest import users
+
+headers_admin = {
+    "Authorization": f'Bearer {users["admin"]["api_key"]}',
+    "Content-Type": "application/json",
+}
+headers_user = {
+    "Authorization": f'Bearer {users["user"]["api_key"]}',
+    "Content-Type": "application/json",
+}
+
+
+def send_batch(client, requests, headers=headers_admin, **options):
+    return client.post(
+        "/api/v1/batch",
+        headers=headers,
+        data=json.dumps({"requests": requests, **options}),
+    )
+
+
+def get_user_id(app, email):
+    with app.app_context():
+        return User.query.filter_by(email=email).one().id
+
+
+def test_batch(app, client):
+    user_id = get_user_id(app, users["user"]["email"])
+    user_url = f"/api/v1/users/{user_id}"
+    resp = send_batch(
+        client,
+        [
+            {"method": "GET", "path": user_url},
+            {"method": "PATCH", "path": user_url, "body": {"first_name": "batch"}},
+            {"method": "GET", "path": user_url},
+            {"method": "GET", "path": "/api/v1/users/unknown"},
+            {"method": "POST", "path": "/api/v1/users", "body": {}},
+            {"method": "GET", "path": "/api/v1/unknown"},
+        ],
+    )
+    assert resp.status_code == 200
+    responses = resp.json["responses"]
+    assert [response["status"] for response in responses] == [
+        200,
+        200,
+        200,
+        404,
+        400,
+        404,
+    ]
+    assert responses[0]["body"]["first_name"] == "user"
+    assert responses[0]["body"]["actions"]["modify-user"]["uri"] == (
+        f"http://localhost{user_url}"
+    )
+    assert responses[2]["body"]["first_name"] == "batch"
+    assert responses[4]["body"]["errors"]["email"] == "Missing required parameter"
+    assert "Content-Length" not in responses[0]["headers"]
+
+
+def test_batch_runs_as_the_batch_user(app, client):
+    # The sub-requests can't switch credentials
+    resp = send_batch(
+        client,
+        [
+            {"method": "GET", "path": "/api/v1/check"},
+            {
+                "method": "GET",
+                "path": "/api/v1/admin-check",
+                "headers": {"authorization": f'Bearer {users["admin"]["api_key"]}'},
+            },
+        ],
+        headers=headers_user,
+    )
+    assert [response["status"] for response in resp.json["responses"]] == [200, 403]
+
+    resp = client.post("/api/v1/batch", data="{}")
+    assert resp.status_code == 401
+
+
+def test_batch_stops_once_the_caller_changes(app, client):
+    admin_url = f'/api/v1/users/{get_user_id(app, users["admin"]["email"])}'
+    resp = send_batch(
+        client,
+        [
+            {"method": "PATCH", "path": admin_url, "body": {"first_name": "batch"}},
+            {"method": "GET", "path": "/api/v1/admin-check"},
+            {"method": "PATCH", "path": admin_url, "body": {"is_admin": False}},
+            {"method": "GET", "path": "/api/v1/check"},
+            {"method": "GET", "path": "/api/v1/check"},
+        ],
+    )
+    responses = resp.json["responses"]
+    assert [response["status"] for response in responses] == [200, 200, 200, 403, 403]
+    assert responses[3]["body"]["error"] == "The batch request credentials changed"
+
+
+def test_batch_stops_once_the_keys_are_revoked(app, client):
+    admin_url = f'/api/v1/users/{get_user_id(app, users["admin"]["email"])}'
+    resp = send_batch(
+        client,
+        [
+            {"method": "POST", "path": f"{admin_url}/gen-api-key"},
+            {"method": "GET", "path": "/api/v1/check"},
+        ],
+    )
+    assert [response["status"] for response in resp.json["responses"]] == [200, 403]
+
+
+def test_batch_ignores_sub_request_forwarded_for(app, client):
+    @app.route("/api/v1/forwarded-for")
+    def forwarded_for():
+        return {"forwarded_for": request.headers.get("X-Forwarded-For")}
+
+    resp = send_batch(
+        client,
+        [
+            {
+                "method": "GET",
+                "path": "/api/v1/forwarded-for",
+                "headers": {"X-Forwarded-For": "10.0.0.1"},
+            }
+        ],
+    )
+    assert resp.json["responses"][0]["body"] == {"forwarded_for": None}
+
+
+@pytest.mark.parametrize(
+    "payload, error",
+    [
+        ({}, "Expected a list of 1 to 100 requests"),
+        ({"requests": []}, "Expected a list of 1 to 100 requests"),
+        (
+            {"requests": [{"method": "GET", "path": "/api/v1/check"}] * 101},
+            "Expected a list of 1 to 100 requests",
+        ),
+        (
+            {
+                "requests": [{"method": "GET", "path": "/api/v1/check"}],
+                "concurrent": "yes",
+            },
+            "Invalid concurrent value",
+        ),
+    ],
+)
+def test_invalid_batch(client, payload, error):
+    resp = client.post("/api/v1/batch", headers=headers_admin, data=json.dumps(payload))
+    assert resp.status_code == 400
+    assert resp.json["error"] == error
+
+
+def test_invalid_sub_requests(client):
+    resp = send_batch(
+        client,
+        [
+            {"method": "GET", "path": "/api/v1/check"},
+            {"method": "PUT", "path": "/static/file"},
+            {"method": "GET", "path": "/api/v1/check", "headers": {"X-Test": 1}},
+            "GET /api/v1/check",
+        ],
+    )
+    assert resp.status_code == 400
+    assert resp.json["errors"] == {
+        "1": {
+            "method": "Must be GET, POST, PATCH or DELETE",
+            "path": 'Must start with "/api/v1/"',
+        },
+        "2": {"headers": "Must be an object of strings"},
+        "3": {"payload": "Expected a JSON object"},
+    }
+
+    resp = send_batch(client, [{"method": "POST", "path": "/api/v1/batch"}])
+    assert resp.json["responses"][0]["status"] == 400
+    assert resp.json["responses"][0]["body"]["error"] == (
+        "Batch requests can't be nested"
+    )
+
+
+def test_concurrent_batch(tmp_path):
+    # The concurrent sub-requests run in other threads with their own connections
+    app = create_app(
+        database_uri=f"sqlite:///{tmp_path}/batch.db",
+        config={"USAGE_FLUSH_INTERVAL": 0, "RATE_LIMIT_ENABLED": False},
+    )
+    with app.app_context():
+        for n in range(10):
+            db.session.add(User(email=f"user{n}@batch.local", first_name=f"user{n}"))
+        db.session.commit()
+        user_ids = [
+            user.id for user in User.query.filter(User.email.like("%@batch.local"))
+        ]
+
+    client = app.test_client()
+    requests = [
+        {"method": "GET", "path": f"/api/v1/users/{user_id}"} for user_id in user_ids
+    ]
+    requests.insert(
+        5,
+        {"method": "PATCH", "path": requests[5]["path"], "body": {"last_name": "x"}},
+    )
+    concurrent = batch.stats()["concurrent"]
+    headers = {**headers_admin, "Authorization": "Bearer superuser"}
+    resp = send_batch(client, requests, headers=headers, concurrent=True)
+    assert resp.status_code == 200
+    responses = resp.json["responses"]
+    assert [response["status"] for response in responses] == [200] * 11
+    assert [response["body"]["id"] for response in responses[:5]] == (user_ids[:5])
+    assert responses[6]["body"]["last_name"] == "x"
+    # Two groups of reads around the write
+    assert batch.stats()["concurrent"] == concurrent + 10
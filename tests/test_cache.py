@@ -0,0 +1,116 @@
+import json
+
+from sqlalchemy.orm import Session
+
+from app import db
+from app.libs.cache import response_cache
+from app.models import User
+
+from .conftest import users
+
+headers_admin = {
+    "Authorization": f'Bearer {users["admin"]["api_key"]}',
+    "Content-Type": "application/json",
+}
+
+
+def test_cached_users_list(app, client):
+    resp = client.get("/api/v1/users?page=1&per_page=5", headers=headers_admin)
+    assert resp.headers["X-Cache"] == "miss"
+    total = resp.json["total_items"]
+
+    # Same arguments in another order
+    cached = client.get("/api/v1/users?per_page=5&page=1", headers=headers_admin)
+    assert cached.headers["X-Cache"] == "hit"
+    assert cached.json == resp.json
+
+    # Authorization is still checked
+    headers_user = {"Authorization": f'Bearer {users["user"]["api_key"]}'}
+    resp = client.get("/api/v1/users?page=1&per_page=5", headers=headers_user)
+    assert resp.status_code == 403
+
+    resp = client.post(
+        "/api/v1/users",
+        headers=headers_admin,
+        data=json.dumps(
+            {"first_name": "json", "last_name": "derulo", "email": "user1@pytest.local"}
+        ),
+    )
+    user_id = resp.json["id"]
+    resp = client.get("/api/v1/users?page=1&per_page=5", headers=headers_admin)
+    assert resp.headers["X-Cache"] == "miss"
+    assert resp.json["total_items"] == total + 1
+
+    stats = client.get("/api/v1/metrics", headers=headers_admin).json
+    assert stats["response_cache"]["hits"] >= 1
+    assert 0 < stats["response_cache"]["hit_ratio"] < 1
+
+    # Changes made outside of the endpoints
+    client.get(f"/api/v1/users/{user_id}", headers=headers_admin)
+    resp = client.get(f"/api/v1/users/{user_id}", headers=headers_admin)
+    assert resp.headers["X-Cache"] == "hit"
+    with app.app_context():
+        db.session.get(User, user_id).first_name = "jason"
+        db.session.commit()
+    resp = client.get(f"/api/v1/users/{user_id}", headers=headers_admin)
+    assert resp.headers["X-Cache"] == "miss"
+    assert resp.json["first_name"] == "jason"
+
+    # Bulk statements
+    with app.app_context():
+        db.session.execute(db.delete(User).where(User.id == user_id))
+        db.session.commit()
+    resp = client.get(f"/api/v1/users/{user_id}", headers=headers_admin)
+    assert resp.status_code == 404
+
+
+def test_rolled_back_changes_keep_the_cache(app, client):
+    client.get("/api/v1/users", headers=headers_admin)
+    with app.app_context():
+        User.query.first().first_name = "rolled back"
+        db.session.flush()
+        db.session.rollback()
+    resp = client.get("/api/v1/users", headers=headers_admin)
+    assert resp.headers["X-Cache"] == "hit"
+
+
+def test_core_and_text_writes_invalidate(app, client):
+    def cached_first_name():
+        client.get(f"/api/v1/users/{user_id}", headers=headers_admin)
+        resp = client.get(f"/api/v1/users/{user_id}", headers=headers_admin)
+        assert resp.headers["X-Cache"] == "hit"
+
+    with app.app_context():
+        user_id = User.query.first().id
+
+    cached_first_name()
+    with app.app_context():
+        db.session.execute(
+            User.__table__.update()
+            .where(User.__table__.c.id == user_id)
+            .values(first_name="core")
+        )
+        db.session.commit()
+    resp = client.get(f"/api/v1/users/{user_id}", headers=headers_admin)
+    assert resp.json["first_name"] == "core"
+
+    cached_first_name()
+    with app.app_context():
+        db.session.execute(
+            db.text("UPDATE users SET first_name = 'text' WHERE id = :id"),
+            {"id": user_id},
+        )
+        db.session.commit()
+    resp = client.get(f"/api/v1/users/{user_id}", headers=headers_admin)
+    assert resp.json["first_name"] == "text"
+
+
+def test_other_sessions_keep_the_generation(app):
+    # Sessions of other engines, not the app ones
+    engine = db.create_engine("sqlite://")
+    with Session(engine) as session:
+        session.execute(db.text("CREATE TABLE users (id TEXT)"))
+        session.execute(db.text("INSERT INTO users VALUES ('other')"))
+        generation = response_cache.generation
+        session.commit()
+    assert response_cache.generation == generation
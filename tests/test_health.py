@@ -0,0 +1,76 @@
+import os
+import time
+
+from app import create_app, db
+from app.libs.health import health
+
+
+def test_liveness(client):
+    for url in ("/api/v1/status", "/api/v1/live"):
+        resp = client.get(url)
+        assert resp.status_code == 200
+        assert resp.json["message"] == "Up and running"
+
+
+def probes(app):
+    with app.app_context():
+        return health.stats()["probes"]
+
+
+def test_readiness(tmp_path):
+    app = create_app(
+        database_uri=f"sqlite:///{tmp_path}/health.db",
+        config={"HEALTH_PROBE_TTL": 0.2},
+    )
+    client = app.test_client()
+    first_probes = probes(app)
+
+    resp = client.get("/api/v1/ready")
+    assert resp.status_code == 200
+    assert resp.json["status"] == "ready"
+    assert resp.json["database"]["ok"] is True
+    # The details are only in the admin metrics
+    assert set(resp.json) == {"status", "database"}
+    with app.app_context():
+        assert health.stats()["pool"]["class"] == "QueuePool"
+
+    # The probe result is cached
+    for _ in range(10):
+        assert client.get("/api/v1/ready").status_code == 200
+    assert probes(app) == first_probes + 1
+    assert health.in_flight()["worker"] == 0
+
+    # Then probed again
+    with app.app_context():
+        db.session.execute(db.text("DROP TABLE users"))
+        db.session.commit()
+    time.sleep(0.2)
+    resp = client.get("/api/v1/ready")
+    assert resp.status_code == 503
+    assert resp.json["status"] == "unavailable"
+    assert resp.json["database"]["error"] == "OperationalError"
+    assert probes(app) == first_probes + 2
+
+
+def test_in_flight_slots(monkeypatch):
+    class Worker:
+        pid = os.getpid()
+
+    monkeypatch.setattr(health, "_slot", None)
+    health._add_in_flight(1)
+    assert health.in_flight() == {"worker": 1, "all_workers": 1}
+
+    # As a gunicorn worker, along with another one killed mid-request
+    health.post_fork(None, Worker)
+    health._slot_pids[1], health._slot_in_flight[1] = 12345, 3
+    health._add_in_flight(1)
+    assert health.in_flight() == {"worker": 2, "all_workers": 5}
+
+    dead = Worker()
+    dead.pid = 12345
+    health.child_exit(None, dead)
+    assert health.in_flight() == {"worker": 2, "all_workers": 2}
+
+    health._add_in_flight(-2)
+    health.child_exit(None, Worker)
+    assert health.in_flight() == {"worker": 0, "all_workers": 0}
@@ -0,0 +1,135 @@
+import json
+import threading
+from datetime import datetime, timedelta
+
+from app import create_app, db
+from app.libs.idempotency import idempotency
+from app.models import IdempotencyKey, User
+
+from .conftest import users
+
+headers_admin = {
+    "Authorization": f'Bearer {users["admin"]["api_key"]}',
+    "Content-Type": "application/json",
+}
+new_user = {"first_name": "json", "last_name": "derulo", "email": "user1@pytest.local"}
+
+
+def test_replayed_response(app, client):
+    headers = {**headers_admin, "Idempotency-Key": "create-user-1"}
+    first = client.post("/api/v1/users", headers=headers, data=json.dumps(new_user))
+    assert first.status_code == 201
+    assert "Idempotent-Replayed" not in first.headers
+
+    # The new API key isn't stored, the replay says it was issued
+    retry = client.post("/api/v1/users", headers=headers, data=json.dumps(new_user))
+    assert retry.status_code == 410
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.json["status_code"] == 201
+    assert retry.json["response"] == {
+        name: value for name, value in first.json.items() if name != "api_key"
+    }
+
+    with app.app_context():
+        assert User.query.filter_by(email=new_user["email"]).count() == 1
+        stored = IdempotencyKey.query.one()
+        assert first.json["api_key"].encode() not in stored.body
+
+    # Same key with another request
+    resp = client.post(
+        "/api/v1/users",
+        headers=headers,
+        data=json.dumps({**new_user, "email": "user2@pytest.local"}),
+    )
+    assert resp.status_code == 422
+
+    # Same key with other credentials
+    headers["Authorization"] = "Bearer superuser"
+    resp = client.post("/api/v1/users", headers=headers, data=json.dumps(new_user))
+    assert resp.status_code == 400
+    assert resp.json["error"] == "user already exists"
+
+
+def test_failed_requests_are_not_stored(app, client):
+    headers = {**headers_admin, "Idempotency-Key": "user-1"}
+    resp = client.patch("/api/v1/users/unknown", headers=headers, data="{}")
+    assert resp.status_code == 404
+
+    # Requests refused by the decorators below are not stored either
+    headers = {
+        "Authorization": f'Bearer {users["user"]["api_key"]}',
+        "Idempotency-Key": "user-2",
+    }
+    assert client.post("/api/v1/users", headers=headers).status_code == 403
+    with app.app_context():
+        assert IdempotencyKey.query.count() == 1
+
+
+def test_concurrent_duplicates(tmp_path):
+    app = create_app(
+        database_uri=f"sqlite:///{tmp_path}/idempotency.db",
+        config={"RATE_LIMIT_ENABLED": False, "USAGE_FLUSH_INTERVAL": 0},
+    )
+    headers = {
+        "Authorization": "Bearer superuser",
+        "Content-Type": "application/json",
+        "Idempotency-Key": "concurrent",
+    }
+    with app.app_context():
+        user_id = User.query.first().id
+
+    responses = []
+
+    def regenerate():
+        client = app.test_client()
+        responses.append(
+            client.post(f"/api/v1/users/{user_id}/api-keys", headers=headers)
+        )
+
+    threads = [threading.Thread(target=regenerate) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Repeats get the stored response, or a conflict while the first one runs
+    created = [resp for resp in responses if "Idempotent-Replayed" not in resp.headers]
+    assert [resp.status_code for resp in created if resp.status_code != 409] == [201]
+    for resp in responses:
+        if resp.headers.get("Idempotent-Replayed"):
+            assert resp.status_code == 410
+            assert "api_key" not in resp.json["response"]
+    with app.app_context():
+        assert len(db.session.get(User, user_id).api_keys) == 1
+
+
+def test_purge(app):
+    with app.app_context():
+        now = datetime.utcnow()
+        for n, age in enumerate((0, 10, 20, 90000)):
+            db.session.add(
+                IdempotencyKey(
+                    key_digest=f"{n:064x}",
+                    fingerprint="",
+                    status_code=200,
+                    created_at=now - timedelta(seconds=age),
+                )
+            )
+        # Left in progress by a crashed worker
+        db.session.add(
+            IdempotencyKey(
+                key_digest=f"{9:064x}",
+                fingerprint="",
+                created_at=now - timedelta(seconds=600),
+            )
+        )
+        db.session.commit()
+
+        idempotency.max_keys = 2
+        try:
+            assert idempotency.purge() == 3
+        finally:
+            idempotency.max_keys = app.config["IDEMPOTENCY_MAX_KEYS"]
+        assert db.session.execute(
+            db.select(IdempotencyKey.key_digest).order_by(IdempotencyKey.key_digest)
+        ).scalars().all() == [f"{0:064x}", f"{1:064x}"]
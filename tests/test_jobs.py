@@ -0,0 +1,140 @@
+import json
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import create_app, db
+from app.libs.audit import audit
+from app.libs.jobs import jobs
+from app.libs.purger import purger
+from app.models import ApiKey, AuditEvent, Job, User
+
+headers = {"Authorization": "Bearer superuser"}
+
+
+@pytest.fixture()
+def file_app(tmp_path):
+    # The jobs run in other threads, which need their own database connections
+    return create_app(
+        database_uri=f"sqlite:///{tmp_path}/jobs.db",
+        config={
+            "USAGE_FLUSH_INTERVAL": 0,
+            "RATE_LIMIT_ENABLED": False,
+            "JOBS_BATCH_SIZE": 10,
+        },
+    )
+
+
+def wait_for_job(client, job_url):
+    for _ in range(100):
+        job = client.get(job_url, headers=headers).json
+        if job["status"] not in ("queued", "running"):
+            return job
+        time.sleep(0.05)
+    raise TimeoutError(job)
+
+
+def test_bulk_delete_users(file_app):
+    client = file_app.test_client()
+    with file_app.app_context():
+        for n in range(25):
+            user = User(email=f"user{n}@delete.local")
+            user.add_api_key()
+            db.session.add(user)
+        db.session.add(User(email="user@keep.local"))
+        db.session.commit()
+
+    resp = client.delete("/api/v1/users", headers=headers)
+    assert resp.status_code == 400
+
+    resp = client.delete("/api/v1/users?is_admin=maybe", headers=headers)
+    assert resp.status_code == 400
+
+    resp = client.delete("/api/v1/users?email_domain=delete.local", headers=headers)
+    assert resp.status_code == 202
+    assert resp.headers["Location"] == resp.json["job"]
+
+    job = wait_for_job(client, resp.json["job"])
+    assert job["status"] == "succeeded"
+    assert job["kind"] == "delete_users"
+    assert job["progress"] == job["total"] == 25
+    assert job["result"] == {"deleted": 25}
+
+    # Soft deleted, then purged
+    with file_app.app_context():
+        assert User.query.filter_by(deleted_at=None).count() == 2
+        assert ApiKey.query.count() == 25
+    assert purger.purge() == 25
+
+    audit.flush()
+    with file_app.app_context():
+        assert User.query.count() == 2
+        assert ApiKey.query.count() == 0
+        # Audited as the job creator
+        event = AuditEvent.query.filter_by(action="users.delete").one()
+        assert event.actor_id == job["created_by"]
+        assert event.details == {
+            "filters": {"email_domain": "delete.local"},
+            "deleted": 25,
+            "job_id": job["id"],
+        }
+
+    # The requesting user is never deleted
+    resp = client.delete("/api/v1/users?is_admin=true", headers=headers)
+    job = wait_for_job(client, resp.json["job"])
+    assert job["result"] == {"deleted": 0}
+    assert client.get("/api/v1/check", headers=headers).status_code == 200
+
+
+def test_failed_and_interrupted_jobs(file_app):
+    client = file_app.test_client()
+
+    @jobs.handler("test_failure")
+    def failing_job(job):
+        raise RuntimeError("Something went wrong")
+
+    with file_app.app_context():
+        job_id = jobs.submit("test_failure", {})
+    job = wait_for_job(client, f"/api/v1/jobs/{job_id}")
+    assert job["status"] == "failed"
+    assert job["error"] == "Something went wrong"
+
+    # A job whose process is gone, its lease expired
+    with file_app.app_context():
+        heartbeat_at = datetime.utcnow() - timedelta(minutes=5)
+        job = Job(kind="test_failure", status="running", heartbeat_at=heartbeat_at)
+        db.session.add(job)
+        db.session.commit()
+        job_id = job.id
+    job = client.get(f"/api/v1/jobs/{job_id}", headers=headers).json
+    assert job["status"] == "failed"
+    assert "Interrupted" in job["error"]
+
+    # A job of another process (or host) renewing its lease
+    with file_app.app_context():
+        job = Job(kind="test_failure", status="running", heartbeat_at=datetime.utcnow())
+        db.session.add(job)
+        db.session.commit()
+        job_id = job.id
+    job = client.get(f"/api/v1/jobs/{job_id}", headers=headers).json
+    assert job["status"] == "running"
+    assert jobs.heartbeat() == 0
+
+    assert client.get("/api/v1/jobs/unknown", headers=headers).status_code == 404
+    resp = client.get("/api/v1/metrics", headers=headers)
+    assert resp.json["jobs"]["failed"] >= 1
+
+    with pytest.raises(ValueError):
+        with file_app.app_context():
+            jobs.submit("unknown", {})
+
+
+def test_jobs_are_admin_only(client):
+    headers_user = {"Authorization": "Bearer user_api_key"}
+    resp = client.get("/api/v1/jobs/unknown", headers=headers_user)
+    assert resp.status_code == 403
+    resp = client.delete(
+        "/api/v1/users?is_admin=false", headers=headers_user, data=json.dumps({})
+    )
+    assert resp.status_code == 403
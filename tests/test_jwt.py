@@ -1,3 +1,11 @@
+import time
+from datetime import timedelta
+
+from flask_jwt_extended import create_access_token, decode_token
+
+from app import jwt
+from app.models import User
+
 from .conftest import users
 
 headers_admin = {
@@ -10,6 +18,10 @@ headers_user = {
 }
 
 
+def bearer(token):
+    return {"Authorization": f"Bearer {token}"}
+
+
 def test_user_auth_and_access(client):
     # Check JWT API access
     resp = client.get("/api/v1/jwt-check", headers=headers_user)
@@ -86,3 +98,58 @@ def test_admin_auth_and_access(client):
     assert resp.status_code == 200
     resp = client.get("/api/v1/admin-check", headers=headers_admin)
     assert resp.status_code == 200
+
+
+def test_token_cache(app, client, monkeypatch):
+    with app.test_request_context():
+        user = User.query.filter_by(email=users["user"]["email"]).one()
+        token = create_access_token(identity=user.id)
+        short_token = create_access_token(
+            identity=user.id, expires_delta=timedelta(seconds=1)
+        )
+
+    stats = jwt.stats()
+    for _ in range(3):
+        resp = client.get("/api/v1/jwt-check", headers=bearer(token))
+        assert resp.status_code == 200
+    assert jwt.stats()["misses"] == stats["misses"] + 1
+    assert jwt.stats()["hits"] == stats["hits"] + 2
+
+    # A tampered token isn't served from the cache
+    resp = client.get("/api/v1/jwt-check", headers=bearer(token[:-2] + "xx"))
+    assert resp.status_code == 422
+
+    # The revocation check runs on cached tokens
+    monkeypatch.setattr(jwt, "_token_in_blocklist_callback", lambda header, data: True)
+    resp = client.get("/api/v1/jwt-check", headers=bearer(token))
+    assert resp.status_code == 401
+    monkeypatch.undo()
+
+    # Cached tokens expire with the token
+    resp = client.get("/api/v1/jwt-check", headers=bearer(short_token))
+    assert resp.status_code == 200
+    time.sleep(1.1)
+    resp = client.get("/api/v1/jwt-check", headers=bearer(short_token))
+    assert resp.status_code == 401
+    assert resp.json["error"] == "Token has expired"
+
+
+def test_token_cache_hook(app, client, monkeypatch):
+    # The cache overrides a private method of flask_jwt_extended,
+    # this fails if an upgrade stops calling it.
+    calls = []
+    decode = jwt._decode_jwt_from_config
+
+    def spy(*args, **kwargs):
+        calls.append(args[0])
+        return decode(*args, **kwargs)
+
+    monkeypatch.setattr(jwt, "_decode_jwt_from_config", spy)
+    with app.test_request_context():
+        user = User.query.filter_by(email=users["user"]["email"]).one()
+        token = create_access_token(identity=user.id)
+        assert decode_token(token)["sub"] == user.id
+
+    resp = client.get("/api/v1/jwt-check", headers=bearer(token))
+    assert resp.status_code == 200
+    assert calls == [token, token]
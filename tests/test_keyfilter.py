@@ -0,0 +1,99 @@
+import json
+
+from sqlalchemy import event
+
+from app import create_app, db
+from app.libs.keyfilter import BloomFilter, key_filter
+from app.models import User
+
+from .conftest import users
+
+headers_admin = {
+    "Authorization": f'Bearer {users["admin"]["api_key"]}',
+    "Content-Type": "application/json",
+}
+
+
+def test_bloom_filter():
+    bloom_filter = BloomFilter(capacity=1000, error_rate=0.01)
+    for n in range(1000):
+        bloom_filter.add(f"key-{n}")
+
+    assert all(f"key-{n}" in bloom_filter for n in range(1000))
+    false_positives = sum(f"other-{n}" in bloom_filter for n in range(10000))
+    assert false_positives < 300
+    assert 0.005 < bloom_filter.stats()["estimated_false_positive_rate"] < 0.02
+
+
+def test_negative_cache(app, client):
+    headers = {"Authorization": "Bearer unknown-key"}
+    assert client.get("/api/v1/check", headers=headers).status_code == 403
+
+    # The rejected key is now refused without touching the database
+    with app.app_context():
+        statements = []
+        event.listen(
+            db.engine,
+            "before_cursor_execute",
+            lambda *args: statements.append(args[2]),
+        )
+        assert client.get("/api/v1/check", headers=headers).status_code == 403
+        assert statements == []
+
+    # Setting the key as a custom key lifts the rejection
+    resp = client.post(
+        "/api/v1/users",
+        headers=headers_admin,
+        data=json.dumps(
+            {
+                "first_name": "json",
+                "last_name": "derulo",
+                "email": "user1@pytest.local",
+                "api_key": "unknown-key",
+            }
+        ),
+    )
+    assert resp.status_code == 201
+    assert client.get("/api/v1/check", headers=headers).status_code == 200
+
+
+def test_bloom_filter_auth():
+    app = create_app(
+        database_uri="sqlite://",
+        config={"KEY_FILTER_BLOOM_FILTER": True, "KEY_FILTER_NEGATIVE_CACHE_TTL": 0},
+    )
+    client = app.test_client()
+    headers = {"Authorization": "Bearer superuser"}
+
+    # Keys loaded at startup
+    assert client.get("/api/v1/check", headers=headers).status_code == 200
+
+    # Keys created afterwards
+    resp = client.post(
+        "/api/v1/users",
+        headers=headers,
+        data=json.dumps(
+            {"first_name": "json", "last_name": "derulo", "email": "user1@pytest.local"}
+        ),
+        content_type="application/json",
+    )
+    new_headers = {"Authorization": f'Bearer {resp.json["api_key"]}'}
+    assert client.get("/api/v1/check", headers=new_headers).status_code == 200
+
+    with app.app_context():
+        user = User.query.filter_by(email="user1@pytest.local").first()
+        user.set_api_key("custom-key")
+        db.session.commit()
+    resp = client.get("/api/v1/check", headers={"Authorization": "Bearer custom-key"})
+    assert resp.status_code == 200
+
+    # Unknown keys never reach the database
+    rejected = key_filter.stats()["bloom_filter"]["rejected"]
+    resp = client.get("/api/v1/check", headers={"Authorization": "Bearer unknown"})
+    assert resp.status_code == 403
+    assert key_filter.stats()["bloom_filter"]["rejected"] > rejected
+
+    resp = client.get("/api/v1/metrics", headers=headers)
+    assert resp.status_code == 200
+    assert resp.json["key_filter"]["bloom_filter"]["items"] >= 3
+    assert "rate_limit" in resp.json
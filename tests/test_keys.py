@@ -0,0 +1,67 @@
+import pytest
+
+from app import check_secrets, db, get_settings
+from app.libs.keyfilter import key_filter
+from app.libs.keys import hash_api_key, legacy_hash_api_key, verify_api_key
+from app.models import User
+
+
+def test_keyed_digests(app):
+    assert hash_api_key("key") == hash_api_key("key")
+    assert hash_api_key("key") != legacy_hash_api_key("key")
+    assert verify_api_key("key", hash_api_key("key"))
+    assert not verify_api_key("other-key", hash_api_key("key"))
+
+    with app.app_context():
+        # Users created without a key get a random digest
+        user = User(email="nokey@pytest.local")
+        db.session.add(user)
+        db.session.commit()
+        assert len(user.hashed_api_key) == 64
+        assert not user.check_api_key("")
+
+
+def test_legacy_digest_upgrade(app, client):
+    with app.app_context():
+        user = User.query.filter_by(email="user@local").first()
+        user.hashed_api_key = legacy_hash_api_key("legacy-key")
+        db.session.commit()
+
+    # On by default, the keys of the upgraded databases keep working
+    app.config["LEGACY_API_KEY_DIGESTS"] = False
+    resp = client.get("/api/v1/check", headers={"Authorization": "Bearer legacy-key"})
+    assert resp.status_code == 403
+
+    app.config["LEGACY_API_KEY_DIGESTS"] = get_settings()["general"][
+        "legacy_api_key_digests"
+    ]
+    key_filter.forget("legacy-key")
+    resp = client.get("/api/v1/check", headers={"Authorization": "Bearer legacy-key"})
+    assert resp.status_code == 200
+
+    with app.app_context():
+        user = User.query.filter_by(email="user@local").first()
+        assert user.hashed_api_key == hash_api_key("legacy-key")
+
+    resp = client.get("/api/v1/check", headers={"Authorization": "Bearer legacy-key"})
+    assert resp.status_code == 200
+
+
+def test_default_secrets_refused():
+    settings = {
+        **get_settings()["general"],
+        "debug": False,
+        "secret_key": "a secret",
+        "api_key_secret": "another secret",
+        "superuser_api_key": "",
+    }
+    check_secrets(settings)
+    check_secrets({**settings, "debug": True, "secret_key": "dev-env"})
+    check_secrets({**settings, "superuser_api_key": "another key"})
+
+    with pytest.raises(RuntimeError, match="secret_key"):
+        check_secrets({**settings, "secret_key": "dev-env"})
+    with pytest.raises(RuntimeError, match="api_key_secret"):
+        check_secrets({**settings, "api_key_secret": "dev-env-api-keys"})
+    with pytest.raises(RuntimeError, match="superuser_api_key"):
+        check_secrets({**settings, "superuser_api_key": "superuser"})
@@ -0,0 +1,91 @@
+import pytest
+
+from app import create_app
+from app.libs.ratelimit import MemoryBucketStore, SharedBucketStore
+
+from .conftest import users
+
+
+@pytest.mark.parametrize("store_class", [MemoryBucketStore, SharedBucketStore])
+def test_bucket_stores(store_class):
+    store = store_class(max_buckets=2)
+    assert store.consume("a", rate=1, burst=2) == 0
+    assert store.consume("a", rate=1, burst=2) == 0
+    assert 0 < store.consume("a", rate=1, burst=2) <= 1
+    assert len(store) <= 2
+
+    # The memory is bounded, new keys evict or take over old buckets
+    for key in ("b", "c", "d"):
+        store.consume(key, rate=1, burst=2)
+    assert len(store) <= 2
+
+
+@pytest.mark.parametrize("backend", ["memory", "shared"])
+def test_rate_limited_routes(backend):
+    app = create_app(
+        database_uri="sqlite://",
+        config={
+            "RATE_LIMIT_BACKEND": backend,
+            "RATE_LIMIT_PER_KEY_RATE": 0.01,
+            "RATE_LIMIT_PER_KEY_BURST": 2,
+            "RATE_LIMIT_PER_ADDRESS_RATE": 0.01,
+            "RATE_LIMIT_PER_ADDRESS_BURST": 4,
+        },
+    )
+    client = app.test_client()
+    headers = {"Authorization": "Bearer superuser"}
+
+    # Per key limit
+    assert client.get("/api/v1/check", headers=headers).status_code == 200
+    assert client.get("/api/v1/check", headers=headers).status_code == 200
+    resp = client.get("/api/v1/check", headers=headers)
+    assert resp.status_code == 429
+    assert int(resp.headers["Retry-After"]) > 0
+
+    # Per address limit, even with unknown API keys
+    resp = client.get(
+        "/api/v1/check", headers={"Authorization": f"Bearer {users['user']['api_key']}"}
+    )
+    assert resp.status_code == 403
+    resp = client.get("/api/v1/check", headers={"Authorization": "Bearer other"})
+    assert resp.status_code == 429
+
+    # Other addresses are not affected
+    resp = client.get(
+        "/api/v1/check",
+        headers={"Authorization": "Bearer x", "X-Forwarded-For": "10.0.0.1"},
+    )
+    assert resp.status_code == 403
+
+
+def test_forwarded_address_from_trusted_proxies():
+    app = create_app(
+        database_uri="sqlite://",
+        config={
+            "RATE_LIMIT_PER_KEY_RATE": 0.01,
+            "RATE_LIMIT_PER_KEY_BURST": 100,
+            "RATE_LIMIT_PER_ADDRESS_RATE": 0.01,
+            "RATE_LIMIT_PER_ADDRESS_BURST": 2,
+            "TRUSTED_PROXIES": ["10.0.0.0/8"],
+        },
+    )
+    client = app.test_client()
+
+    def check(remote_addr, forwarded):
+        return client.get(
+            "/api/v1/check",
+            headers={"Authorization": "Bearer x", "X-Forwarded-For": forwarded},
+            environ_base={"REMOTE_ADDR": remote_addr},
+        ).status_code
+
+    # A client rotating the header doesn't get fresh buckets
+    assert check("192.0.2.1", "198.51.100.1") == 403
+    assert check("192.0.2.1", "198.51.100.2") == 403
+    assert check("192.0.2.1", "198.51.100.3") == 429
+
+    # Behind the trusted proxies, the client is the last untrusted address,
+    # whatever it sent itself
+    assert check("10.0.0.1", "192.0.2.1, 198.51.100.1, 10.0.0.2") == 403
+    assert check("10.0.0.1", "192.0.2.2, 198.51.100.1") == 403
+    assert check("10.0.0.3", "198.51.100.1") == 429
+    assert check("10.0.0.1", "198.51.100.4") == 403
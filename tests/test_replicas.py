@@ -0,0 +1,128 @@
+import json
+import multiprocessing
+import sqlite3
+
+import pytest
+
+from app import create_app, db
+from app.libs.replicas import StickyClients
+from app.models import User
+
+headers = {"Authorization": "Bearer superuser", "Content-Type": "application/json"}
+
+
+@pytest.fixture()
+def replicated_app(tmp_path):
+    app = create_app(
+        database_uri=f"sqlite:///{tmp_path}/primary.db",
+        config={
+            "REPLICAS_URIS": [f"sqlite:///{tmp_path}/replica.db"],
+            "REPLICAS_STICKY_SECONDS": 60,
+            "USAGE_FLUSH_INTERVAL": 0,
+            "RATE_LIMIT_ENABLED": False,
+            "KEY_FILTER_NEGATIVE_CACHE_TTL": 0,
+            # The replication is invisible to the response cache
+            "RESPONSE_CACHE_ENABLED": False,
+        },
+    )
+    app.replicate = lambda: replicate(tmp_path)
+    app.replicate()
+    return app
+
+
+def replicate(path):
+    # Stand-in for the replication tool
+    with sqlite3.connect(path / "primary.db") as primary:
+        with sqlite3.connect(path / "replica.db") as replica:
+            primary.backup(replica)
+
+
+def test_reads_from_replica(replicated_app):
+    client = replicated_app.test_client()
+    with replicated_app.app_context():
+        db.session.add(User(email="unreplicated@pytest.local"))
+        db.session.commit()
+
+    resp = client.get("/api/v1/users?email_domain=pytest.local", headers=headers)
+    assert resp.json["total_items"] == 0
+
+    replicated_app.replicate()
+    resp = client.get("/api/v1/users?email_domain=pytest.local", headers=headers)
+    assert resp.json["total_items"] == 1
+
+    stats = client.get("/api/v1/metrics", headers=headers).json["replicas"]
+    assert stats["replicas"] == 1 and stats["replica_reads"] > 0
+
+
+def test_read_your_writes(replicated_app):
+    client = replicated_app.test_client()
+    resp = client.post(
+        "/api/v1/users",
+        headers=headers,
+        data=json.dumps(
+            {"first_name": "json", "last_name": "derulo", "email": "user1@pytest.local"}
+        ),
+    )
+    assert resp.status_code == 201
+    user_id, api_key = resp.json["id"], resp.json["api_key"]
+
+    # The writing client reads from the primary
+    resp = client.get(f"/api/v1/users/{user_id}", headers=headers)
+    assert resp.status_code == 200
+
+    # The keys are looked up in the primary
+    resp = client.get("/api/v1/check", headers={"Authorization": f"Bearer {api_key}"})
+    assert resp.status_code == 200
+
+    # Other clients read from the replica until it catches up
+    with replicated_app.app_context():
+        new_admin = User(email="admin@pytest.local", is_admin=True)
+        new_admin.set_api_key("other_admin_key")
+        db.session.add(new_admin)
+        db.session.commit()
+    replicated_app.replicate()
+    with replicated_app.app_context():
+        db.session.delete(User.query.get(user_id))
+        db.session.commit()
+
+    other_headers = {"Authorization": "Bearer other_admin_key"}
+    resp = client.get(f"/api/v1/users/{user_id}", headers=other_headers)
+    assert resp.status_code == 200
+    resp = client.get(f"/api/v1/users/{user_id}", headers=headers)
+    assert resp.status_code == 404
+
+
+def test_auth_reads_from_primary(replicated_app):
+    client = replicated_app.test_client()
+    with replicated_app.app_context():
+        user = User(email="revoked@pytest.local", is_admin=True)
+        user.set_api_key("revoked_key")
+        db.session.add(user)
+        db.session.commit()
+    replicated_app.replicate()
+
+    revoked_headers = {"Authorization": "Bearer revoked_key"}
+    assert client.get("/api/v1/users", headers=revoked_headers).status_code == 200
+
+    # Deactivated on the primary, the replica still has the active user
+    with replicated_app.app_context():
+        User.query.filter_by(email="revoked@pytest.local").one().is_active = False
+        db.session.commit()
+    assert client.get("/api/v1/users", headers=revoked_headers).status_code == 403
+    assert client.get("/api/v1/check", headers=revoked_headers).status_code == 403
+
+
+def test_sticky_clients_across_workers():
+    sticky = StickyClients(16)
+    # A write served by another worker
+    worker = multiprocessing.get_context("fork").Process(
+        target=sticky.add, args=(b"writer" * 3, 60)
+    )
+    worker.start()
+    worker.join()
+    assert sticky.is_sticky(b"writer" * 3)
+    assert not sticky.is_sticky(b"reader" * 3)
+    assert len(sticky) == 1
+
+    sticky.add(b"expired" * 3, -1)
+    assert not sticky.is_sticky(b"expired" * 3)
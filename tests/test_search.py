@@ -0,0 +1,106 @@
+import json
+
+from app import create_app, db, models
+from app.models import User
+
+from .conftest import users
+
+headers_admin = {
+    "Authorization": f'Bearer {users["admin"]["api_key"]}',
+    "Content-Type": "application/json",
+}
+
+
+def test_user_search(client):
+    for first_name, last_name, email in [
+        ("Jason", "Derulo", "jason@music.local"),
+        ("Jay", "Z", "hova@music.local"),
+        ("Bruno", "Mars", "bruno@pytest.local"),
+    ]:
+        resp = client.post(
+            "/api/v1/users",
+            headers=headers_admin,
+            data=json.dumps(
+                {"first_name": first_name, "last_name": last_name, "email": email}
+            ),
+        )
+        assert resp.status_code == 201
+
+    # Substring match on names and emails, case insensitive
+    resp = client.get("/api/v1/users/search?q=DERU", headers=headers_admin)
+    assert resp.status_code == 200
+    assert [user["email"] for user in resp.json["users"]] == ["jason@music.local"]
+
+    resp = client.get("/api/v1/users/search?q=music", headers=headers_admin)
+    assert {user["email"] for user in resp.json["users"]} == {
+        "jason@music.local",
+        "hova@music.local",
+    }
+
+    # All terms must match
+    resp = client.get("/api/v1/users/search?q=music jas", headers=headers_admin)
+    assert [user["first_name"] for user in resp.json["users"]] == ["Jason"]
+
+    # FTS5 query syntax is not interpreted
+    resp = client.get('/api/v1/users/search?q=mars" AND "jay', headers=headers_admin)
+    assert resp.status_code == 200
+    assert resp.json["users"] == []
+
+    # The index follows updates and deletes
+    user_id = client.get("/api/v1/users/search?q=bruno", headers=headers_admin).json[
+        "users"
+    ][0]["id"]
+    client.patch(
+        f"/api/v1/users/{user_id}",
+        headers=headers_admin,
+        data=json.dumps({"last_name": "Venus"}),
+    )
+    resp = client.get("/api/v1/users/search?q=mars", headers=headers_admin)
+    assert resp.json["users"] == []
+    resp = client.get("/api/v1/users/search?q=venus", headers=headers_admin)
+    assert [user["id"] for user in resp.json["users"]] == [user_id]
+
+    client.delete(f"/api/v1/users/{user_id}", headers=headers_admin)
+    resp = client.get("/api/v1/users/search?q=venus", headers=headers_admin)
+    assert resp.json["users"] == []
+
+    # Pagination
+    resp = client.get("/api/v1/users/search?q=music&per_page=1", headers=headers_admin)
+    assert len(resp.json["users"]) == 1
+    resp = client.get(resp.json["next_page"], headers=headers_admin)
+    assert len(resp.json["users"]) == 1
+    assert resp.json["next_page"] is None
+
+    # Short terms can't use the trigram index
+    resp = client.get("/api/v1/users/search?q=ja", headers=headers_admin)
+    assert resp.status_code == 400
+
+
+def test_search_without_index(monkeypatch):
+    # SQLite without FTS5 or older than 3.34
+    monkeypatch.setattr(models, "search_index_supported", lambda: False)
+    app = create_app(database_uri="sqlite://", config={"RATE_LIMIT_ENABLED": False})
+    with app.app_context():
+        assert not db.session.execute(
+            db.text("SELECT 1 FROM sqlite_master WHERE name = 'users_fts'")
+        ).first()
+        for first_name, email in [
+            ("Jason", "jason@music.local"),
+            ("Jay", "100%@z.local"),
+        ]:
+            db.session.add(User(first_name=first_name, email=email))
+        admin = User(email="admin@pytest.local", is_admin=True)
+        api_key = admin.gen_api_key()
+        db.session.add(admin)
+        db.session.commit()
+
+    client = app.test_client()
+    headers = {"Authorization": f"Bearer {api_key}"}
+    resp = client.get("/api/v1/users/search?q=MUSIC jas", headers=headers)
+    assert [user["email"] for user in resp.json["users"]] == ["jason@music.local"]
+
+    # LIKE wildcards in the terms match literally
+    resp = client.get("/api/v1/users/search?q=0%25@", headers=headers)
+    assert [user["email"] for user in resp.json["users"]] == ["100%@z.local"]
+    resp = client.get("/api/v1/users/search?q=a_o", headers=headers)
+    assert resp.json["users"] == []
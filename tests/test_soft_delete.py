@@ -0,0 +1,240 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import create_app, db
+from app.libs.purger import parse_window, purger
+from app.models import ApiKey, Lease, User, count_users
+
+from .conftest import users
+
+headers_admin = {
+    "Authorization": f'Bearer {users["admin"]["api_key"]}',
+    "Content-Type": "application/json",
+}
+headers_user = {"Authorization": f'Bearer {users["user"]["api_key"]}'}
+
+
+def user_id(app, email):
+    with app.app_context():
+        return db.session.execute(
+            db.select(User.id).where(User.email == email)
+        ).scalar_one()
+
+
+def test_soft_delete(app, client):
+    deleted_id = user_id(app, users["user"]["email"])
+    with app.app_context():
+        assert count_users() == 3
+
+    resp = client.post(f"/api/v1/users/{deleted_id}/api-keys", headers=headers_admin)
+    key_id = resp.json["key_id"]
+    resp = client.delete(f"/api/v1/users/{deleted_id}", headers=headers_admin)
+    assert resp.status_code == 200
+
+    # Hidden right away, its API key stops working
+    assert client.get("/api/v1/check", headers=headers_user).status_code == 403
+    resp = client.get(f"/api/v1/users/{deleted_id}", headers=headers_admin)
+    assert resp.status_code == 404
+    resp = client.delete(f"/api/v1/users/{deleted_id}", headers=headers_admin)
+    assert resp.status_code == 404
+    resp = client.delete(
+        f"/api/v1/users/{deleted_id}/api-keys/{key_id}", headers=headers_admin
+    )
+    assert resp.status_code == 404
+
+    resp = client.get("/api/v1/users", headers=headers_admin)
+    assert deleted_id not in [user["id"] for user in resp.json["users"]]
+    assert resp.json["total_items"] == 2
+    resp = client.get("/api/v1/users?exact=true", headers=headers_admin)
+    assert resp.json["total_items"] == 2
+    resp = client.get("/api/v1/users/search?q=user@local", headers=headers_admin)
+    assert deleted_id not in [user["id"] for user in resp.json["users"]]
+
+    with app.app_context():
+        user = db.session.get(User, deleted_id)
+        assert user.deleted_at is not None
+        assert ApiKey.query.filter_by(user_id=deleted_id).count() == 1
+
+    assert purger.purge() == 1
+    with app.app_context():
+        assert db.session.get(User, deleted_id) is None
+        assert ApiKey.query.filter_by(user_id=deleted_id).count() == 0
+        assert count_users() == 2
+    assert purger.purge() == 0
+
+
+def test_soft_deleted_email_reuse(app, client):
+    email = "reused@pytest.local"
+    new_user = {"first_name": "new", "last_name": "user", "email": email}
+    resp = client.post(
+        "/api/v1/users", headers=headers_admin, data=json.dumps(new_user)
+    )
+    client.delete(f"/api/v1/users/{resp.json['id']}", headers=headers_admin)
+
+    resp = client.post(
+        "/api/v1/users", headers=headers_admin, data=json.dumps(new_user)
+    )
+    assert resp.status_code == 201
+    client.delete(f"/api/v1/users/{resp.json['id']}", headers=headers_admin)
+
+    resp = client.post(
+        "/api/v1/users/bulk",
+        headers=headers_admin,
+        data=json.dumps({"users": [{**new_user, "first_name": "bulk"}]}),
+    )
+    assert resp.status_code == 201
+    client.delete(f"/api/v1/users/{user_id(app, email)}", headers=headers_admin)
+
+    admin_id = user_id(app, users["admin"]["email"])
+    resp = client.patch(
+        f"/api/v1/users/{admin_id}",
+        headers=headers_admin,
+        data=json.dumps({"email": email}),
+    )
+    assert resp.status_code == 200
+    with app.app_context():
+        assert User.query.filter_by(email=email).one().id == admin_id
+
+
+def test_hard_delete():
+    app = create_app(
+        database_uri="sqlite://",
+        config={"RATE_LIMIT_ENABLED": False, "SOFT_DELETE_ENABLED": False},
+    )
+    client = app.test_client()
+    with app.app_context():
+        user = User(email="hard@delete.local")
+        db.session.add(user)
+        db.session.commit()
+        deleted_id = user.id
+
+    resp = client.delete(
+        f"/api/v1/users/{deleted_id}", headers={"Authorization": "Bearer superuser"}
+    )
+    assert resp.status_code == 200
+    with app.app_context():
+        assert db.session.get(User, deleted_id) is None
+
+
+def test_list_uses_partial_index(app):
+    with app.app_context():
+        select = db.select(User.id).where(User.deleted_at.is_(None))
+        plan = db.session.execute(
+            db.text(
+                "EXPLAIN QUERY PLAN "
+                + str(
+                    select.order_by(User.created_at).compile(
+                        compile_kwargs={"literal_binds": True}
+                    )
+                )
+            )
+        ).all()
+        assert any("ix_users_created_at" in row[-1] for row in plan), plan
+
+
+def test_ensure_soft_delete(tmp_path):
+    uri = f"sqlite:///{tmp_path}/old.db"
+    app = create_app(database_uri=uri, config={"RATE_LIMIT_ENABLED": False})
+    with app.app_context():
+        # A database created before soft delete
+        for index in User.__table__.indexes:
+            if index.dialect_options["sqlite"]["where"] is not None:
+                db.session.execute(db.text(f"DROP INDEX {index.name}"))
+        for statement in (
+            "DROP TRIGGER users_count_insert",
+            "CREATE TRIGGER users_count_insert AFTER INSERT ON users BEGIN "
+            "UPDATE table_counters SET row_count = row_count + 1 "
+            "WHERE name = 'users'; END",
+            # Miscounted by the previous trigger
+            "UPDATE table_counters SET row_count = row_count + 1",
+            "DROP TRIGGER users_count_delete_live",
+            "DROP TRIGGER users_count_soft_delete",
+            "CREATE TRIGGER users_count_delete AFTER DELETE ON users BEGIN "
+            "UPDATE table_counters SET row_count = row_count - 1 "
+            "WHERE name = 'users'; END",
+            "CREATE INDEX ix_users_created_at ON users (created_at)",
+            "ALTER TABLE users DROP COLUMN deleted_at",
+        ):
+            db.session.execute(db.text(statement))
+        db.session.commit()
+
+    app = create_app(database_uri=uri, config={"RATE_LIMIT_ENABLED": False})
+    with app.app_context():
+        columns = db.inspect(db.engine).get_columns("users")
+        assert "deleted_at" in [column["name"] for column in columns]
+        index = db.session.execute(
+            db.text("SELECT sql FROM sqlite_master WHERE name = 'ix_users_created_at'")
+        ).scalar_one()
+        assert "deleted_at IS NULL" in index
+        triggers = db.session.execute(
+            db.text("SELECT name FROM sqlite_master WHERE type = 'trigger'")
+        ).scalars()
+        assert "users_count_soft_delete" in triggers
+        live = User.query.filter(User.deleted_at.is_(None)).count()
+        assert count_users() == live
+        db.session.add(User(email="deleted@pytest.local", deleted_at=datetime.utcnow()))
+        db.session.commit()
+        assert count_users() == live
+    client = app.test_client()
+    assert (
+        client.get("/api/v1/check", headers={"Authorization": "Bearer superuser"})
+    ).status_code == 200
+
+
+def test_purge_window():
+    assert parse_window("") is None
+    assert parse_window("02:00-05:30") == (120, 330)
+    with pytest.raises(ValueError):
+        parse_window("2am-5am")
+
+    purger.window = parse_window("22:00-04:00")
+    try:
+        assert purger.in_window(datetime(2024, 1, 1, 23, 0))
+        assert purger.in_window(datetime(2024, 1, 1, 3, 59))
+        assert not purger.in_window(datetime(2024, 1, 1, 4, 0))
+        assert not purger.in_window(datetime(2024, 1, 1, 12, 0))
+    finally:
+        purger.window = None
+
+
+def test_purge_lease(app, monkeypatch):
+    def lease():
+        return db.session.get(Lease, "purger", populate_existing=True)
+
+    monkeypatch.setattr(purger, "lease", 60)
+    with app.app_context():
+        # Another process holds the lease
+        db.session.add(
+            Lease(
+                name="purger",
+                owner="other",
+                expires_at=datetime.utcnow() + timedelta(seconds=60),
+            )
+        )
+        db.session.commit()
+        assert not purger.claim()
+
+        # Renewed and released by its owner only
+        purger._renew()
+        purger.release()
+        assert lease().owner == "other"
+
+        # The command doesn't run meanwhile
+        result = app.test_cli_runner().invoke(args=["purge-deleted-users"])
+        assert result.exit_code == 1
+        assert "being purged by a worker" in result.output
+
+        # Expired, killed or stuck worker
+        lease().expires_at = datetime.utcnow() - timedelta(seconds=1)
+        db.session.commit()
+        assert purger.claim()
+        assert lease().owner == purger.owner
+        assert lease().expires_at > datetime.utcnow() + timedelta(seconds=50)
+        purger.release()
+        assert lease() is None
+
+        result = app.test_cli_runner().invoke(args=["purge-deleted-users"])
+        assert result.exit_code == 0
+        assert lease() is None
@@ -0,0 +1,27 @@
+from app import create_app, db, get_settings
+from app.models import User
+
+
+def test_settings_are_loaded_once():
+    assert get_settings() is get_settings()
+    assert get_settings()["general"]["create_schema"] in (True, False)
+
+
+def test_skip_startup_database_work():
+    app = create_app(
+        database_uri="sqlite://",
+        config={"CREATE_SCHEMA": False, "BOOTSTRAP_SUPERUSER": False},
+    )
+    with app.app_context():
+        assert not db.inspect(db.engine).has_table("users")
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=["init-db"])
+    assert result.exit_code == 0
+    result = runner.invoke(args=["create-superuser"])
+    assert "has been created" in result.output
+    result = runner.invoke(args=["create-superuser"])
+    assert "nothing to do" in result.output
+
+    with app.app_context():
+        assert User.query.count() == 1
@@ -0,0 +1,106 @@
+import json
+import uuid
+from datetime import datetime
+
+import pytest
+
+from app import create_app, db
+from app.models import (
+    HexDigest,
+    User,
+    UUIDString,
+    check_storage_mode,
+    copy_database,
+    count_users,
+)
+
+from .conftest import users
+
+headers_admin = {
+    "Authorization": f'Bearer {users["admin"]["api_key"]}',
+    "Content-Type": "application/json",
+}
+
+
+@pytest.fixture()
+def compact_app():
+    return create_app(database_uri="sqlite://", config={"COMPACT_STORAGE": True})
+
+
+def test_compact_storage(compact_app):
+    client = compact_app.test_client()
+    headers = {"Authorization": "Bearer superuser"}
+
+    with compact_app.app_context():
+        user = User.query.first()
+        raw = db.session.execute(db.text("SELECT id, hashed_api_key FROM users"))
+        raw_id, raw_digest = raw.first()
+        assert len(raw_id) == 16 and len(raw_digest) == 32
+        assert user.id == str(user.id) and len(user.hashed_api_key) == 64
+
+    resp = client.post(
+        "/api/v1/users",
+        headers=headers,
+        data=json.dumps(
+            {"first_name": "json", "last_name": "derulo", "email": "c@pytest.local"}
+        ),
+        content_type="application/json",
+    )
+    assert resp.status_code == 201
+    user_id, api_key = resp.json["id"], resp.json["api_key"]
+
+    resp = client.get(f"/api/v1/users/{user_id}", headers=headers)
+    assert resp.json["id"] == user_id
+
+    resp = client.get("/api/v1/check", headers={"Authorization": f"Bearer {api_key}"})
+    assert resp.status_code == 200
+
+    # Invalid ids can't be converted to bytes, they never match
+    resp = client.get("/api/v1/users/not-a-uuid", headers=headers)
+    assert resp.status_code == 404
+
+
+def test_migrate_storage(app, tmp_path):
+    target_uri = f"sqlite:///{tmp_path}/compact.db"
+    with app.app_context():
+        expected = {user.id: user.hashed_api_key for user in User.query.all()}
+        # Soft deleted users are copied, not counted
+        User.query.filter_by(
+            email=users["user"]["email"]
+        ).one().deleted_at = datetime.utcnow()
+        db.session.commit()
+        copy_database(target_uri, compact=True)
+
+    # Opening the new database in text mode must fail
+    with pytest.raises(RuntimeError):
+        create_app(database_uri=target_uri)
+
+    compact_app = create_app(database_uri=target_uri, config={"COMPACT_STORAGE": True})
+    with compact_app.app_context():
+        check_storage_mode()
+        assert {user.id: user.hashed_api_key for user in User.query.all()} == expected
+        assert count_users() == len(expected) - 1
+
+    client = compact_app.test_client()
+    resp = client.get("/api/v1/users/search?q=admin", headers=headers_admin)
+    assert [user["email"] for user in resp.json["users"]] == ["admin@local"]
+
+
+def test_compact_conversions():
+    compact = type("Dialect", (), {"compact_storage": True})()
+    text = type("Dialect", (), {"compact_storage": False})()
+    user_id, digest = str(uuid.uuid4()), "ab" * 32
+
+    for column_type, value, size in (
+        (UUIDString(), user_id, 16),
+        (HexDigest(), digest, 32),
+    ):
+        stored = column_type.process_bind_param(value, compact)
+        assert len(stored) == size
+        assert column_type.process_result_value(stored, compact) == value
+        assert column_type.process_bind_param(value, text) == value
+        # Rows written in text mode are read as is
+        assert column_type.process_result_value(value, compact) == value
+
+    # Invalid values are stored as text, they never match a valid one
+    assert UUIDString().process_bind_param("unknown", compact) == b"unknown"
@@ -0,0 +1,144 @@
+import json
+
+from sqlalchemy import event
+
+from app import db
+from app.libs.schema import Boolean, Email, Schema, String
+
+from .conftest import users
+
+headers_admin = {
+    "Authorization": f'Bearer {users["admin"]["api_key"]}',
+    "Content-Type": "application/json",
+}
+
+
+def test_schema():
+    schema = Schema(
+        name=String(required=True, max_length=5),
+        email=Email(required=True),
+        is_admin=Boolean(),
+    )
+    values, errors = schema.validate(
+        {"name": "derulo", "email": "json@pytest.local", "is_admin": "yes", "x": 1}
+    )
+    assert values == {"email": "json@pytest.local"}
+    assert errors == {
+        "name": "Must be at most 5 characters",
+        "is_admin": "Must be true or false",
+    }
+
+    assert schema.validate({"email": "json"})[1] == {
+        "name": "Missing required parameter",
+        "email": "Invalid email format",
+    }
+    assert schema.validate({"name": ""}, partial=True)[1] == {
+        "name": "Must not be empty"
+    }
+    assert schema.validate([])[1] == {"payload": "Expected a JSON object"}
+
+    values, errors = schema.validate_many(
+        [{"name": "json", "email": "json@pytest.local"}, {"name": 1}]
+    )
+    assert len(values) == 2
+    assert set(errors) == {1}
+
+
+def test_create_user_errors(client):
+    resp = client.post(
+        "/api/v1/users",
+        headers=headers_admin,
+        data=json.dumps({"first_name": "json", "email": "json", "is_admin": 1}),
+    )
+    assert resp.status_code == 400
+    assert resp.json["error"] == "Missing required parameters"
+    assert resp.json["errors"] == {
+        "last_name": "Missing required parameter",
+        "email": "Invalid email format",
+        "is_admin": "Must be true or false",
+    }
+
+
+def test_modify_user_skips_unchanged_email(app, client):
+    resp = client.get("/api/v1/users?email=user@local", headers=headers_admin)
+    user = resp.json["users"][0]
+
+    with app.app_context():
+        statements = []
+        event.listen(
+            db.engine,
+            "before_cursor_execute",
+            lambda *args: statements.append(args[2]),
+        )
+        resp = client.patch(
+            f'/api/v1/users/{user["id"]}',
+            headers=headers_admin,
+            data=json.dumps({"email": user["email"], "first_name": "Jay"}),
+        )
+        assert resp.status_code == 200
+        # Auth lookup, user lookup and the update only
+        assert not any("users.email = ?" in statement for statement in statements)
+
+    resp = client.patch(
+        f'/api/v1/users/{user["id"]}',
+        headers=headers_admin,
+        data=json.dumps({"first_name": ""}),
+    )
+    assert resp.status_code == 400
+    assert resp.json["errors"] == {"first_name": "Must not be empty"}
+
+
+def test_bulk_create_users(client):
+    resp = client.post(
+        "/api/v1/users",
+        headers=headers_admin,
+        data=json.dumps(
+            {"first_name": "json", "last_name": "derulo", "email": "taken@pytest.local"}
+        ),
+    )
+    assert resp.status_code == 201
+
+    new_users = [
+        {"first_name": "json", "last_name": "derulo", "email": f"bulk{n}@pytest.local"}
+        for n in range(3)
+    ]
+    resp = client.post(
+        "/api/v1/users/bulk",
+        headers=headers_admin,
+        data=json.dumps(
+            {
+                "users": new_users
+                + [
+                    {**new_users[0], "first_name": ""},
+                    {**new_users[0], "email": "taken@pytest.local"},
+                    {**new_users[0], "email": "bulk0@pytest.local"},
+                    {**new_users[1], "email": "bulk9@pytest.local", "api_key": "sk_1"},
+                ]
+            }
+        ),
+    )
+    assert resp.status_code == 400
+    assert resp.json["errors"] == {
+        "0": {"email": "Email already exists"},
+        "3": {"first_name": "Must not be empty", "email": "Email already exists"},
+        "4": {"email": "Email already exists"},
+        "5": {"email": "Email already exists"},
+    }
+
+    resp = client.post(
+        "/api/v1/users/bulk",
+        headers=headers_admin,
+        data=json.dumps({"users": new_users}),
+    )
+    assert resp.status_code == 201
+    assert [user["email"] for user in resp.json["users"]] == [
+        user["email"] for user in new_users
+    ]
+    api_key = resp.json["users"][2]["api_key"]
+    resp = client.get("/api/v1/check", headers={"Authorization": f"Bearer {api_key}"})
+    assert resp.status_code == 200
+
+    resp = client.post(
+        "/api/v1/users/bulk", headers=headers_admin, data=json.dumps({"users": []})
+    )
+    assert resp.status_code == 400
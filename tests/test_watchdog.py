@@ -0,0 +1,50 @@
+from types import SimpleNamespace
+
+from app import create_app
+from app.libs.watchdog import MemoryWatchdog, current_rss
+
+
+def fake_worker(**kwargs):
+    return SimpleNamespace(
+        **{"pid": 1234, "alive": True, "nr": 0, "max_requests": 0, **kwargs}
+    )
+
+
+def test_current_rss():
+    assert 10 * 2**20 < current_rss() < 2**32
+
+
+def test_memory_recycling():
+    watchdog = MemoryWatchdog()
+    watchdog.init_app(
+        create_app(config={"WORKERS_MAX_RSS_MB": 1, "WORKERS_RSS_CHECK_EVERY": 3})
+    )
+    worker = fake_worker()
+
+    # Sampled every 3 requests
+    for _ in range(2):
+        watchdog.post_request(worker, None, None, None)
+    assert worker.alive
+    watchdog.post_request(worker, None, None, None)
+    assert not worker.alive
+
+    watchdog.worker_exit(None, worker)
+    stats = watchdog.stats()
+    assert stats["recycles"] == {"memory": 1, "max_requests": 0, "other": 0}
+    assert stats["last_recycle"]["pid"] == 1234
+    assert stats["last_recycle"]["rss"] > watchdog.max_rss
+
+
+def test_other_recycles():
+    watchdog = MemoryWatchdog()
+    watchdog.init_app(create_app(config={"WORKERS_MAX_RSS_MB": 0}))
+    assert watchdog.stats()["last_recycle"] is None
+
+    worker = fake_worker(nr=100, max_requests=100)
+    for _ in range(100):
+        watchdog.post_request(worker, None, None, None)
+    assert worker.alive
+
+    watchdog.worker_exit(None, worker)
+    watchdog.worker_exit(None, fake_worker())
+    assert watchdog.stats()["recycles"] == {"memory": 0, "max_requests": 1, "other": 1}